@@ -0,0 +1,129 @@
+"""
+Deterministic synthetic school data.
+
+The same seed and sizes always produce the same rows, table by table, so
+benchmark runs on different machines or commits load identical databases.
+Rows are generated lazily; nothing is held in memory beyond one batch.
+
+Usage::
+
+    python -m benchmarks.generate path/to/school.db --students 100000
+"""
+
+import argparse, random
+from school import db, services
+
+FIRST = ("Adam", "Bea", "Carl", "Dana", "Elie", "Fay", "Georges", "Hala", "Imad", "Jana",
+         "Karim", "Lea", "Marc", "Nour", "Omar", "Perla", "Rami", "Sara", "Tarek", "Yara")
+LAST = ("Haddad", "Khoury", "Nassar", "Saab", "Aoun", "Baroudy", "Abou Nader", "Frem",
+        "Gemayel", "Hajj", "Issa", "Jaber", "Karam", "Mansour", "Rizk", "Tannous")
+SUBJECTS = ("Algebra", "Biology", "Chemistry", "Databases", "Economics", "French", "Geometry",
+            "History", "Networks", "Physics", "Statistics", "Systems")
+
+
+class Dataset:
+    """
+    Seeded generator for students, instructors, courses and registrations.
+
+    :param students: Number of students.
+    :type students: int
+    :param instructors: Number of instructors; defaults to one per 100 students.
+    :type instructors: int
+    :param courses: Number of courses; defaults to one per 50 students.
+    :type courses: int
+    :param density: Average registrations per student.
+    :type density: float
+    :param unassigned: Share of courses without an instructor.
+    :type unassigned: float
+    :param seed: Random seed.
+    :type seed: int
+    """
+
+    def __init__(self, students, instructors=None, courses=None, density=3.0, unassigned=0.1, seed=0):
+        self.n_students = students
+        self.n_instructors = instructors if instructors is not None else max(1, students // 100)
+        self.n_courses = courses if courses is not None else max(1, students // 50)
+        self.density = density
+        self.unassigned = unassigned
+        self.seed = seed
+
+    def _rnd(self, table):
+        # one stream per table, so changing one size leaves the other tables alone
+        return random.Random(f"{self.seed}:{table}")
+
+    def _name(self, rnd):
+        return f"{rnd.choice(FIRST)} {rnd.choice(LAST)}"
+
+    def student_id(self, i):
+        return f"S{i:07d}"
+
+    def instructor_id(self, i):
+        return f"I{i:05d}"
+
+    def course_id(self, i):
+        return f"C{i:05d}"
+
+    def students(self):
+        rnd = self._rnd("students")
+        for i in range(self.n_students):
+            yield (self.student_id(i), self._name(rnd), rnd.randint(17, 30), f"student{i}@school.edu")
+
+    def instructors(self):
+        rnd = self._rnd("instructors")
+        for i in range(self.n_instructors):
+            yield (self.instructor_id(i), self._name(rnd), rnd.randint(25, 70), f"instructor{i}@school.edu")
+
+    def courses(self):
+        rnd = self._rnd("courses")
+        for i in range(self.n_courses):
+            teacher = None if rnd.random() < self.unassigned else self.instructor_id(rnd.randrange(self.n_instructors))
+            yield (self.course_id(i), f"{rnd.choice(SUBJECTS)} {100 + i}", teacher)
+
+    def registrations(self):
+        rnd = self._rnd("registrations")
+        whole, frac = int(self.density), self.density - int(self.density)
+        for i in range(self.n_students):
+            k = min(self.n_courses, whole + (rnd.random() < frac))
+            for c in sorted(rnd.sample(range(self.n_courses), k)):
+                yield (self.student_id(i), self.course_id(c))
+
+    def load(self, batch=10000):
+        """
+        Insert the dataset into the current database through the bulk services.
+
+        :param batch: Rows per bulk call.
+        :type batch: int
+        :return: Rows inserted per table
+        :rtype: dict
+        """
+        db.init_db()
+        counts = {}
+        for table, rows, bulk in (("instructors", self.instructors(), services.add_instructors_bulk),
+                                  ("courses", self.courses(), services.add_courses_bulk),
+                                  ("students", self.students(), services.add_students_bulk),
+                                  ("registrations", self.registrations(), services.register_bulk)):
+            counts[table] = 0
+            while True:
+                chunk = [r for _, r in zip(range(batch), rows)]
+                if not chunk:
+                    break
+                counts[table] += bulk(chunk)["inserted"]
+        return counts
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("path", help="database file to create or extend")
+    p.add_argument("--students", type=int, default=10000)
+    p.add_argument("--instructors", type=int)
+    p.add_argument("--courses", type=int)
+    p.add_argument("--density", type=float, default=3.0)
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args()
+    db.DB_PATH = args.path
+    ds = Dataset(args.students, args.instructors, args.courses, args.density, seed=args.seed)
+    print(ds.load())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+Concurrent load against one database file from several processes.
+
+A seeded dataset is loaded once, then N worker processes run a weighted mix
+of services calls against the same file for a fixed time, the way several
+clerks' machines share one school.db. Each worker reports its latencies,
+errors and the db lock statistics; the parent merges them into throughput,
+latency percentiles, lock-wait time and error rates per operation.
+
+Usage::
+
+    python -m benchmarks.load --workers 8 --duration 10
+    python -m benchmarks.load --mix register=1,edit=1 --busy-timeout 0 --retries 0
+    python -m benchmarks.load --journal delete --out load.json
+"""
+
+import argparse, json, multiprocessing, os, random, shutil, sqlite3, tempfile, time
+from school import db, services
+from benchmarks.generate import Dataset, FIRST, LAST
+
+DEFAULT_MIX = {"register": 3, "unregister": 2, "edit": 3, "search": 2}
+
+
+def parse_mix(text):
+    """
+    Parse ``name=weight,...`` into a dict of operation weights.
+
+    :rtype: dict
+    """
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"unknown operation {name!r}; choose from {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def _register(ds, rnd):
+    services.register(ds.student_id(rnd.randrange(ds.n_students)), ds.course_id(rnd.randrange(ds.n_courses)))
+
+
+def _unregister(ds, rnd):
+    services.unregister(ds.student_id(rnd.randrange(ds.n_students)), ds.course_id(rnd.randrange(ds.n_courses)))
+
+
+def _edit(ds, rnd):
+    i = rnd.randrange(ds.n_students)
+    services.edit_student(ds.student_id(i), f"{rnd.choice(FIRST)} {rnd.choice(LAST)}",
+                          rnd.randint(17, 30), f"student{i}@school.edu")
+
+
+def _search(ds, rnd):
+    services.query(rnd.choice(FIRST) if rnd.random() < 0.5 else rnd.choice(LAST))
+
+
+OPERATIONS = {"register": _register, "unregister": _unregister, "edit": _edit, "search": _search}
+
+
+def worker(n, path, ds, mix, duration, policy, journal, results):
+    """
+    Run the operation mix until ``duration`` seconds have passed and put this
+    worker's raw results on the ``results`` queue.
+    """
+    db.DB_PATH = path
+    db.configure(**policy)
+    if journal:
+        db.PRAGMAS = tuple((k, journal if k == "journal_mode" else v) for k, v in db.PRAGMAS)
+    rnd = random.Random(f"load:{n}")
+    names, weights = list(mix), list(mix.values())
+    latencies = {name: [] for name in names}
+    errors = {name: {} for name in names}
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        name = rnd.choices(names, weights)[0]
+        t = time.perf_counter()
+        try:
+            OPERATIONS[name](ds, rnd)
+        except Exception as ex:
+            kind = type(ex).__name__
+            errors[name][kind] = errors[name].get(kind, 0) + 1
+        else:
+            latencies[name].append(time.perf_counter() - t)
+    db.close_all()
+    results.put({"latencies": latencies, "errors": errors, "locks": db.lock_stats()})
+
+
+def percentile_ms(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))] * 1000
+
+
+def summarize(parts, duration):
+    """
+    Merge the worker results into one report.
+
+    :param parts: What each worker put on the results queue.
+    :type parts: list
+    :param duration: Wall-clock seconds the workers ran for.
+    :type duration: float
+    :rtype: dict
+    """
+    ops, total_ok, total_err = {}, 0, 0
+    for name in parts[0]["latencies"]:
+        lat = sorted(x for p in parts for x in p["latencies"][name])
+        errs = {}
+        for p in parts:
+            for kind, count in p["errors"][name].items():
+                errs[kind] = errs.get(kind, 0) + count
+        failed = sum(errs.values())
+        total_ok += len(lat)
+        total_err += failed
+        calls = len(lat) + failed
+        ops[name] = {
+            "calls": calls,
+            "ok": len(lat),
+            "per_s": calls / duration,
+            "error_rate": failed / calls if calls else 0.0,
+            "errors": errs,
+            "p50_ms": percentile_ms(lat, 50),
+            "p90_ms": percentile_ms(lat, 90),
+            "p99_ms": percentile_ms(lat, 99),
+            "max_ms": lat[-1] * 1000 if lat else None,
+        }
+    locks = {k: sum(p["locks"][k] for p in parts) for k in parts[0]["locks"]}
+    calls = total_ok + total_err
+    return {
+        "throughput": calls / duration,
+        "calls": calls,
+        "error_rate": total_err / calls if calls else 0.0,
+        "lock_wait_s": locks["wait"],
+        "lock_wait_per_write_ms": locks["wait"] / locks["acquired"] * 1000 if locks["acquired"] else 0.0,
+        "contended_share": locks["contended"] / locks["acquired"] if locks["acquired"] else 0.0,
+        "locks": locks,
+        "operations": ops,
+    }
+
+
+def run(workers=4, duration=5.0, mix=None, students=10000, seed=0, policy=None, journal=None, path=None):
+    """
+    Load a dataset, run the workers against it and return the report.
+
+    :param workers: Number of worker processes.
+    :type workers: int
+    :param duration: Seconds each worker runs for.
+    :type duration: float
+    :param mix: Operation weights; see ``OPERATIONS``.
+    :type mix: dict
+    :param policy: Keyword arguments for ``db.configure`` in every worker.
+    :type policy: dict
+    :param journal: journal_mode to use instead of the library default (e.g. "delete").
+    :type journal: str
+    :param path: Database file to use; a temp directory is used when omitted.
+    :type path: str
+    :rtype: dict
+    """
+    mix = mix or DEFAULT_MIX
+    policy = policy or {}
+    work = None if path else tempfile.mkdtemp(prefix="school-load-")
+    path = path or os.path.join(work, "school.db")
+    saved = db.DB_PATH
+    try:
+        db.close_all()
+        db.DB_PATH = path
+        ds = Dataset(students, seed=seed)
+        db.init_db()
+        if not db.count_students():
+            ds.load()
+        if journal:
+            db.get_conn().execute(f"PRAGMA journal_mode = {journal}")
+        db.close_all()
+
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Queue()
+        procs = [ctx.Process(target=worker, args=(n, path, ds, mix, duration, policy, journal, results))
+                 for n in range(workers)]
+        start = time.perf_counter()
+        for p in procs:
+            p.start()
+        parts = [results.get() for _ in procs]
+        elapsed = time.perf_counter() - start
+        for p in procs:
+            p.join()
+        report = summarize(parts, max(duration, 1e-9))
+        report["meta"] = {
+            "workers": workers, "duration": duration, "elapsed": elapsed, "mix": mix,
+            "students": students, "seed": seed, "journal": journal or dict(db.PRAGMAS)["journal_mode"],
+            "policy": {**db.configure(), **policy}, "sqlite": sqlite3.sqlite_version,
+        }
+        return report
+    finally:
+        db.close_all()
+        db.DB_PATH = saved
+        if work:
+            shutil.rmtree(work, ignore_errors=True)
+
+
+def print_report(report):
+    m = report["meta"]
+    print(f"{m['workers']} workers x {m['duration']:g} s, journal={m['journal']}, policy={m['policy']}")
+    print(f"throughput {report['throughput']:.0f} calls/s, errors {report['error_rate']:.2%}, "
+          f"lock wait {report['lock_wait_s']:.2f} s total, {report['lock_wait_per_write_ms']:.2f} ms per write, "
+          f"{report['contended_share']:.0%} of writes waited, {report['locks']['retries']} retries")
+    print(f"{'operation':<12}{'calls/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}  errors")
+    fmt = lambda v: f"{v:10.2f}" if v is not None else f"{'-':>10}"
+    for name, o in report["operations"].items():
+        errs = ", ".join(f"{k} {v}" for k, v in o["errors"].items()) or "-"
+        print(f"{name:<12}{o['per_s']:10.0f}{fmt(o['p50_ms'])}{fmt(o['p90_ms'])}{fmt(o['p99_ms'])}{fmt(o['max_ms'])}"
+              f"  {o['error_rate']:.2%} {errs}")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Run concurrent services calls from several processes.")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--duration", type=float, default=5.0, help="seconds per worker")
+    p.add_argument("--mix", default=",".join(f"{k}={v}" for k, v in DEFAULT_MIX.items()),
+                   help="operation weights, e.g. register=3,edit=1,search=2")
+    p.add_argument("--students", type=int, default=10000)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--db", help="use this database file instead of a temp copy (loaded if empty)")
+    p.add_argument("--journal", choices=("wal", "delete", "truncate"), help="override the journal mode")
+    p.add_argument("--busy-timeout", type=int, help="ms SQLite waits for a lock")
+    p.add_argument("--retries", type=int, help="retries after the busy timeout runs out")
+    p.add_argument("--backoff", type=float, help="first retry delay in seconds")
+    p.add_argument("--max-backoff", type=float)
+    p.add_argument("--out", help="write the report JSON here")
+    args = p.parse_args()
+
+    policy = {k: v for k, v in (("busy_timeout", args.busy_timeout), ("retries", args.retries),
+                                ("backoff", args.backoff), ("max_backoff", args.max_backoff)) if v is not None}
+    report = run(args.workers, args.duration, parse_mix(args.mix), args.students, args.seed,
+                 policy, args.journal, args.db)
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Benchmark the school package at several dataset sizes.
+
+Each scale loads a seeded synthetic database (see benchmarks.generate) into a
+temp directory and times the db, services and storage entry points against
+it. Results are written as JSON; with --baseline the run is compared against
+a saved result file and the exit status is 1 if any case regressed.
+
+Usage::
+
+    python -m benchmarks.run --scales 1000,10000 --out results.json
+    python -m benchmarks.run --scales 1000,10000 --baseline results.json
+    python -m benchmarks.run --compare new.json --baseline old.json
+"""
+
+import argparse, collections, json, os, platform, random, shutil, sqlite3, statistics, subprocess, sys, tempfile, time, tracemalloc
+from datetime import datetime, timezone
+from school import db, services, storage, csvio, binsnap
+from benchmarks.generate import Dataset
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+# streaming cases whose memory must stay flat as the data grows
+MEMORY_CASES = ("storage.export_json", "storage.import_json", "csvio.export_csv registrations",
+                "binsnap.write_snapshot")
+
+
+def measure(fn, repeat, setup=None, teardown=None):
+    """
+    Time ``fn`` ``repeat`` times; setup and teardown run outside the timed region.
+
+    :return: Minimum, median and all run times in seconds
+    :rtype: dict
+    """
+    times = []
+    for _ in range(repeat):
+        if setup: setup()
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+        if teardown: teardown()
+    return {"min": min(times), "median": statistics.median(times), "runs": times}
+
+
+def peak_memory(fn, setup=None, teardown=None):
+    """
+    Run ``fn`` once more, untimed, and record its memory peak.
+
+    ``traced_mb`` is the peak of Python allocations during the call (tracemalloc);
+    ``maxrss_mb`` is the process's peak resident size so far, so it only shows growth
+    when the case goes above everything that ran before it.
+
+    :return: Peak traced and resident memory in MB
+    :rtype: dict
+    """
+    if setup: setup()
+    tracemalloc.start()
+    try:
+        fn()
+        traced = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    if teardown: teardown()
+    out = {"traced_mb": traced / 2 ** 20}
+    if resource:
+        # kilobytes on Linux, bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        out["maxrss_mb"] = rss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+    return out
+
+
+def drain(it):
+    collections.deque(it, maxlen=0)
+
+
+def cases(ds, work):
+    """
+    Build the benchmark cases for a loaded dataset.
+
+    :param ds: The dataset loaded into the current database.
+    :type ds: Dataset
+    :param work: Scratch directory for output files.
+    :type work: str
+    :return: (name, fn, setup, teardown) tuples
+    :rtype: list
+    """
+    rnd = random.Random(1)
+    n, nc = ds.n_students, ds.n_courses
+    sample = [ds.student_id(rnd.randrange(n)) for _ in range(1000)]
+    ops = [(ds.student_id(rnd.randrange(n)), ds.course_id(rnd.randrange(nc))) for _ in range(100)]
+    out = lambda name: os.path.join(work, name)
+    source = db.DB_PATH
+
+    def fresh_db():
+        db.close_all()
+        db.DB_PATH = out("import.db")
+
+    def back_to_source():
+        db.close_all()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(out("import.db") + suffix):
+                os.remove(out("import.db") + suffix)
+        db.DB_PATH = source
+
+    def add_remove():
+        for i in range(100):
+            services.add_student(f"B{i}", "Bench", 20, "bench@school.edu")
+        for i in range(100):
+            services.remove_student(f"B{i}")
+
+    def edit():
+        for sid in sample[:100]:
+            services.edit_student(sid, "Edited", 21, "edited@school.edu")
+
+    def register_unregister():
+        for sid, cid in ops:
+            services.register(sid, cid)
+        for sid, cid in ops:
+            services.unregister(sid, cid)
+
+    def assign():
+        for _, cid in ops:
+            services.assign_instructor(cid, ds.instructor_id(0))
+
+    def cli(*args):
+        # a fresh interpreter each time: what a cron job pays per call
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.run([sys.executable, "-m", "school", "--db", source, *args], cwd=root,
+                       check=True, stdout=subprocess.DEVNULL)
+
+    bulk_rows = [(f"B{i:06d}", "Bulk", 20, "bulk@school.edu") for i in range(1000)]
+
+    def drop_bulk():
+        with db.transaction() as conn:
+            conn.execute("DELETE FROM students WHERE student_id LIKE 'B%'")
+        services.clear_cache()
+
+    return [
+        ("db.get_students", db.get_students, None, None),
+        ("db.get_courses", db.get_courses, None, None),
+        ("db.get_registrations", db.get_registrations, None, None),
+        ("db.get_students_page", lambda: db.get_students_page(ds.student_id(n // 2), 500), None, None),
+        ("db.iter_students", lambda: drain(db.iter_students()), None, None),
+        ("db.count_registrations", db.count_registrations, None, None),
+        ("db.get_student x1000", lambda: [db.get_student(s) for s in sample], None, None),
+        ("db.get_students_by_ids 1000", lambda: db.get_students_by_ids(sample), None, None),
+        ("db.existing_keys 1000", lambda: db.existing_keys("students", sample), None, None),
+        ("db.search name", lambda: db.search("Sara"), None, None),
+        ("db.search prefix", lambda: db.search("Ka"), None, None),
+        ("db.search id", lambda: db.search(ds.student_id(n // 3)), None, None),
+        ("services.snapshot cold", services.snapshot, services.clear_cache, None),
+        ("services.snapshot warm", services.snapshot, services.snapshot, None),
+        ("services.query cold", lambda: services.query("Nour Haddad"), services.clear_cache, None),
+        ("services.add_student+remove_student x100", add_remove, None, None),
+        ("services.edit_student x100", edit, None, None),
+        ("services.register+unregister x100", register_unregister, None, None),
+        ("services.assign_instructor x100", assign, None, None),
+        ("services.add_students_bulk 1000", lambda: services.add_students_bulk(bulk_rows), None, drop_bulk),
+        ("storage.export_json", lambda: storage.export_json(out("export.json")), None, None),
+        ("storage.import_json", lambda: storage.import_json(out("export.json")), fresh_db, back_to_source),
+        ("db.backup_db", lambda: db.backup_db(out("backup.db")), None, None),
+        ("csvio.export_csv registrations", lambda: csvio.export_csv("registrations", out("regs.csv")), None, None),
+        ("binsnap.write_snapshot", lambda: binsnap.write_snapshot(out("snap.bin")), None, None),
+        ("cli stats (cold start)", lambda: cli("stats"), None, None),
+        ("cli search (cold start)", lambda: cli("search", "Nour Haddad"), None, None),
+    ]
+
+
+def run(scales, repeat=3, seed=0, density=3.0, only=None):
+    """
+    Run every case at every scale.
+
+    :param scales: Student counts.
+    :type scales: list
+    :param only: Substring filter on case names.
+    :type only: str
+    :return: The results document
+    :rtype: dict
+    """
+    doc = {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "seed": seed,
+            "density": density,
+            "repeat": repeat,
+        },
+        "results": {},
+    }
+    saved_path = db.DB_PATH
+    for scale in scales:
+        work = tempfile.mkdtemp(prefix=f"school-bench-{scale}-")
+        try:
+            db.close_all()
+            db.DB_PATH = os.path.join(work, "school.db")
+            services.clear_cache()
+            ds = Dataset(scale, density=density, seed=seed)
+            load = measure(ds.load, 1)
+            results = doc["results"][str(scale)] = {"generate+load": load}
+            print(f"scale {scale:,}: loaded in {load['min']:.2f} s", file=sys.stderr)
+            for name, fn, setup, teardown in cases(ds, work):
+                if only and only not in name:
+                    continue
+                results[name] = measure(fn, repeat, setup, teardown)
+                line = f"  {name:<45}{results[name]['median'] * 1000:10.2f} ms"
+                if name in MEMORY_CASES:
+                    mem = results[name]["memory"] = peak_memory(fn, setup, teardown)
+                    line += f"{mem['traced_mb']:10.1f} MB peak"
+                print(line, file=sys.stderr)
+        finally:
+            db.close_all()
+            db.DB_PATH = saved_path
+            shutil.rmtree(work, ignore_errors=True)
+    return doc
+
+
+def compare(baseline, current, threshold=0.25, min_delta=0.001):
+    """
+    Compare two result documents by median time.
+
+    A case regresses when it is more than ``threshold`` slower (relative) and
+    at least ``min_delta`` seconds slower (absolute, to ignore timer noise).
+
+    :return: (scale, case, baseline, current, ratio, regressed) rows
+    :rtype: list
+    """
+    rows = []
+    for scale, cases_ in current["results"].items():
+        base = baseline["results"].get(scale, {})
+        for name, result in cases_.items():
+            if name not in base:
+                continue
+            old, new = base[name]["median"], result["median"]
+            ratio = new / old if old else float("inf")
+            rows.append((scale, name, old, new, ratio, ratio > 1 + threshold and new - old >= min_delta))
+    return rows
+
+
+def print_comparison(rows):
+    for scale, name, old, new, ratio, regressed in rows:
+        flag = "REGRESSION" if regressed else ("faster" if ratio < 0.8 else "")
+        print(f"{scale:>9} {name:<45}{old * 1000:10.2f} ms{new * 1000:10.2f} ms{ratio:8.2f}x  {flag}")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark the school package.")
+    p.add_argument("--scales", default="1000,10000", help="comma-separated student counts")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--density", type=float, default=3.0, help="registrations per student")
+    p.add_argument("--only", help="run only cases whose name contains this")
+    p.add_argument("--out", help="write results JSON here")
+    p.add_argument("--baseline", help="results JSON to compare against")
+    p.add_argument("--compare", help="compare this results JSON instead of running")
+    p.add_argument("--threshold", type=float, default=0.25, help="relative slowdown that counts as a regression")
+    args = p.parse_args()
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            doc = json.load(f)
+    else:
+        doc = run([int(s) for s in args.scales.split(",")], args.repeat, args.seed, args.density, args.only)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(doc, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            rows = compare(json.load(f), doc, args.threshold)
+        print_comparison(rows)
+        if any(r[-1] for r in rows):
+            sys.exit(1)
+    elif not args.out:
+        json.dump(doc, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Compare the binary columnar snapshot (school.binsnap) with JSON export/import.
+
+Usage::
+
+    python -m benchmarks.snapshot_formats [students]
+
+Runs against a throwaway database in a temp directory.
+"""
+
+import json, os, shutil, sys, tempfile, time
+from school import db, storage, binsnap
+from benchmarks.generate import Dataset
+
+
+def timed(fn, *args):
+    t = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - t, result
+
+
+def main(n=100_000):
+    work = tempfile.mkdtemp()
+    db.DB_PATH = os.path.join(work, "source.db")
+    Dataset(n).load()
+    json_path, bin_path = os.path.join(work, "snap.json"), os.path.join(work, "snap.bin")
+
+    results = {}
+    results["write json"], _ = timed(storage.export_json, json_path)
+    results["write binary"], _ = timed(binsnap.write_snapshot, bin_path)
+
+    def read_json():
+        with open(json_path, encoding="utf-8") as f:
+            data = json.load(f)
+        return sum(s["age"] for s in data["students"])
+
+    def read_binary():
+        with binsnap.Snapshot(bin_path) as snap:
+            return sum(snap.column("students", "age"))
+
+    results["load + sum ages, json"], a = timed(read_json)
+    results["load + sum ages, binary"], b = timed(read_binary)
+    assert a == b
+
+    for name, fn, path in (("restore json", storage.import_json, json_path),
+                           ("restore binary", binsnap.restore_snapshot, bin_path)):
+        db.close_all()
+        db.DB_PATH = os.path.join(work, name.replace(" ", "_") + ".db")
+        results[name], _ = timed(fn, path)
+
+    print(f"{n:,} students, {3 * n:,} registrations")
+    print(f"  size json    {os.path.getsize(json_path) / 1e6:8.1f} MB")
+    print(f"  size binary  {os.path.getsize(bin_path) / 1e6:8.1f} MB")
+    for name, seconds in results.items():
+        print(f"  {name:<26}{seconds * 1000:10.1f} ms")
+    db.close_all()
+    shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
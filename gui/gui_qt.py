@@ -18,15 +18,547 @@ Author:
     Marc Abou Nader
 """
 
-import sys, os, csv
+import sys, os, bisect, threading, time
+from collections import OrderedDict
+from PyQt5.QtCore import (
+    Qt, QAbstractTableModel, QModelIndex, QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
+)
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QTabWidget, QVBoxLayout, QHBoxLayout, QLabel,
-    QLineEdit, QPushButton, QComboBox, QTableWidget, QTableWidgetItem,
-    QFileDialog, QMessageBox
+    QLineEdit, QPushButton, QComboBox, QTableView, QAbstractItemView,
+    QFileDialog, QMessageBox, QProgressBar, QCheckBox
 )
-from school import db, services, storage
+from school import db, events, services, storage, csvio
+
+
+class TaskCancelled(Exception):
+    """Raised inside a task's progress callback once the task has been cancelled."""
+
+
+class TaskSignals(QObject):
+    """
+    Signals of a :class:`Task`. They are emitted on the pool thread and delivered
+    to slots on the GUI thread.
+    """
+
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+
+class Task(QRunnable):
+    """
+    Long-running job executed on a :class:`QThreadPool`.
+
+    ``fn(*args, progress=callback)`` is called on a pool thread. The callback takes
+    ``(rows, bytes)``, emits :attr:`TaskSignals.progress` and raises
+    :class:`TaskCancelled` once :meth:`cancel` has been called, so cancellation
+    takes effect at the job's next progress report.
+
+    :param fn: The job; it must accept a ``progress`` keyword argument.
+    :type fn: callable
+    :param args: Positional arguments for ``fn``.
+    :type args: tuple
+    """
+
+    def __init__(self, fn, *args):
+        super().__init__()
+        self.fn, self.args = fn, args
+        self.signals = TaskSignals()
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """Ask the task to stop at its next progress report."""
+        self._cancel.set()
+
+    def report(self, rows, nbytes):
+        """
+        Progress callback handed to the job.
+
+        :param rows: Rows processed so far.
+        :type rows: int
+        :param nbytes: Bytes read or written so far.
+        :type nbytes: int
+        :return: None
+        """
+        if self._cancel.is_set():
+            raise TaskCancelled()
+        self.signals.progress.emit(rows, nbytes)
+
+    def run(self):
+        """Run the job and emit exactly one of finished, failed or cancelled."""
+        try:
+            result = self.fn(*self.args, progress=self.report)
+        except TaskCancelled:
+            self.signals.cancelled.emit()
+        except Exception as ex:
+            self.signals.failed.emit(str(ex))
+        else:
+            self.signals.finished.emit(result)
+        finally:
+            # pool threads are reused or retired by Qt; don't leave a connection behind
+            db.close_conn()
+
+
+def human_size(n):
+    """Format a byte count for display."""
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+class TaskPanel(QWidget):
+    """
+    Strip listing the running tasks, each with a progress bar and a Cancel button.
+
+    Tasks run on the global :class:`QThreadPool`, so several can run at once
+    while the tables stay responsive.
+    """
+
+    def __init__(self):
+        """Initialize an empty task panel."""
+        super().__init__()
+        self.pool = QThreadPool.globalInstance()
+        self.tasks = set()
+        self.v = QVBoxLayout(self)
+        self.v.setContentsMargins(0, 0, 0, 0)
+
+    def start(self, title, fn, *args, total=0, unit="rows", on_done=None):
+        """
+        Run ``fn(*args, progress=...)`` in the background.
+
+        :param title: Label shown next to the progress bar.
+        :type title: str
+        :param fn: The job.
+        :type fn: callable
+        :param total: Expected byte count, or 0 when unknown (busy bar).
+        :type total: int
+        :param unit: What the job's item count measures, for the label.
+        :type unit: str
+        :param on_done: Called on the GUI thread with the job's result.
+        :type on_done: callable
+        :return: The started task
+        :rtype: Task
+        """
+        task = Task(fn, *args)
+        row = QWidget(); h = QHBoxLayout(row); h.setContentsMargins(0, 0, 0, 0)
+        bar = QProgressBar(); bar.setRange(0, 100 if total else 0)
+        info = QLabel(""); cancel = QPushButton("Cancel")
+        h.addWidget(QLabel(title)); h.addWidget(bar); h.addWidget(info); h.addWidget(cancel)
+        self.v.addWidget(row)
+
+        def progress(rows, nbytes):
+            info.setText(f"{rows:,} {unit}, {human_size(nbytes)}")
+            if total:
+                bar.setValue(min(100, nbytes * 100 // total))
+
+        def finish(message=None):
+            self.tasks.discard(task)
+            row.deleteLater()
+            if message:
+                QMessageBox.information(self, title, message)
+
+        def done(result):
+            finish()
+            if on_done: on_done(result)
+
+        def failed(error):
+            finish()
+            QMessageBox.warning(self, title, error)
+
+        cancel.clicked.connect(lambda: (task.cancel(), cancel.setEnabled(False)))
+        task.signals.progress.connect(progress)
+        task.signals.finished.connect(done)
+        task.signals.failed.connect(failed)
+        task.signals.cancelled.connect(lambda: finish(f"{title} cancelled."))
+        # keep a reference until a final signal has been delivered
+        self.tasks.add(task)
+        self.pool.start(task)
+        return task
+
+    def cancel_all(self):
+        """Cancel every running task."""
+        for task in list(self.tasks):
+            task.cancel()
+
+
+def backup_with_progress(path, progress=None):
+    """
+    Back up the live database page by page, reporting pages and bytes copied.
+
+    :param path: Destination file.
+    :type path: str
+    :return: None
+    """
+    page_size = db.get_conn().execute("PRAGMA page_size").fetchone()[0]
+    report = (lambda done, total: progress(done, done * page_size)) if progress else None
+    # a short pause between steps leaves disk bandwidth for the rest of the app
+    db.backup_db(path, pages=256, progress=report, pause=0.005)
+
+
+class LazyTableModel(QAbstractTableModel):
+    """
+    Read-only table model that pages rows in from SQLite on demand.
+
+    Rows are appended a page at a time as the view scrolls
+    (``canFetchMore``/``fetchMore``). Only the ``max_pages`` most recently
+    used pages are kept in memory; an evicted page is re-read from its keyset
+    anchor when it scrolls back into view.
+
+    Page ``p`` holds the rows after anchor ``p`` up to and including anchor ``p + 1``,
+    so inserting or removing one key only changes the length of the page it falls in.
+    :meth:`insert_keys` and :meth:`remove_keys` apply such changes in place, keeping
+    the rows around them (and the view's scroll position) where they are.
+
+    :param headers: Column titles.
+    :type headers: list
+    :param fetch_page: ``fetch_page(after, limit)`` returning the rows that follow ``after``.
+    :type fetch_page: callable
+    :param next_after: ``next_after(rows, after)`` returning the anchor of the page after ``rows``.
+    :type next_after: callable
+    :param key_of: Function returning the primary key of a row, used by :meth:`update_rows`,
+        :meth:`insert_keys` and :meth:`remove_keys`.
+    :type key_of: callable
+    :param page_size: Rows per page.
+    :type page_size: int
+    :param max_pages: Pages kept in the cache.
+    :type max_pages: int
+    """
+
+    def __init__(self, headers, fetch_page, next_after, key_of=None, page_size=200, max_pages=20):
+        super().__init__()
+        self.headers = headers
+        self.fetch_page = fetch_page
+        self.next_after = next_after
+        self.key_of = key_of
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._anchors = [None]
+        self._lengths = []
+        self._starts = []
+        self._pages = OrderedDict()
+        self._rows = 0
+        self._done = False
+
+    def reset(self):
+        """
+        Drop every cached page and start again from the first page.
+
+        :return: None
+        """
+        self.beginResetModel()
+        self._anchors = [None]
+        self._lengths = []
+        self._starts = []
+        self._pages.clear()
+        self._rows = 0
+        self._done = False
+        self.endResetModel()
+
+    def _cache(self, p, page):
+        self._pages[p] = page
+        self._pages.move_to_end(p)
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+
+    def _page(self, p):
+        page = self._pages.get(p)
+        if page is None:
+            page = self.fetch_page(self._anchors[p], self._lengths[p])
+            self._cache(p, page)
+        else:
+            self._pages.move_to_end(p)
+        return page
+
+    def row(self, r):
+        """
+        Return the raw row tuple at position ``r``.
+
+        :param r: Row index
+        :type r: int
+        :return: The row, or None if it is no longer available
+        :rtype: tuple
+        """
+        p = bisect.bisect_right(self._starts, r) - 1
+        if p < 0:
+            return None
+        page = self._page(p)
+        i = r - self._starts[p]
+        return page[i] if i < len(page) else None
+
+    def update_rows(self, rows):
+        """
+        Replace cached rows that share a key with one of ``rows`` and repaint just those rows.
+
+        Rows that are not currently cached need no work; they are read fresh when paged in.
+
+        :param rows: Fresh row tuples.
+        :type rows: list
+        :return: None
+        """
+        fresh = {self.key_of(r): r for r in rows}
+        if not fresh:
+            return
+        for p, page in self._pages.items():
+            for i, r in enumerate(page):
+                new = fresh.get(self.key_of(r))
+                if new is not None:
+                    page[i] = new
+                    row = self._starts[p] + i
+                    self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.headers) - 1))
+
+    def cached_keys(self, pred):
+        """
+        Return the keys of the cached rows that satisfy ``pred``.
+
+        :param pred: Function taking a row and returning a bool.
+        :type pred: callable
+        :return: Keys
+        :rtype: list
+        """
+        return [self.key_of(r) for page in self._pages.values() for r in page if pred(r)]
+
+    def _locate(self, key):
+        # the loaded page whose key range holds `key`, or None past the loaded rows
+        p = bisect.bisect_left(self._anchors, key, 1) - 1
+        return p if p < len(self._lengths) else None
+
+    def _resize_page(self, key, delta):
+        # re-read the page holding `key` with one row more or less and apply it
+        p = self._locate(key)
+        if p is None or self._lengths[p] + delta < 0:
+            return
+        cached = self._pages.get(p)
+        if cached is not None and (key in map(self.key_of, cached)) == (delta > 0):
+            return
+        page = self.fetch_page(self._anchors[p], self._lengths[p] + delta)
+        keys = [self.key_of(r) for r in page]
+        i = bisect.bisect_left(keys, key)
+        if (i < len(keys) and keys[i] == key) != (delta > 0):
+            return
+        row = self._starts[p] + i
+        if delta > 0:
+            self.beginInsertRows(QModelIndex(), row, row)
+        else:
+            self.beginRemoveRows(QModelIndex(), row, row)
+        self._lengths[p] += delta
+        for q in range(p + 1, len(self._starts)):
+            self._starts[q] += delta
+        self._rows += delta
+        self._cache(p, page)
+        if delta > 0:
+            self.endInsertRows()
+        else:
+            self.endRemoveRows()
+        # rows of this page that other pending changes already moved
+        if page:
+            first = self._starts[p]
+            self.dataChanged.emit(self.index(first, 0),
+                                  self.index(first + len(page) - 1, len(self.headers) - 1))
+
+    def insert_keys(self, keys):
+        """
+        Show newly inserted rows in place, one keyset read per key.
+
+        Keys past the rows loaded so far need no work; they are read when paged in.
+        A large batch re-pages the loaded rows from the first key instead.
+
+        :param keys: Keys of the inserted rows.
+        :type keys: tuple
+        :return: None
+        """
+        if len(keys) > self.page_size:
+            self.reload_from(min(keys))
+            return
+        for k in sorted(keys):
+            self._resize_page(k, 1)
+
+    def remove_keys(self, keys):
+        """
+        Drop deleted rows in place, one keyset read per key.
+
+        :param keys: Keys of the deleted rows.
+        :type keys: tuple
+        :return: None
+        """
+        if len(keys) > self.page_size:
+            self.reload_from(min(keys))
+            return
+        for k in sorted(keys):
+            self._resize_page(k, -1)
+
+    def reload_from(self, key=None):
+        """
+        Re-read the loaded rows from the page holding ``key`` onwards, keeping the pages
+        before it and as many rows as were loaded, so the view does not jump.
 
-db.init_db()
+        Used when the changed keys are not known, e.g. rows removed by a cascade.
+
+        :param key: First key that may have changed; None re-reads every loaded page.
+        :type key: object
+        :return: None
+        """
+        p = 0 if key is None else self._locate(key)
+        if p is None:
+            return
+        old = self._rows
+        anchors, lengths, starts = self._anchors[:p + 1], self._lengths[:p], self._starts[:p]
+        rows, done, pages = (self._starts[p] if p < len(self._starts) else self._rows), False, []
+        while rows < old and not done:
+            q = len(lengths)
+            page = self.fetch_page(anchors[q], self.page_size)
+            starts.append(rows)
+            lengths.append(len(page))
+            rows += len(page)
+            pages.append((q, page))
+            if len(page) < self.page_size:
+                done = True
+            else:
+                anchors.append(self.next_after(page, anchors[q]))
+        if rows < old:
+            self.beginRemoveRows(QModelIndex(), rows, old - 1)
+        elif rows > old:
+            self.beginInsertRows(QModelIndex(), old, rows - 1)
+        self._anchors, self._lengths, self._starts = anchors, lengths, starts
+        self._rows, self._done = rows, done
+        for q in [q for q in self._pages if q >= p]:
+            del self._pages[q]
+        for q, page in pages[-self.max_pages:]:
+            self._cache(q, page)
+        if rows < old:
+            self.endRemoveRows()
+        elif rows > old:
+            self.endInsertRows()
+        first = starts[p] if p < len(starts) else rows
+        if first < min(rows, old):
+            self.dataChanged.emit(self.index(first, 0), self.index(min(rows, old) - 1, len(self.headers) - 1))
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._rows
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        row = self.row(index.row())
+        if row is None:
+            return None
+        val = row[index.column()]
+        return "" if val is None else str(val)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._done
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._done:
+            return
+        p = len(self._lengths)
+        rows = self.fetch_page(self._anchors[p], self.page_size)
+        self._lengths.append(len(rows))
+        self._starts.append(self._rows)
+        self._cache(p, rows)
+        if len(rows) < self.page_size:
+            self._done = True
+        else:
+            self._anchors.append(self.next_after(rows, self._anchors[p]))
+        if rows:
+            self.beginInsertRows(QModelIndex(), self._rows, self._rows + len(rows) - 1)
+            self._rows += len(rows)
+            self.endInsertRows()
+
+
+def keyset_model(headers, fetch_page, key_columns=(0,)):
+    """
+    Build a :class:`LazyTableModel` over one of the ``db.get_*_page`` functions.
+
+    :param headers: Column titles.
+    :type headers: list
+    :param fetch_page: Calls a ``db.get_*_page`` function; look it up at call time
+        so :func:`school.db.instrument` can wrap it.
+    :type fetch_page: callable
+    :param key_columns: Positions of the primary key columns in a row.
+    :type key_columns: tuple
+    :return: The model
+    :rtype: LazyTableModel
+    """
+    def key_of(row):
+        key = tuple(row[i] for i in key_columns)
+        return key if len(key) > 1 else key[0]
+    return LazyTableModel(headers, fetch_page, lambda rows, after: key_of(rows[-1]), key_of)
+
+
+def list_model(headers):
+    """
+    Build a :class:`LazyTableModel` over an in-memory list, set with ``model.rows``.
+
+    :param headers: Column titles.
+    :type headers: list
+    :return: The model
+    :rtype: LazyTableModel
+    """
+    model = LazyTableModel(headers, lambda after, limit: model.rows[after or 0:(after or 0) + limit],
+                           lambda rows, after: (after or 0) + len(rows))
+    model.rows = []
+    return model
+
+
+def make_view(model):
+    """
+    Create a row-selecting :class:`QTableView` over ``model``.
+
+    :param model: The table model.
+    :type model: LazyTableModel
+    :return: The view
+    :rtype: QTableView
+    """
+    view = QTableView()
+    view.setModel(model)
+    view.setSelectionBehavior(QAbstractItemView.SelectRows)
+    view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+    return view
+
+
+def update_choices(combo, op, keys, reload, limit=1000):
+    """
+    Insert or remove ids in a combo box whose items are kept sorted, without re-reading
+    the table; each key is placed with a binary search over the items. A batch of more
+    than ``limit`` keys (a bulk import) calls ``reload`` instead.
+
+    :param combo: Combo box of ids in ascending order (an empty first item is allowed).
+    :type combo: QComboBox
+    :param op: "insert" or "delete"; other operations leave the items alone.
+    :type op: str
+    :param keys: Ids that were inserted or deleted.
+    :type keys: tuple
+    :param reload: Refills the combo box from the database.
+    :type reload: callable
+    :return: None
+    """
+    if len(keys) > limit:
+        reload()
+        return
+    for k in keys:
+        lo, hi = 0, combo.count()
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if combo.itemText(mid) < k:
+                lo = mid + 1
+            else:
+                hi = mid
+        present = lo < combo.count() and combo.itemText(lo) == k
+        if op == "insert" and not present:
+            combo.insertItem(lo, k)
+        elif op == "delete" and present:
+            combo.removeItem(lo)
 
 
 class TabStudents(QWidget):
@@ -36,13 +568,17 @@ class TabStudents(QWidget):
     Provides a form and table to add, edit, delete, save, and load student records.
     """
 
-    def __init__(self):
+    def __init__(self, tasks):
         """
         Initialize the Students tab.
 
         Sets up form fields, table, and buttons for student management.
+
+        :param tasks: Panel that runs JSON import/export in the background.
+        :type tasks: TaskPanel
         """
         super().__init__()
+        self.tasks = tasks
         v = QVBoxLayout(self)
         top = QHBoxLayout()
         self.sid = QLineEdit(); self.sname = QLineEdit(); self.sage = QLineEdit(); self.semail = QLineEdit()
@@ -61,39 +597,51 @@ class TabStudents(QWidget):
         for b in (b1, b2, b3, b4, b5): btns.addWidget(b)
         v.addLayout(btns)
 
-        self.table = QTableWidget(0, 4)
-        self.table.setHorizontalHeaderLabels(["ID", "Name", "Age", "Email"])
+        self.model = keyset_model(["ID", "Name", "Age", "Email"], lambda after, limit: db.get_students_page(after, limit))
+        self.table = make_view(self.model)
         v.addWidget(self.table)
-        self.table.cellClicked.connect(self.on_sel)
+        self.table.clicked.connect(self.on_sel)
         self.refresh()
 
     def refresh(self):
         """
-        Reload all students into the table from the database.
+        Reload the students table; rows are paged in from the database as they scroll into view.
 
         :return: None
         """
-        rows = services.db.get_students()
-        self.table.setRowCount(0)
-        for r in rows:
-            i = self.table.rowCount(); self.table.insertRow(i)
-            for j, val in enumerate(r):
-                self.table.setItem(i, j, QTableWidgetItem(str(val)))
+        self.model.reset()
 
-    def on_sel(self, r, c):
+    def on_change(self, ev):
+        """
+        Apply a change event: repaint edited rows, insert or remove added and deleted rows in place.
+
+        :param ev: The change event.
+        :type ev: school.events.ChangeEvent
+        :return: None
+        """
+        if ev.entity != "student":
+            return
+        if ev.op == "update":
+            self.model.update_rows(db.get_students_by_ids(ev.keys))
+        elif ev.op == "insert":
+            self.model.insert_keys(ev.keys)
+        else:
+            self.model.remove_keys(ev.keys)
+
+    def on_sel(self, index):
         """
         Fill the form fields when a table row is selected.
 
-        :param r: Row index
-        :type r: int
-        :param c: Column index
-        :type c: int
+        :param index: Index of the clicked cell
+        :type index: QModelIndex
         :return: None
         """
-        self.sid.setText(self.table.item(r, 0).text())
-        self.sname.setText(self.table.item(r, 1).text())
-        self.sage.setText(self.table.item(r, 2).text())
-        self.semail.setText(self.table.item(r, 3).text())
+        r = self.model.row(index.row())
+        if r is None: return
+        self.sid.setText(str(r[0]))
+        self.sname.setText(str(r[1]))
+        self.sage.setText(str(r[2]))
+        self.semail.setText(str(r[3]))
 
     def add(self):
         """
@@ -105,7 +653,6 @@ class TabStudents(QWidget):
         try:
             services.add_student(self.sid.text(), self.sname.text(),
                                  self.sage.text(), self.semail.text())
-            self.refresh()
         except Exception as ex:
             QMessageBox.critical(self, "Error", str(ex))
 
@@ -119,7 +666,6 @@ class TabStudents(QWidget):
         try:
             services.edit_student(self.sid.text(), self.sname.text(),
                                   self.sage.text(), self.semail.text())
-            self.refresh()
         except Exception as ex:
             QMessageBox.critical(self, "Error", str(ex))
 
@@ -131,7 +677,6 @@ class TabStudents(QWidget):
         """
         if not self.sid.text(): return
         services.remove_student(self.sid.text())
-        self.refresh()
 
     def save_json(self):
         """
@@ -140,9 +685,9 @@ class TabStudents(QWidget):
         Opens a file dialog to select the save location.
         :return: None
         """
-        path, _ = QFileDialog.getSaveFileName(self, "Save JSON", "", "JSON Files (*.json)")
+        path, _ = QFileDialog.getSaveFileName(self, "Save JSON", "", "JSON Files (*.json);;NDJSON Files (*.ndjson)")
         if not path: return
-        storage.export_json(path)
+        self.tasks.start("Save JSON", storage.export_json, path)
 
     def load_json(self):
         """
@@ -151,10 +696,22 @@ class TabStudents(QWidget):
         Opens a file dialog to choose the file.
         :return: None
         """
-        path, _ = QFileDialog.getOpenFileName(self, "Load JSON", "", "JSON Files (*.json)")
+        path, _ = QFileDialog.getOpenFileName(self, "Load JSON", "", "JSON Files (*.json);;NDJSON Files (*.ndjson)")
         if not path: return
-        storage.import_json(path)
-        self.refresh()
+        self.tasks.start("Load JSON", storage.import_json, path, total=os.path.getsize(path), on_done=self.import_done)
+
+    def import_done(self, report):
+        """
+        Report rejected records once an import finishes.
+
+        :param report: The import report.
+        :type report: dict
+        :return: None
+        """
+        if report and report.get("error"):
+            QMessageBox.warning(self, "Import", f"{report['error']}. Records before that point were loaded.")
+        elif report and report["rejected_total"]:
+            QMessageBox.warning(self, "Import", f"{report['rejected_total']} record(s) were rejected.")
 
 
 class TabInstructors(QWidget):
@@ -183,34 +740,41 @@ class TabInstructors(QWidget):
         for b in (b1, b2, b3): btns.addWidget(b)
         v.addLayout(btns)
 
-        self.table = QTableWidget(0, 4)
-        self.table.setHorizontalHeaderLabels(["ID", "Name", "Age", "Email"])
+        self.model = keyset_model(["ID", "Name", "Age", "Email"], lambda after, limit: db.get_instructors_page(after, limit))
+        self.table = make_view(self.model)
         v.addWidget(self.table)
-        self.table.cellClicked.connect(self.on_sel)
+        self.table.clicked.connect(self.on_sel)
         self.refresh()
 
     def refresh(self):
-        """Reload instructors into the table."""
-        rows = services.db.get_instructors()
-        self.table.setRowCount(0)
-        for r in rows:
-            i = self.table.rowCount(); self.table.insertRow(i)
-            for j, val in enumerate(r):
-                self.table.setItem(i, j, QTableWidgetItem(str(val)))
-
-    def on_sel(self, r, c):
+        """Reload the instructors table."""
+        self.model.reset()
+
+    def on_change(self, ev):
+        """Apply a change event to the instructors table."""
+        if ev.entity != "instructor":
+            return
+        if ev.op == "update":
+            self.model.update_rows(db.get_instructors_by_ids(ev.keys))
+        elif ev.op == "insert":
+            self.model.insert_keys(ev.keys)
+        else:
+            self.model.remove_keys(ev.keys)
+
+    def on_sel(self, index):
         """Fill fields with selected instructor record."""
-        self.iid.setText(self.table.item(r, 0).text())
-        self.iname.setText(self.table.item(r, 1).text())
-        self.iage.setText(self.table.item(r, 2).text())
-        self.iemail.setText(self.table.item(r, 3).text())
+        r = self.model.row(index.row())
+        if r is None: return
+        self.iid.setText(str(r[0]))
+        self.iname.setText(str(r[1]))
+        self.iage.setText(str(r[2]))
+        self.iemail.setText(str(r[3]))
 
     def add(self):
         """Add a new instructor."""
         try:
             services.add_instructor(self.iid.text(), self.iname.text(),
                                     self.iage.text(), self.iemail.text())
-            self.refresh()
         except Exception as ex:
             QMessageBox.critical(self, "Error", str(ex))
 
@@ -219,7 +783,6 @@ class TabInstructors(QWidget):
         try:
             services.edit_instructor(self.iid.text(), self.iname.text(),
                                      self.iage.text(), self.iemail.text())
-            self.refresh()
         except Exception as ex:
             QMessageBox.critical(self, "Error", str(ex))
 
@@ -227,7 +790,6 @@ class TabInstructors(QWidget):
         """Delete the selected instructor."""
         if not self.iid.text(): return
         services.remove_instructor(self.iid.text())
-        self.refresh()
 
 
 class TabCourses(QWidget):
@@ -254,36 +816,64 @@ class TabCourses(QWidget):
         for b in (b1, b2, b3): btns.addWidget(b)
         v.addLayout(btns)
 
-        self.table = QTableWidget(0, 4)
-        self.table.setHorizontalHeaderLabels(["Course ID", "Course Name", "Instructor ID", "Instructor Name"])
+        self.model = keyset_model(["Course ID", "Course Name", "Instructor ID", "Instructor Name"],
+                                  lambda after, limit: db.get_courses_page(after, limit))
+        self.table = make_view(self.model)
         v.addWidget(self.table)
-        self.table.cellClicked.connect(self.on_sel)
+        self.table.clicked.connect(self.on_sel)
         self.refresh()
 
     def refresh(self):
-        """Reload courses and instructors into the table and dropdown."""
+        """Reload the instructor dropdown and the courses table."""
+        self.refresh_choices()
+        self.model.reset()
+
+    def refresh_choices(self):
+        """Reload the instructor dropdown."""
+        current = self.cinstr.currentText()
         self.cinstr.clear()
         self.cinstr.addItem("")
-        for ins in services.db.get_instructors():
+        for ins in db.iter_instructors():
             self.cinstr.addItem(ins[0])
-        rows = services.db.get_courses()
-        self.table.setRowCount(0)
-        for r in rows:
-            i = self.table.rowCount(); self.table.insertRow(i)
-            for j, val in enumerate(r):
-                self.table.setItem(i, j, QTableWidgetItem("" if val is None else str(val)))
-
-    def on_sel(self, r, c):
+        self.cinstr.setCurrentText(current)
+
+    def on_change(self, ev):
+        """
+        Apply a change event to the courses table.
+
+        Renaming an instructor only repaints the courses that show that instructor; adding
+        or deleting one only touches that item of the dropdown.
+        """
+        if ev.entity == "course":
+            if ev.op == "update":
+                self.model.update_rows(db.get_courses_by_ids(ev.keys))
+            elif ev.op == "insert":
+                self.model.insert_keys(ev.keys)
+            else:
+                self.model.remove_keys(ev.keys)
+        elif ev.entity == "instructor":
+            if ev.op == "update":
+                for iid in ev.keys:
+                    self.model.update_rows(db.get_courses_by_instructor(iid))
+            else:
+                update_choices(self.cinstr, ev.op, ev.keys, self.refresh_choices)
+                if ev.op == "delete":
+                    # their courses are left without an instructor
+                    gone = set(ev.keys)
+                    self.model.update_rows(db.get_courses_by_ids(self.model.cached_keys(lambda r: r[2] in gone)))
+
+    def on_sel(self, index):
         """Fill fields with selected course record."""
-        self.cid.setText(self.table.item(r, 0).text())
-        self.cname.setText(self.table.item(r, 1).text())
-        self.cinstr.setCurrentText(self.table.item(r, 2).text())
+        r = self.model.row(index.row())
+        if r is None: return
+        self.cid.setText(str(r[0]))
+        self.cname.setText(str(r[1]))
+        self.cinstr.setCurrentText(r[2] or "")
 
     def add(self):
         """Add a new course."""
         try:
             services.add_course(self.cid.text(), self.cname.text(), self.cinstr.currentText() or None)
-            self.refresh()
         except Exception as ex:
             QMessageBox.critical(self, "Error", str(ex))
 
@@ -291,7 +881,6 @@ class TabCourses(QWidget):
         """Edit the selected course."""
         try:
             services.edit_course(self.cid.text(), self.cname.text(), self.cinstr.currentText() or None)
-            self.refresh()
         except Exception as ex:
             QMessageBox.critical(self, "Error", str(ex))
 
@@ -299,7 +888,6 @@ class TabCourses(QWidget):
         """Delete the selected course."""
         if not self.cid.text(): return
         services.remove_course(self.cid.text())
-        self.refresh()
 
 
 class TabReg(QWidget):
@@ -320,30 +908,56 @@ class TabReg(QWidget):
         top.addWidget(b1); top.addWidget(b2)
         v.addLayout(top)
 
-        self.table = QTableWidget(0, 4)
-        self.table.setHorizontalHeaderLabels(["Student ID", "Student Name", "Course ID", "Course Name"])
+        self.model = keyset_model(["Student ID", "Student Name", "Course ID", "Course Name"],
+                                  lambda after, limit: db.get_registrations_page(after, limit), key_columns=(0, 2))
+        self.table = make_view(self.model)
         v.addWidget(self.table)
         self.refresh()
 
     def refresh(self):
-        """Reload students, courses, and registrations."""
+        """Reload the student and course dropdowns and the registrations table."""
+        self.refresh_choices()
+        self.model.reset()
+
+    def refresh_choices(self):
+        """Reload the student and course dropdowns."""
+        stu, crs = self.stu.currentText(), self.crs.currentText()
         self.stu.clear(); self.crs.clear()
-        for s in services.db.get_students():
+        for s in db.iter_students():
             self.stu.addItem(s[0])
-        for c in services.db.get_courses():
+        for c in db.iter_courses():
             self.crs.addItem(c[0])
-        rows = services.db.get_registrations()
-        self.table.setRowCount(0)
-        for r in rows:
-            i = self.table.rowCount(); self.table.insertRow(i)
-            for j, val in enumerate(r):
-                self.table.setItem(i, j, QTableWidgetItem(str(val)))
+        self.stu.setCurrentText(stu); self.crs.setCurrentText(crs)
+
+    def on_change(self, ev):
+        """
+        Apply a change event to the registrations table and dropdowns.
+
+        Renaming a student or course only repaints the registrations that show it; adding
+        or deleting one only touches that item of its dropdown.
+        """
+        if ev.entity == "registration":
+            if ev.op == "insert":
+                self.model.insert_keys(ev.keys)
+            else:
+                self.model.remove_keys(ev.keys)
+        elif ev.entity in ("student", "course"):
+            if ev.op == "update":
+                lookup = (db.get_registrations_by_student if ev.entity == "student"
+                          else db.get_registrations_by_course)
+                for k in ev.keys:
+                    self.model.update_rows(lookup(k))
+            else:
+                update_choices(self.stu if ev.entity == "student" else self.crs, ev.op, ev.keys, self.refresh_choices)
+                if ev.op == "delete":
+                    # the deleted rows' registrations went with them; a student's are
+                    # contiguous in key order, a course's can be on any page
+                    self.model.reload_from((min(ev.keys),) if ev.entity == "student" else None)
 
     def reg(self):
         """Register a student in a course."""
         try:
             services.register(self.stu.currentText(), self.crs.currentText())
-            self.refresh()
         except Exception as ex:
             QMessageBox.critical(self, "Error", str(ex))
 
@@ -351,7 +965,6 @@ class TabReg(QWidget):
         """Unregister a student from a course."""
         try:
             services.unregister(self.stu.currentText(), self.crs.currentText())
-            self.refresh()
         except Exception as ex:
             QMessageBox.critical(self, "Error", str(ex))
 
@@ -368,26 +981,17 @@ class TabSearch(QWidget):
         top = QHBoxLayout()
         self.q = QLineEdit(); b = QPushButton("Search"); b.clicked.connect(self.go)
         top.addWidget(self.q); top.addWidget(b); v.addLayout(top)
-        self.table = QTableWidget(0, 4)
-        self.table.setHorizontalHeaderLabels(["Type", "ID", "Name", "Extra"])
+        self.model = list_model(["Type", "ID", "Name", "Extra"])
+        self.table = make_view(self.model)
         v.addWidget(self.table)
 
     def go(self):
         """Perform a search and display results."""
         s, i, c = services.query(self.q.text())
-        self.table.setRowCount(0)
-        for x in s:
-            r = self.table.rowCount(); self.table.insertRow(r)
-            for j, val in enumerate(("Student", x[0], x[1], x[3])):
-                self.table.setItem(r, j, QTableWidgetItem(str(val)))
-        for x in i:
-            r = self.table.rowCount(); self.table.insertRow(r)
-            for j, val in enumerate(("Instructor", x[0], x[1], x[3])):
-                self.table.setItem(r, j, QTableWidgetItem(str(val)))
-        for x in c:
-            r = self.table.rowCount(); self.table.insertRow(r)
-            for j, val in enumerate(("Course", x[0], x[1], x[2] if x[2] else "")):
-                self.table.setItem(r, j, QTableWidgetItem(str(val)))
+        self.model.rows = ([("Student", x[0], x[1], x[3]) for x in s]
+                           + [("Instructor", x[0], x[1], x[3]) for x in i]
+                           + [("Course", x[0], x[1], x[2] if x[2] else "") for x in c])
+        self.model.reset()
 
 
 class TabExport(QWidget):
@@ -395,71 +999,188 @@ class TabExport(QWidget):
     Tab for exporting and backing up data.
     """
 
-    def __init__(self):
-        """Initialize the Export tab with CSV and DB backup buttons."""
+    def __init__(self, tasks):
+        """Initialize the Export tab with CSV and DB backup buttons; the work runs on ``tasks``."""
         super().__init__()
+        self.tasks = tasks
         v = QVBoxLayout(self)
         top = QHBoxLayout()
         b1 = QPushButton("Export Students CSV")
         b2 = QPushButton("Export Instructors CSV")
         b3 = QPushButton("Export Courses CSV")
+        b5 = QPushButton("Export Registrations CSV")
+        b6 = QPushButton("Import CSV")
         b4 = QPushButton("Backup Database")
         b1.clicked.connect(self.csv_students); b2.clicked.connect(self.csv_instructors)
         b3.clicked.connect(self.csv_courses); b4.clicked.connect(self.backup_db)
-        top.addWidget(b1); top.addWidget(b2); top.addWidget(b3); top.addWidget(b4)
+        b5.clicked.connect(self.csv_registrations); b6.clicked.connect(self.import_csv)
+        for b in (b1, b2, b3, b5, b6, b4): top.addWidget(b)
         v.addLayout(top)
 
+    def export_csv(self, table, title):
+        """
+        Export one table to a CSV file in the background; a ``.gz`` name is gzip-compressed.
+
+        :param table: Table name.
+        :type table: str
+        :param title: Dialog and task title.
+        :type title: str
+        :return: None
+        """
+        path, _ = QFileDialog.getSaveFileName(self, title, "", "CSV Files (*.csv);;Compressed CSV (*.csv.gz)")
+        if not path: return
+        self.tasks.start(title, csvio.export_csv, table, path)
+
     def csv_students(self):
         """Export students to a CSV file."""
-        path, _ = QFileDialog.getSaveFileName(self, "Export Students CSV", "", "CSV Files (*.csv)")
-        if not path: return
-        rows = services.db.get_students()
-        with open(path, "w", newline="", encoding="utf-8") as f:
-            w = csv.writer(f); w.writerow(["student_id", "name", "age", "email"]); w.writerows(rows)
+        self.export_csv("students", "Export Students CSV")
 
     def csv_instructors(self):
         """Export instructors to a CSV file."""
-        path, _ = QFileDialog.getSaveFileName(self, "Export Instructors CSV", "", "CSV Files (*.csv)")
-        if not path: return
-        rows = services.db.get_instructors()
-        with open(path, "w", newline="", encoding="utf-8") as f:
-            w = csv.writer(f); w.writerow(["instructor_id", "name", "age", "email"]); w.writerows(rows)
+        self.export_csv("instructors", "Export Instructors CSV")
 
     def csv_courses(self):
         """Export courses to a CSV file."""
-        path, _ = QFileDialog.getSaveFileName(self, "Export Courses CSV", "", "CSV Files (*.csv)")
+        self.export_csv("courses", "Export Courses CSV")
+
+    def csv_registrations(self):
+        """Export registrations to a CSV file."""
+        self.export_csv("registrations", "Export Registrations CSV")
+
+    def import_csv(self):
+        """Import a CSV file; the table is recognised from its header and existing rows are updated."""
+        path, _ = QFileDialog.getOpenFileName(self, "Import CSV", "", "CSV Files (*.csv *.csv.gz)")
         if not path: return
-        rows = services.db.get_courses()
-        with open(path, "w", newline="", encoding="utf-8") as f:
-            w = csv.writer(f); w.writerow(["course_id", "course_name", "instructor_id", "instructor_name"]); w.writerows(rows)
+        self.tasks.start("Import CSV", csvio.import_csv, path, total=os.path.getsize(path), on_done=self.import_done)
+
+    def import_done(self, report):
+        """Summarise a finished CSV import."""
+        QMessageBox.information(self, "Import CSV",
+                                f"{report['table']}: {report['inserted']} inserted, {report['updated']} updated, "
+                                f"{report['rejected_total']} rejected.")
 
     def backup_db(self):
         """Backup the SQLite database."""
         path, _ = QFileDialog.getSaveFileName(self, "Backup DB", "", "SQLite DB (*.db)")
         if not path: return
-        services.db.backup_db(path)
+        self.tasks.start("Backup Database", backup_with_progress, path,
+                         total=os.path.getsize(db.DB_PATH), unit="pages")
+
+
+class TabDiagnostics(QWidget):
+    """
+    Tab showing live query timings, the slow-query log and cache and lock counters.
+
+    The numbers are in-memory counters kept by :mod:`school.db`, so they are read on the GUI thread.
+    """
+
+    def __init__(self):
+        """Initialize the Diagnostics tab and refresh it once a second while visible."""
+        super().__init__()
+        v = QVBoxLayout(self)
+        top = QHBoxLayout()
+        st = db.stats()
+        self.enabled = QCheckBox("Time queries"); self.enabled.setChecked(st["enabled"])
+        self.enabled.toggled.connect(self.apply)
+        self.slow_ms = QLineEdit(str(st["slow_ms"])); self.slow_ms.setMaximumWidth(80)
+        b_apply = QPushButton("Apply"); b_apply.clicked.connect(self.apply)
+        b_reset = QPushButton("Reset"); b_reset.clicked.connect(self.reset)
+        for w in (self.enabled, QLabel("Slow (ms)"), self.slow_ms, b_apply, b_reset):
+            top.addWidget(w)
+        top.addStretch(1)
+        v.addLayout(top)
+        self.summary = QLabel("")
+        v.addWidget(self.summary)
+        self.model = list_model(["Kind", "Name", "Count", "Total ms", "Mean ms", "P50 ms", "P90 ms", "P99 ms", "Max ms"])
+        v.addWidget(make_view(self.model), 3)
+        self.slow_model = list_model(["Time", "ms", "SQL", "Plan"])
+        v.addWidget(make_view(self.slow_model), 1)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(1000)
+        self.refresh()
+
+    def apply(self):
+        """Turn query timing on or off with the threshold from the input box."""
+        try:
+            slow = float(self.slow_ms.text())
+        except ValueError:
+            QMessageBox.warning(self, "Diagnostics", "Slow threshold must be a number of milliseconds")
+            return
+        db.instrument(self.enabled.isChecked(), slow_ms=slow)
+        self.refresh()
+
+    def reset(self):
+        """Clear the collected timings and lock counters."""
+        db.reset_stats()
+        self.refresh()
+
+    def refresh(self):
+        """Redraw the timings, slowest total first, and the slow-query log."""
+        if not self.isVisible():
+            return
+        st, cache = db.stats(), services.cache_stats()
+        locks = st["locks"]
+        self.summary.setText(
+            f"Timing {'on' if st['enabled'] else 'off'}   "
+            f"cache {cache['hits']} hits / {cache['misses']} misses ({cache['hit_rate']:.0%})   "
+            f"write locks {locks['acquired']}, {locks['contended']} waited {locks['wait'] * 1000:.0f} ms, "
+            f"{locks['retries']} retries, {locks['failures']} busy errors")
+        rows = [("call", k, h) for k, h in st["functions"].items()] + [("sql", k, h) for k, h in st["statements"].items()]
+        rows.sort(key=lambda r: -r[2]["total_ms"])
+        self.model.rows = [(kind, name, h["count"], f"{h['total_ms']:.1f}", f"{h['mean_ms']:.3f}", f"{h['p50_ms']:.3f}",
+                            f"{h['p90_ms']:.3f}", f"{h['p99_ms']:.3f}", f"{h['max_ms']:.3f}") for kind, name, h in rows[:100]]
+        self.model.reset()
+        self.slow_model.rows = [(time.strftime("%H:%M:%S", time.localtime(e["at"])), f"{e['ms']:.1f}", e["sql"],
+                                 " | ".join(e["plan"] or ())) for e in reversed(st["slow"])]
+        self.slow_model.reset()
 
 
 class Main(QWidget):
     """
     Main application window.
 
-    Hosts all the management tabs.
+    Hosts all the management tabs and the background task panel.
     """
 
+    # change events can be published on pool threads; the signal hops them to the GUI thread
+    changed = pyqtSignal(object)
+
     def __init__(self):
-        """Initialize the main window with all tabs."""
+        """Initialize the main window with all tabs; the schema is created or migrated first."""
         super().__init__()
+        db.init_db()
         self.setWindowTitle("School Management System")
         v = QVBoxLayout(self)
         tabs = QTabWidget()
-        tabs.addTab(TabStudents(), "Students")
-        tabs.addTab(TabInstructors(), "Instructors")
-        tabs.addTab(TabCourses(), "Courses")
-        tabs.addTab(TabReg(), "Registrations")
+        self.tasks = TaskPanel()
+        self.listeners = [TabStudents(self.tasks), TabInstructors(), TabCourses(), TabReg()]
+        for tab, title in zip(self.listeners, ("Students", "Instructors", "Courses", "Registrations")):
+            tabs.addTab(tab, title)
         tabs.addTab(TabSearch(), "Search")
-        tabs.addTab(TabExport(), "Export/Backup")
+        tabs.addTab(TabExport(self.tasks), "Export/Backup")
+        tabs.addTab(TabDiagnostics(), "Diagnostics")
         v.addWidget(tabs)
+        v.addWidget(self.tasks)
+        self.changed.connect(self.on_change)
+        self._unsubscribe = events.subscribe(self.changed.emit)
+
+    def on_change(self, ev):
+        """
+        Forward a change event from the services layer to every tab that shows data.
+
+        :param ev: The change event.
+        :type ev: school.events.ChangeEvent
+        :return: None
+        """
+        for tab in self.listeners:
+            tab.on_change(ev)
+
+    def closeEvent(self, event):
+        """Stop listening for change events and cancel running tasks when the window closes."""
+        self._unsubscribe()
+        self.tasks.cancel_all()
+        super().closeEvent(event)
 
 
 if __name__ == "__main__":
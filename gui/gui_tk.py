@@ -1,9 +1,430 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-from school import db, services, storage
-import os
+from school import db, events, services, storage, csvio
+import os, sys, bisect, queue, threading, time
 
-db.init_db()
+class DbRequest:
+    """
+    A unit of work queued on a :class:`DbWorker`.
+
+    :param fn: Function to run on the database thread.
+    :type fn: callable
+    :param args: Positional arguments for ``fn``.
+    :type args: tuple
+    :param on_done: Called on the Tk thread with the result.
+    :type on_done: callable
+    :param on_error: Called on the Tk thread with the exception.
+    :type on_error: callable
+    :param key: Supersede key; a newer request with the same key cancels this one.
+    :type key: str
+
+    :return: None
+    """
+    def __init__(self, fn, args, on_done=None, on_error=None, key=None):
+        self.fn, self.args = fn, args
+        self.on_done, self.on_error = on_done, on_error
+        self.key = key
+        self.cancelled = False
+        self.result = self.error = None
+
+    def cancel(self):
+        """
+        Cancel the request. It is skipped if it has not started, and its result is dropped if it has.
+
+        :return: None
+        """
+        self.cancelled = True
+
+class DbWorker:
+    """
+    Runs database work on one dedicated thread so the Tk mainloop never blocks on SQLite.
+
+    Requests are queued with :meth:`submit`; their results are handed back on the Tk thread
+    by polling a result queue with ``after()``.
+
+    :param root: The Tk root window used for ``after()`` polling.
+    :type root: tk.Tk
+    :param on_busy: Called on the Tk thread with True/False as work starts and drains.
+    :type on_busy: callable
+    :param poll_ms: Polling interval in milliseconds.
+    :type poll_ms: int
+
+    :return: None
+    """
+    def __init__(self, root, on_busy=None, poll_ms=25):
+        self.root = root
+        self.on_busy = on_busy
+        self.poll_ms = poll_ms
+        self.pending = 0
+        self._latest = {}
+        self._requests = queue.Queue()
+        self._results = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="school-db", daemon=True)
+        self._thread.start()
+        self._after = root.after(poll_ms, self._poll)
+
+    def submit(self, fn, *args, on_done=None, on_error=None, key=None):
+        """
+        Queue ``fn(*args)`` on the database thread.
+
+        :param fn: Function to run.
+        :type fn: callable
+        :param on_done: Called on the Tk thread with the result.
+        :type on_done: callable
+        :param on_error: Called on the Tk thread with the exception.
+        :type on_error: callable
+        :param key: Supersede key; an older pending request with the same key is cancelled.
+        :type key: str
+        :return: The request, which can be cancelled
+        :rtype: DbRequest
+        """
+        req = DbRequest(fn, args, on_done, on_error, key)
+        if key is not None:
+            old = self._latest.get(key)
+            if old is not None:
+                old.cancel()
+            self._latest[key] = req
+        self.pending += 1
+        if self.pending == 1 and self.on_busy:
+            self.on_busy(True)
+        self._requests.put(req)
+        return req
+
+    def post(self, fn, *args):
+        """
+        Run ``fn(*args)`` on the Tk thread; safe to call from any thread.
+
+        :param fn: Function to run.
+        :type fn: callable
+        :return: None
+        """
+        self._results.put((fn, args))
+
+    def stop(self):
+        """
+        Stop polling and let the database thread finish its queue and close its connection.
+
+        :return: None
+        """
+        self.root.after_cancel(self._after)
+        self._requests.put(None)
+
+    def _run(self):
+        while True:
+            req = self._requests.get()
+            if req is None:
+                break
+            if not req.cancelled:
+                try:
+                    req.result = req.fn(*req.args)
+                except Exception as ex:
+                    req.error = ex
+            self._results.put(req)
+        db.close_conn()
+
+    def _call(self, fn, *args):
+        # a failing callback is reported the way Tk reports its own callback
+        # errors and must not stop the polling loop
+        try:
+            fn(*args)
+        except Exception:
+            self.root.report_callback_exception(*sys.exc_info())
+
+    def _poll(self):
+        delivered = False
+        try:
+            while True:
+                try:
+                    item = self._results.get_nowait()
+                except queue.Empty:
+                    break
+                if isinstance(item, tuple):
+                    self._call(item[0], *item[1])
+                    continue
+                self.pending -= 1
+                delivered = True
+                if item.key is not None and self._latest.get(item.key) is item:
+                    del self._latest[item.key]
+                if not item.cancelled:
+                    if item.error is not None:
+                        if item.on_error: self._call(item.on_error, item.error)
+                    elif item.on_done:
+                        self._call(item.on_done, item.result)
+            # only on the transition to idle, not on every tick while idle
+            if delivered and self.pending == 0 and self.on_busy:
+                self._call(self.on_busy, False)
+        finally:
+            self._after = self.root.after(self.poll_ms, self._poll)
+
+class VirtualTree(ttk.Frame):
+    """
+    Treeview that only materialises the rows inside the visible scroll window.
+
+    Rows are kept as plain tuples keyed by primary key. The underlying Treeview only ever
+    holds the handful of items that fit on screen, and scrolling rebinds those items to
+    other rows. Refreshes apply a keyed diff, so an unchanged row costs nothing and an
+    edited row only touches the widget if it is on screen.
+
+    :param master: Parent widget.
+    :type master: tk.Widget
+    :param columns: Column identifiers.
+    :type columns: tuple
+    :param key: Function returning the primary key of a row.
+    :type key: callable
+    :param height: Initial number of visible rows.
+    :type height: int
+
+    :return: None
+    """
+    def __init__(self, master, columns, key=lambda r: r[0], height=10):
+        super().__init__(master)
+        self.key = key
+        self.visible = height
+        self.tv = ttk.Treeview(self, columns=columns, show="headings", height=height)
+        self.sb = ttk.Scrollbar(self, orient="vertical", command=self.yview)
+        self.tv.pack(side="left", fill="both", expand=True)
+        self.sb.pack(side="right", fill="y")
+        self._keys = []
+        self._rows = {}
+        self._iids = {}
+        self._top = 0
+        self._selected = None
+        # set while dispatching a <<TreeviewSelect>> that only re-selects the
+        # remembered row after it scrolled back into view
+        self._restoring = False
+        self.tv.bind("<Configure>", self._on_resize)
+        self.tv.bind("<MouseWheel>", lambda e: self.yview("scroll", -1 if e.delta > 0 else 1, "units"))
+        self.tv.bind("<Button-4>", lambda e: self.yview("scroll", -1, "units"))
+        self.tv.bind("<Button-5>", lambda e: self.yview("scroll", 1, "units"))
+        self.tv.bind("<<TreeviewSelect>>", self._on_select, add="+")
+
+    def heading(self, column, **kw):
+        """Configure a column heading (passed through to the Treeview)."""
+        return self.tv.heading(column, **kw)
+
+    def column(self, column, **kw):
+        """Configure a column (passed through to the Treeview)."""
+        return self.tv.column(column, **kw)
+
+    def bind(self, sequence=None, func=None, add=None):
+        """
+        Bind an event on the underlying Treeview.
+
+        Select handlers are not called for the selection the tree restores itself when the
+        selected row scrolls back into view, so they only see selections the user made.
+        """
+        if sequence == "<<TreeviewSelect>>" and func is not None:
+            handler = func
+            func = lambda e: None if self._restoring else handler(e)
+        return self.tv.bind(sequence, func, "+" if add is None else add)
+
+    def selection(self):
+        """
+        Return the item ids currently selected.
+
+        :return: Selected item ids
+        :rtype: tuple
+        """
+        return self.tv.selection()
+
+    def row(self, iid):
+        """
+        Return the row tuple behind a Treeview item id.
+
+        :param iid: Item id from :meth:`selection`.
+        :type iid: str
+        :return: The row, or None
+        :rtype: tuple
+        """
+        k = self._iids.get(iid)
+        return None if k is None else self._rows.get(k)
+
+    def keys(self):
+        """
+        Return every key in display order.
+
+        :return: Keys
+        :rtype: list
+        """
+        return list(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def get(self, k):
+        """
+        Return the row stored under key ``k``.
+
+        :param k: Row key.
+        :return: The row, or None
+        :rtype: tuple
+        """
+        return self._rows.get(k)
+
+    def keys_where(self, pred):
+        """
+        Return the keys whose row satisfies ``pred``.
+
+        :param pred: Function taking a row and returning a bool.
+        :type pred: callable
+        :return: Matching keys
+        :rtype: list
+        """
+        return [k for k in self._keys if pred(self._rows[k])]
+
+    def keys_prefixed(self, prefix):
+        """
+        Return the tuple keys that start with ``prefix``, using the sorted key order.
+
+        :param prefix: Leading key components.
+        :type prefix: tuple
+        :return: Matching keys
+        :rtype: list
+        """
+        i = bisect.bisect_left(self._keys, prefix)
+        out = []
+        while i < len(self._keys) and self._keys[i][:len(prefix)] == prefix:
+            out.append(self._keys[i])
+            i += 1
+        return out
+
+    def patch(self, rows, keys=()):
+        """
+        Upsert ``rows`` and drop any of ``keys`` that are not among them, then render once.
+
+        :param rows: Fresh row tuples.
+        :type rows: iterable
+        :param keys: Keys that were touched; those missing from ``rows`` are removed.
+        :type keys: iterable
+        :return: None
+        """
+        fresh = set()
+        for r in rows:
+            k = self.key(r)
+            fresh.add(k)
+            if k not in self._rows:
+                bisect.insort(self._keys, k)
+            self._rows[k] = tuple(r)
+        gone = {k for k in keys if k not in fresh and k in self._rows}
+        if gone:
+            for k in gone:
+                del self._rows[k]
+            self._keys = [k for k in self._keys if k not in gone]
+        self._render()
+
+    def set_rows(self, rows):
+        """
+        Replace the contents with ``rows`` by applying a keyed diff.
+
+        Rows are shown in the order given.
+
+        :param rows: Iterable of row tuples.
+        :type rows: iterable
+        :return: Number of inserted, updated and deleted rows
+        :rtype: tuple
+        """
+        new = {}
+        keys = []
+        for r in rows:
+            k = self.key(r)
+            new[k] = tuple(r)
+            keys.append(k)
+        old, old_keys = self._rows, self._keys
+        inserted = sum(1 for k in keys if k not in old)
+        updated = sum(1 for k in keys if k in old and old[k] != new[k])
+        deleted = len(old) - (len(keys) - inserted)
+        self._keys, self._rows = keys, new
+        if inserted or updated or deleted or keys != old_keys:
+            self._render()
+        return inserted, updated, deleted
+
+    def upsert(self, row):
+        """
+        Insert or update one row, keeping keys sorted.
+
+        :param row: Row tuple.
+        :type row: tuple
+        :return: None
+        """
+        k = self.key(row)
+        if k not in self._rows:
+            bisect.insort(self._keys, k)
+        self._rows[k] = tuple(row)
+        self._render()
+
+    def remove(self, k):
+        """
+        Remove the row with key ``k`` if present.
+
+        :param k: Row key.
+        :return: None
+        """
+        if self._rows.pop(k, None) is None:
+            return
+        i = bisect.bisect_left(self._keys, k)
+        if i < len(self._keys) and self._keys[i] == k:
+            del self._keys[i]
+        else:
+            self._keys.remove(k)
+        self._render()
+
+    def yview(self, *args):
+        """
+        Scroll the window; accepts the scrollbar ``moveto``/``scroll`` commands.
+
+        :return: None
+        """
+        n = len(self._keys)
+        if not args or not n:
+            return
+        if args[0] == "moveto":
+            self._top = int(float(args[1]) * n)
+        elif args[0] == "scroll":
+            step = int(args[1]) * (self.visible if args[2] == "pages" else 1)
+            self._top += step
+        self._render()
+
+    def _on_resize(self, e):
+        rowheight = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+        visible = max(1, (e.height - 24) // rowheight + 1)
+        if visible != self.visible:
+            self.visible = visible
+            self._render()
+
+    def _on_select(self, e):
+        # bound first, so it runs before the handlers added through bind();
+        # the event is queued, so compare keys rather than flag the render call
+        sel = self.tv.selection()
+        k = self._iids.get(sel[0]) if sel else None
+        self._restoring = k is not None and k == self._selected
+        if k is not None:
+            self._selected = k
+
+    def _render(self):
+        n = len(self._keys)
+        self._top = max(0, min(self._top, n - self.visible))
+        window = self._keys[self._top:self._top + self.visible]
+        iids = {}
+        for k in window:
+            iids["\x1f".join(k) if isinstance(k, tuple) else str(k)] = k
+        stale = [i for i in self.tv.get_children() if i not in iids]
+        if stale:
+            self.tv.delete(*stale)
+        for pos, (iid, k) in enumerate(iids.items()):
+            if self.tv.exists(iid):
+                self.tv.item(iid, values=self._rows[k])
+                self.tv.move(iid, "", pos)
+            else:
+                self.tv.insert("", pos, iid=iid, values=self._rows[k])
+        self._iids = iids
+        if self._selected in window:
+            iid = next(i for i, k in iids.items() if k == self._selected)
+            if self.tv.selection() != (iid,):
+                self.tv.selection_set(iid)
+        if n:
+            self.sb.set(self._top / n, min(1.0, (self._top + len(window)) / n))
+        else:
+            self.sb.set(0.0, 1.0)
 
 class App(tk.Tk):
     """
@@ -23,6 +444,8 @@ class App(tk.Tk):
     :type reg_tab: ttk.Frame
     :param search_tab: Frame for searching records.
     :type search_tab: ttk.Frame
+    :param diag_tab: Frame showing query timings and lock statistics.
+    :type diag_tab: ttk.Frame
 
     :return: None
 
@@ -40,17 +463,91 @@ class App(tk.Tk):
         self.courses_tab = ttk.Frame(nb)
         self.reg_tab = ttk.Frame(nb)
         self.search_tab = ttk.Frame(nb)
+        self.diag_tab = ttk.Frame(nb)
         nb.add(self.students_tab, text="Students")
         nb.add(self.instructors_tab, text="Instructors")
         nb.add(self.courses_tab, text="Courses")
         nb.add(self.reg_tab, text="Registrations")
         nb.add(self.search_tab, text="Search")
+        nb.add(self.diag_tab, text="Diagnostics")
         self.build_students()
         self.build_instructors()
         self.build_courses()
         self.build_reg()
         self.build_search()
+        self.build_diagnostics()
+        self.build_status()
+        self.worker = DbWorker(self, on_busy=self.set_busy)
+        self.worker.submit(db.init_db, on_error=self.show_error)
         self.refresh_all()
+        # events are published on the database thread; hop to the Tk thread first
+        self._unsubscribe = events.subscribe(lambda ev: self.worker.post(self.on_change, ev))
+
+    def destroy(self):
+        """
+        Stop listening for change events, stop the database worker and close the window.
+
+        :return: None
+        """
+        self._unsubscribe()
+        self.worker.stop()
+        super().destroy()
+
+    def build_status(self):
+        """
+        Build the status bar with the busy indicator.
+
+        :param status: Label showing whether database work is in progress.
+        :type status: ttk.Label
+        :param busy_bar: Indeterminate progress bar shown while work is in progress.
+        :type busy_bar: ttk.Progressbar
+
+        :return: None
+        """
+        bar = ttk.Frame(self); bar.pack(side="bottom", fill="x", padx=8, pady=(0, 6))
+        self.status = ttk.Label(bar, text="Ready"); self.status.pack(side="left")
+        self.busy_bar = ttk.Progressbar(bar, mode="indeterminate", length=120)
+
+    def set_busy(self, busy):
+        """
+        Show or hide the busy indicator.
+
+        :param busy: Whether database work is in progress.
+        :type busy: bool
+
+        :return: None
+        """
+        if busy:
+            self.status.config(text="Working...")
+            self.busy_bar.pack(side="right"); self.busy_bar.start(15)
+        else:
+            self.status.config(text="Ready")
+            self.busy_bar.stop(); self.busy_bar.pack_forget()
+
+    def show_error(self, ex):
+        """
+        Report an error from the database thread.
+
+        :param ex: The exception raised.
+        :type ex: Exception
+
+        :return: None
+        """
+        messagebox.showerror("Error", str(ex))
+
+    def call(self, fn, *args, on_done=None):
+        """
+        Run a services call on the database worker, reporting failures in a message box.
+
+        :param fn: The services function.
+        :type fn: callable
+        :param on_done: Called on the Tk thread with the result.
+        :type on_done: callable
+
+        :return: The queued request
+        :rtype: DbRequest
+        """
+        return self.worker.submit(fn, *args, on_done=on_done, on_error=self.show_error)
 
     def build_students(self):
         """
@@ -69,7 +566,7 @@ class App(tk.Tk):
         :param semail: StringVar for student email input.
         :type semail: tk.StringVar
         :param student_tv: Treeview widget to display the list of students.
-        :type student_tv: ttk.Treeview
+        :type student_tv: VirtualTree
 
         :return: None
         """
@@ -83,7 +580,9 @@ class App(tk.Tk):
         ttk.Button(frm, text="Delete", command=self.delete_student).grid(row=1, column=2)
         ttk.Button(frm, text="Save JSON", command=self.save_json).grid(row=1, column=3)
         ttk.Button(frm, text="Load JSON", command=self.load_json).grid(row=1, column=4)
-        self.student_tv = ttk.Treeview(f, columns=("id","name","age","email"), show="headings", height=10)
+        ttk.Button(frm, text="Export CSV", command=lambda: self.export_csv("students")).grid(row=1, column=5)
+        ttk.Button(frm, text="Import CSV", command=lambda: self.import_csv("students")).grid(row=1, column=6)
+        self.student_tv = VirtualTree(f, ("id","name","age","email"), height=10)
         for c in ("id","name","age","email"):
             self.student_tv.heading(c, text=c.title())
             self.student_tv.column(c, width=140, anchor="center")
@@ -107,7 +606,7 @@ class App(tk.Tk):
         :param iemail: StringVar for instructor email input.
         :type iemail: tk.StringVar
         :param instructor_tv: Treeview widget to display the list of instructors.
-        :type instructor_tv: ttk.Treeview
+        :type instructor_tv: VirtualTree
 
         :return: None
         """
@@ -119,7 +618,9 @@ class App(tk.Tk):
         ttk.Button(frm, text="Add", command=self.add_instructor).grid(row=1, column=0, pady=6)
         ttk.Button(frm, text="Edit", command=self.edit_instructor).grid(row=1, column=1)
         ttk.Button(frm, text="Delete", command=self.delete_instructor).grid(row=1, column=2)
-        self.instructor_tv = ttk.Treeview(f, columns=("id","name","age","email"), show="headings", height=10)
+        ttk.Button(frm, text="Export CSV", command=lambda: self.export_csv("instructors")).grid(row=1, column=3)
+        ttk.Button(frm, text="Import CSV", command=lambda: self.import_csv("instructors")).grid(row=1, column=4)
+        self.instructor_tv = VirtualTree(f, ("id","name","age","email"), height=10)
         for c in ("id","name","age","email"):
             self.instructor_tv.heading(c, text=c.title())
             self.instructor_tv.column(c, width=140, anchor="center")
@@ -141,7 +642,7 @@ class App(tk.Tk):
         :param cinstr: Combobox for selecting the instructor for the course.
         :type cinstr: ttk.Combobox
         :param course_tv: Treeview widget to display the list of courses.
-        :type course_tv: ttk.Treeview
+        :type course_tv: VirtualTree
         
         :return: None
         """
@@ -155,7 +656,9 @@ class App(tk.Tk):
         ttk.Button(top, text="Add", command=self.add_course).grid(row=1, column=0, pady=6)
         ttk.Button(top, text="Edit", command=self.edit_course).grid(row=1, column=1)
         ttk.Button(top, text="Delete", command=self.delete_course).grid(row=1, column=2)
-        self.course_tv = ttk.Treeview(f, columns=("id","name","instructor_id","instructor_name"), show="headings", height=10)
+        ttk.Button(top, text="Export CSV", command=lambda: self.export_csv("courses")).grid(row=1, column=3)
+        ttk.Button(top, text="Import CSV", command=lambda: self.import_csv("courses")).grid(row=1, column=4)
+        self.course_tv = VirtualTree(f, ("id","name","instructor_id","instructor_name"), height=10)
         for i,c in enumerate(("id","name","instructor_id","instructor_name")):
             self.course_tv.heading(c, text=c.title())
             self.course_tv.column(c, width=160 if i<2 else 180, anchor="center")
@@ -174,7 +677,7 @@ class App(tk.Tk):
         :param reg_course: Combobox for selecting a course to register the student in.
         :type reg_course: ttk.Combobox
         :param reg_tv: Treeview widget to display the list of registrations.        
-        :type reg_tv: ttk.Treeview
+        :type reg_tv: VirtualTree
 
         :return: None
         """
@@ -186,7 +689,9 @@ class App(tk.Tk):
         self.reg_course = ttk.Combobox(top, values=[], width=25); self.reg_course.grid(row=0, column=3, padx=4)
         ttk.Button(top, text="Register", command=self.register).grid(row=0, column=4, padx=6)
         ttk.Button(top, text="Unregister", command=self.unregister).grid(row=0, column=5, padx=6)
-        self.reg_tv = ttk.Treeview(f, columns=("student_id","student_name","course_id","course_name"), show="headings", height=12)
+        ttk.Button(top, text="Export CSV", command=lambda: self.export_csv("registrations")).grid(row=0, column=6, padx=6)
+        ttk.Button(top, text="Import CSV", command=lambda: self.import_csv("registrations")).grid(row=0, column=7, padx=6)
+        self.reg_tv = VirtualTree(f, ("student_id","student_name","course_id","course_name"), key=lambda r: (r[0], r[2]), height=12)
         for c in ("student_id","student_name","course_id","course_name"):
             self.reg_tv.heading(c, text=c.title()); self.reg_tv.column(c, width=180, anchor="center")
         self.reg_tv.pack(fill="both", expand=True, padx=8, pady=8)
@@ -202,7 +707,7 @@ class App(tk.Tk):
         :param q: StringVar for the search query input.
         :type q: tk.StringVar
         :param search_tv: Treeview widget to display the search results.
-        :type search_tv: ttk.Treeview
+        :type search_tv: VirtualTree
 
         :return: None
         """
@@ -211,7 +716,7 @@ class App(tk.Tk):
         self.q = tk.StringVar()
         ttk.Entry(top, textvariable=self.q, width=50).grid(row=0, column=0, padx=4)
         ttk.Button(top, text="Search", command=self.do_search).grid(row=0, column=1, padx=4)
-        self.search_tv = ttk.Treeview(f, columns=("type","id","name","extra"), show="headings", height=15)
+        self.search_tv = VirtualTree(f, ("type","id","name","extra"), key=lambda r: (r[0], r[1]), height=15)
         for c in ("type","id","name","extra"):
             self.search_tv.heading(c, text=c.title()); self.search_tv.column(c, width=180, anchor="center")
         self.search_tv.pack(fill="both", expand=True, padx=8, pady=8)
@@ -220,23 +725,124 @@ class App(tk.Tk):
         """
         Refresh all data displayed in the application, including students, instructors, courses, and registrations.
 
+        The tables are read on the database worker; a newer refresh supersedes a pending one.
+
+        :return: None
+        """
+        self.worker.submit(services.snapshot, on_done=self.apply_snapshot, on_error=self.show_error, key="refresh")
+
+    def apply_snapshot(self, snap):
+        """
+        Diff a full snapshot into the tables.
+
+        :param snap: Students, instructors, courses and registrations rows.
+        :type snap: tuple
+
         :return: None
         """
-        self.student_tv.delete(*self.student_tv.get_children())
-        for s in services.db.get_students():
-            self.student_tv.insert("", "end", values=s)
-        self.instructor_tv.delete(*self.instructor_tv.get_children())
-        for i in services.db.get_instructors():
-            self.instructor_tv.insert("", "end", values=i)
-        self.course_tv.delete(*self.course_tv.get_children())
-        for c in services.db.get_courses():
-            self.course_tv.insert("", "end", values=c)
-        self.reg_tv.delete(*self.reg_tv.get_children())
-        for r in services.db.get_registrations():
-            self.reg_tv.insert("", "end", values=r)
-        self.cinstr["values"] = [""] + [x[0] for x in services.db.get_instructors()]
-        self.reg_student["values"] = [x[0] for x in services.db.get_students()]
-        self.reg_course["values"] = [x[0] for x in services.db.get_courses()]
+        s, i, c, r = snap
+        self.student_tv.set_rows(s)
+        self.instructor_tv.set_rows(i)
+        self.course_tv.set_rows(c)
+        self.reg_tv.set_rows(r)
+        self.refresh_choices()
+
+    def on_change(self, ev):
+        """
+        Apply a change event from the services layer, touching only the affected rows.
+
+        Fresh rows are read on the database worker (:meth:`gather_change`) and applied here
+        by :meth:`apply_change`. Large batches (e.g. a JSON import) fall back to a full refresh.
+
+        :param ev: The change event.
+        :type ev: school.events.ChangeEvent
+
+        :return: None
+        """
+        if len(ev.keys) > 500:
+            self.refresh_all()
+            return
+        self.worker.submit(self.gather_change, ev, on_done=lambda rows: self.apply_change(ev, rows), on_error=self.show_error)
+
+    def gather_change(self, ev):
+        """
+        Read the rows a change event touched. Runs on the database worker.
+
+        :param ev: The change event.
+        :type ev: school.events.ChangeEvent
+
+        :return: Fresh rows for the entity and for dependent tables
+        :rtype: dict
+        """
+        keys, dependents = ev.keys, ev.op == "update"
+        out = {}
+        if ev.entity == "student":
+            out["rows"] = db.get_students_by_ids(keys)
+            if dependents:
+                out["regs"] = {k: db.get_registrations_by_student(k) for k in keys}
+        elif ev.entity == "instructor":
+            out["rows"] = db.get_instructors_by_ids(keys)
+            if dependents:
+                out["courses"] = {k: db.get_courses_by_instructor(k) for k in keys}
+        elif ev.entity == "course":
+            out["rows"] = db.get_courses_by_ids(keys)
+            if dependents:
+                out["regs"] = {k: db.get_registrations_by_course(k) for k in keys}
+        elif ev.entity == "registration":
+            out["rows"] = db.get_registrations_by_keys(keys)
+        return out
+
+    def apply_change(self, ev, fresh):
+        """
+        Patch the tables with rows read by :meth:`gather_change`.
+
+        Rows that only need to disappear (cascaded deletes) are handled from the rows
+        already loaded, without another query.
+
+        :param ev: The change event.
+        :type ev: school.events.ChangeEvent
+        :param fresh: Rows read on the database worker.
+        :type fresh: dict
+
+        :return: None
+        """
+        keys = ev.keys
+        if ev.entity == "student":
+            self.student_tv.patch(fresh["rows"], keys)
+            for sid in keys:
+                if ev.op == "update":
+                    self.reg_tv.patch(fresh["regs"][sid])
+                elif ev.op == "delete":
+                    self.reg_tv.patch([], self.reg_tv.keys_prefixed((sid,)))
+        elif ev.entity == "instructor":
+            self.instructor_tv.patch(fresh["rows"], keys)
+            for iid in keys:
+                if ev.op == "update":
+                    self.course_tv.patch(fresh["courses"][iid])
+                elif ev.op == "delete":
+                    touched = self.course_tv.keys_where(lambda r: r[2] == iid)
+                    self.course_tv.patch([self.course_tv.get(k)[:2] + (None, None) for k in touched])
+        elif ev.entity == "course":
+            self.course_tv.patch(fresh["rows"], keys)
+            for cid in keys:
+                if ev.op == "update":
+                    self.reg_tv.patch(fresh["regs"][cid])
+                elif ev.op == "delete":
+                    self.reg_tv.patch([], self.reg_tv.keys_where(lambda r: r[2] == cid))
+        elif ev.entity == "registration":
+            self.reg_tv.patch(fresh["rows"], keys)
+        if ev.entity != "registration" and ev.op != "update":
+            self.refresh_choices()
+
+    def refresh_choices(self):
+        """
+        Refill the instructor, student and course comboboxes from the rows already loaded in the tables.
+
+        :return: None
+        """
+        self.cinstr["values"] = [""] + self.instructor_tv.keys()
+        self.reg_student["values"] = self.student_tv.keys()
+        self.reg_course["values"] = self.course_tv.keys()
 
     def on_student_sel(self, e):
         """
@@ -252,7 +858,8 @@ class App(tk.Tk):
         """
         sel = self.student_tv.selection()
         if not sel: return
-        v = self.student_tv.item(sel[0])["values"]
+        v = self.student_tv.row(sel[0])
+        if v is None: return
         self.sid.set(v[0]); self.sname.set(v[1]); self.sage.set(v[2]); self.semail.set(v[3])
 
     def on_instructor_sel(self, e):
@@ -270,7 +877,8 @@ class App(tk.Tk):
         """
         sel = self.instructor_tv.selection()
         if not sel: return
-        v = self.instructor_tv.item(sel[0])["values"]
+        v = self.instructor_tv.row(sel[0])
+        if v is None: return
         self.iid.set(v[0]); self.iname.set(v[1]); self.iage.set(v[2]); self.iemail.set(v[3])
 
     def on_course_sel(self, e):
@@ -288,7 +896,8 @@ class App(tk.Tk):
         """
         sel = self.course_tv.selection()
         if not sel: return
-        v = self.course_tv.item(sel[0])["values"]
+        v = self.course_tv.row(sel[0])
+        if v is None: return
         self.cid.set(v[0]); self.cname.set(v[1]); self.cinstr.set(v[2] if v[2] else "")
 
     def add_student(self):
@@ -297,11 +906,7 @@ class App(tk.Tk):
 
         :return: None
         """
-        try:
-            services.add_student(self.sid.get(), self.sname.get(), self.sage.get(), self.semail.get())
-            self.refresh_all()
-        except Exception as ex:
-            messagebox.showerror("Error", str(ex))
+        self.call(services.add_student, self.sid.get(), self.sname.get(), self.sage.get(), self.semail.get())
 
     def edit_student(self):
         """ 
@@ -309,11 +914,7 @@ class App(tk.Tk):
 
         :return: None
         """
-        try:
-            services.edit_student(self.sid.get(), self.sname.get(), self.sage.get(), self.semail.get())
-            self.refresh_all()
-        except Exception as ex:
-            messagebox.showerror("Error", str(ex))
+        self.call(services.edit_student, self.sid.get(), self.sname.get(), self.sage.get(), self.semail.get())
 
     def delete_student(self):
         """
@@ -322,8 +923,7 @@ class App(tk.Tk):
         :return: None
         """
         if not self.sid.get(): return
-        services.remove_student(self.sid.get())
-        self.refresh_all()
+        self.call(services.remove_student, self.sid.get())
 
     def add_instructor(self):
         """
@@ -331,11 +931,7 @@ class App(tk.Tk):
         
         :return: None
         """
-        try:
-            services.add_instructor(self.iid.get(), self.iname.get(), self.iage.get(), self.iemail.get())
-            self.refresh_all()
-        except Exception as ex:
-            messagebox.showerror("Error", str(ex))
+        self.call(services.add_instructor, self.iid.get(), self.iname.get(), self.iage.get(), self.iemail.get())
 
     def edit_instructor(self):
         """
@@ -343,11 +939,7 @@ class App(tk.Tk):
 
         :return: None
         """
-        try:
-            services.edit_instructor(self.iid.get(), self.iname.get(), self.iage.get(), self.iemail.get())
-            self.refresh_all()
-        except Exception as ex:
-            messagebox.showerror("Error", str(ex))
+        self.call(services.edit_instructor, self.iid.get(), self.iname.get(), self.iage.get(), self.iemail.get())
 
     def delete_instructor(self):
         """
@@ -356,8 +948,7 @@ class App(tk.Tk):
         :return: None
         """
         if not self.iid.get(): return
-        services.remove_instructor(self.iid.get())
-        self.refresh_all()
+        self.call(services.remove_instructor, self.iid.get())
 
     def add_course(self):
         """
@@ -365,11 +956,7 @@ class App(tk.Tk):
 
         :return: None
         """
-        try:
-            services.add_course(self.cid.get(), self.cname.get(), self.cinstr.get() or None)
-            self.refresh_all()
-        except Exception as ex:
-            messagebox.showerror("Error", str(ex))
+        self.call(services.add_course, self.cid.get(), self.cname.get(), self.cinstr.get() or None)
 
     def edit_course(self):
         """
@@ -377,11 +964,7 @@ class App(tk.Tk):
 
         :return: None
         """
-        try:
-            services.edit_course(self.cid.get(), self.cname.get(), self.cinstr.get() or None)
-            self.refresh_all()
-        except Exception as ex:
-            messagebox.showerror("Error", str(ex))
+        self.call(services.edit_course, self.cid.get(), self.cname.get(), self.cinstr.get() or None)
 
     def delete_course(self):
         """
@@ -390,8 +973,7 @@ class App(tk.Tk):
         :return: None
         """
         if not self.cid.get(): return
-        services.remove_course(self.cid.get())
-        self.refresh_all()
+        self.call(services.remove_course, self.cid.get())
 
     def register(self):
         """
@@ -399,11 +981,7 @@ class App(tk.Tk):
 
         :return: None
         """
-        try:
-            services.register(self.reg_student.get(), self.reg_course.get())
-            self.refresh_all()
-        except Exception as ex:
-            messagebox.showerror("Error", str(ex))
+        self.call(services.register, self.reg_student.get(), self.reg_course.get())
 
     def unregister(self):
         """
@@ -411,11 +989,7 @@ class App(tk.Tk):
 
         :return: None
         """
-        try:
-            services.unregister(self.reg_student.get(), self.reg_course.get())
-            self.refresh_all()
-        except Exception as ex:
-            messagebox.showerror("Error", str(ex))
+        self.call(services.unregister, self.reg_student.get(), self.reg_course.get())
 
     def do_search(self):
         """
@@ -424,14 +998,22 @@ class App(tk.Tk):
         :return: None
         """
         term = self.q.get()
-        s,i,c = services.query(term)
-        self.search_tv.delete(*self.search_tv.get_children())
-        for x in s:
-            self.search_tv.insert("", "end", values=("Student", x[0], x[1], x[3]))
-        for x in i:
-            self.search_tv.insert("", "end", values=("Instructor", x[0], x[1], x[3]))
-        for x in c:
-            self.search_tv.insert("", "end", values=("Course", x[0], x[1], x[2] if x[2] else ""))
+        # a newer search supersedes one that is still queued or running
+        self.worker.submit(services.query, term, on_done=self.show_results, on_error=self.show_error, key="search")
+
+    def show_results(self, results):
+        """
+        Display search results.
+
+        :param results: Matching students, instructors and courses.
+        :type results: tuple
+
+        :return: None
+        """
+        s,i,c = results
+        self.search_tv.set_rows([("Student", x[0], x[1], x[3]) for x in s]
+                                + [("Instructor", x[0], x[1], x[3]) for x in i]
+                                + [("Course", x[0], x[1], x[2] if x[2] else "") for x in c])
 
     def save_json(self):
         """
@@ -439,9 +1021,9 @@ class App(tk.Tk):
 
         :return: None
         """
-        path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON","*.json")])
+        path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON","*.json"),("NDJSON","*.ndjson")])
         if not path: return
-        storage.export_json(path)
+        self.call(storage.export_json, path)
 
     def load_json(self):
         """
@@ -449,10 +1031,136 @@ class App(tk.Tk):
         
         :return: None
         """
-        path = filedialog.askopenfilename(filetypes=[("JSON","*.json")])
+        path = filedialog.askopenfilename(filetypes=[("JSON","*.json"),("NDJSON","*.ndjson")])
         if not path: return
-        storage.import_json(path)
-        self.refresh_all()
+        self.call(storage.import_json, path, on_done=self.import_done)
+
+    def import_done(self, report):
+        """
+        Report rejected records once an import finishes.
+
+        :param report: The import report.
+        :type report: dict
+
+        :return: None
+        """
+        if report and report.get("error"):
+            messagebox.showwarning("Import", f"{report['error']}. Records before that point were loaded.")
+        elif report and report["rejected_total"]:
+            messagebox.showwarning("Import", f"{report['rejected_total']} record(s) were rejected.")
+
+    def export_csv(self, table):
+        """
+        Export one table to a CSV file; a ``.gz`` name is gzip-compressed.
+
+        :param table: Table name.
+        :type table: str
+
+        :return: None
+        """
+        path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV","*.csv"),("Compressed CSV","*.csv.gz")])
+        if not path: return
+        self.call(csvio.export_csv, table, path)
+
+    def import_csv(self, table):
+        """
+        Import rows of one table from a CSV file, updating rows that already exist.
+
+        :param table: Table name.
+        :type table: str
+
+        :return: None
+        """
+        path = filedialog.askopenfilename(filetypes=[("CSV","*.csv *.csv.gz")])
+        if not path: return
+        self.call(csvio.import_csv, path, table, on_done=self.import_done)
+
+    def build_diagnostics(self):
+        """
+        Build the diagnostics view: query instrumentation switch, latency table and slow-query log.
+
+        :param diag_on: Whether ``db`` instrumentation is on.
+        :type diag_on: tk.BooleanVar
+        :param diag_slow: Slow-query threshold in milliseconds.
+        :type diag_slow: tk.StringVar
+        :param diag_summary: Label with cache and lock counters.
+        :type diag_summary: ttk.Label
+        :param diag_tv: Latency per entry point and per statement, slowest total first.
+        :type diag_tv: ttk.Treeview
+        :param slow_tv: Statements slower than the threshold, with their query plans.
+        :type slow_tv: ttk.Treeview
+
+        :return: None
+        """
+        f = self.diag_tab
+        top = ttk.Frame(f); top.pack(side="top", fill="x", padx=8, pady=8)
+        self.diag_on = tk.BooleanVar(value=db.stats()["enabled"])
+        self.diag_slow = tk.StringVar(value=str(db.stats()["slow_ms"]))
+        ttk.Checkbutton(top, text="Time queries", variable=self.diag_on, command=self.apply_instrumentation).grid(row=0, column=0, padx=4)
+        ttk.Label(top, text="Slow (ms)").grid(row=0, column=1, padx=4)
+        ttk.Entry(top, textvariable=self.diag_slow, width=8).grid(row=0, column=2, padx=4)
+        ttk.Button(top, text="Apply", command=self.apply_instrumentation).grid(row=0, column=3, padx=4)
+        ttk.Button(top, text="Reset", command=lambda: (db.reset_stats(), self.refresh_diagnostics(False))).grid(row=0, column=4, padx=4)
+        self.diag_summary = ttk.Label(f, text="")
+        self.diag_summary.pack(side="top", anchor="w", padx=8)
+        cols = ("kind","name","count","total","mean","p50","p90","p99","max")
+        self.diag_tv = ttk.Treeview(f, columns=cols, show="headings", height=12)
+        for c in cols:
+            self.diag_tv.heading(c, text=c.title() + (" ms" if c not in ("kind","name","count") else ""))
+            self.diag_tv.column(c, width=420 if c == "name" else 70, anchor="w" if c == "name" else "center")
+        self.diag_tv.pack(fill="both", expand=True, padx=8, pady=4)
+        cols = ("time","ms","sql","plan")
+        self.slow_tv = ttk.Treeview(f, columns=cols, show="headings", height=6)
+        for c, w in zip(cols, (80, 70, 420, 380)):
+            self.slow_tv.heading(c, text=c.upper() if c == "sql" else c.title()); self.slow_tv.column(c, width=w, anchor="w")
+        self.slow_tv.pack(fill="both", expand=True, padx=8, pady=(4, 8))
+        self.refresh_diagnostics()
+
+    def apply_instrumentation(self):
+        """
+        Turn query timing on or off with the threshold from the entry box.
+
+        :return: None
+        """
+        try:
+            slow = float(self.diag_slow.get())
+        except ValueError:
+            messagebox.showerror("Error", "Slow threshold must be a number of milliseconds"); return
+        db.instrument(self.diag_on.get(), slow_ms=slow)
+        self.refresh_diagnostics(False)
+
+    def refresh_diagnostics(self, repeat=True):
+        """
+        Redraw the diagnostics view once a second while it is visible.
+
+        The numbers are in-memory counters, so they are read on the Tk thread.
+
+        :param repeat: Schedule the next refresh.
+        :type repeat: bool
+
+        :return: None
+        """
+        if repeat:
+            self.after(1000, self.refresh_diagnostics)
+        if not self.diag_tab.winfo_ismapped():
+            return
+        st, cache = db.stats(), services.cache_stats()
+        locks = st["locks"]
+        self.diag_summary.config(text=(
+            f"Timing {'on' if st['enabled'] else 'off'}   "
+            f"cache {cache['hits']} hits / {cache['misses']} misses ({cache['hit_rate']:.0%})   "
+            f"write locks {locks['acquired']}, {locks['contended']} waited {locks['wait'] * 1000:.0f} ms, "
+            f"{locks['retries']} retries, {locks['failures']} busy errors"))
+        rows = [("call", k, v) for k, v in st["functions"].items()] + [("sql", k, v) for k, v in st["statements"].items()]
+        rows.sort(key=lambda r: -r[2]["total_ms"])
+        self.diag_tv.delete(*self.diag_tv.get_children())
+        for kind, name, h in rows[:100]:
+            self.diag_tv.insert("", "end", values=(kind, name, h["count"], f"{h['total_ms']:.1f}", f"{h['mean_ms']:.3f}",
+                                                   f"{h['p50_ms']:.3f}", f"{h['p90_ms']:.3f}", f"{h['p99_ms']:.3f}", f"{h['max_ms']:.3f}"))
+        self.slow_tv.delete(*self.slow_tv.get_children())
+        for e in reversed(st["slow"]):
+            self.slow_tv.insert("", "end", values=(time.strftime("%H:%M:%S", time.localtime(e["at"])), f"{e['ms']:.1f}",
+                                                   e["sql"], " | ".join(e["plan"] or ())))
 
 if __name__ == "__main__":
 
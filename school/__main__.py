@@ -0,0 +1,211 @@
+import argparse, os, sys
+
+# Headless entry point for scripts and cron jobs:
+#
+#   python -m school [--db PATH] export|import|search|backup|stats|verify ...
+#
+# Only argparse is imported up front; every command imports the modules it
+# needs when it runs, so `search` or `stats` never load the import/export
+# code, and nothing here touches the GUI packages.
+
+def _db(args):
+    from . import db
+    if args.db:
+        db.DB_PATH = args.db
+    if args.busy_timeout is not None:
+        db.configure(busy_timeout=args.busy_timeout)
+    return db
+
+def _positive(text):
+    # an argparse type; its errors become usage errors (exit status 2)
+    try:
+        n = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {text!r}") from None
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {n}")
+    return n
+
+def _out(args, doc, lines):
+    if args.json:
+        import json
+        json.dump(doc, sys.stdout, indent=2, default=str)
+        sys.stdout.write("\n")
+    else:
+        for line in lines:
+            print(line)
+
+def _table_format(path):
+    # csv for one table, otherwise the whole database as JSON/NDJSON
+    name = path.lower()
+    if name.endswith((".csv", ".csv.gz")):
+        return "csv"
+    return "ndjson" if name.endswith((".ndjson", ".jsonl")) else "json"
+
+def cmd_export(args):
+    db = _db(args)
+    db.init_db()
+    fmt = _table_format(args.path)
+    if fmt == "csv":
+        if not args.table:
+            raise SystemExit("export: CSV holds one table; pass --table")
+        from . import csvio
+        n = csvio.export_csv(args.table, args.path)
+        _out(args, {args.table: n}, [f"{args.table}: {n} rows -> {args.path}"])
+    else:
+        if args.table:
+            raise SystemExit("export: --table needs a .csv or .csv.gz path")
+        from . import storage
+        counts = storage.export_json(args.path, fmt)
+        _out(args, counts, [f"{t}: {n} rows" for t, n in counts.items()] + [f"-> {args.path}"])
+    return 0
+
+def cmd_import(args):
+    _db(args)
+    if not os.path.exists(args.path):
+        raise SystemExit(f"import: {args.path} does not exist")
+    if _table_format(args.path) == "csv" or args.table:
+        from . import csvio
+        report = csvio.import_csv(args.path, args.table, args.batch_size, upsert=not args.no_upsert)
+        lines = [f"{report['table']}: {report['rows']} rows, {report['inserted']} inserted, {report['updated']} updated, "
+                 f"{report['duplicate']} duplicate, {report['invalid']} invalid"]
+    else:
+        from . import storage
+        report = storage.import_json(args.path, args.batch_size)
+        lines = [f"{t}: {c['inserted']} inserted, {c['duplicate']} duplicate, {c['invalid']} invalid"
+                 for t, c in report.items() if isinstance(c, dict)]
+    for r in report["rejected"][:args.show_rejected]:
+        where = r.get("line", r.get("index"))
+        lines.append(f"  rejected {r.get('table') or report.get('table')} #{where}: {r['reason']}")
+    lines.append(f"{report['rejected_total']} rejected")
+    if report.get("error"):
+        lines.append(f"stopped: {report['error']}")
+    _out(args, report, lines)
+    if report.get("error"):
+        return 1
+    # rejects are normal in day-to-day imports; --strict makes them fail the run
+    return 2 if args.strict and report["rejected_total"] else 0
+
+def cmd_search(args):
+    db = _db(args)
+    db.init_db()
+    students, instructors, courses = db.search(args.term, args.limit)
+    doc = {"students": students, "instructors": instructors, "courses": courses}
+    lines = ([f"student\t{r[0]}\t{r[1]}\t{r[3]}" for r in students]
+             + [f"instructor\t{r[0]}\t{r[1]}\t{r[3]}" for r in instructors]
+             + [f"course\t{r[0]}\t{r[1]}\t{r[2]}" for r in courses])
+    _out(args, doc, lines)
+    return 0 if lines else 1
+
+def cmd_backup(args):
+    db = _db(args)
+    db.init_db()
+    if args.store:
+        from .snapshots import SnapshotStore
+        store = SnapshotStore(args.store)
+        snap = store.create(note=args.note)
+        if args.keep_last is not None:
+            store.prune(keep_last=args.keep_last)
+        _out(args, snap, [f"snapshot {snap['id']} in {args.store}"])
+    else:
+        if not args.path:
+            raise SystemExit("backup: pass a destination path or --store")
+        db.backup_db(args.path, verify=not args.no_verify)
+        _out(args, {"path": args.path, "bytes": os.path.getsize(args.path)},
+             [f"{args.path}: {os.path.getsize(args.path)} bytes"])
+    return 0
+
+def cmd_stats(args):
+    db = _db(args)
+    db.init_db()
+    conn = db.get_conn()
+    doc = {
+        "path": db.DB_PATH,
+        "bytes": os.path.getsize(db.DB_PATH),
+        "schema_version": db.schema_version(),
+        "journal_mode": conn.execute("PRAGMA journal_mode").fetchone()[0],
+        "pages": conn.execute("PRAGMA page_count").fetchone()[0],
+        "free_pages": conn.execute("PRAGMA freelist_count").fetchone()[0],
+        "rows": {"students": db.count_students(), "instructors": db.count_instructors(),
+                 "courses": db.count_courses(), "registrations": db.count_registrations()},
+    }
+    lines = [f"{k}: {v}" for k, v in doc.items() if k != "rows"] + [f"{t}: {n}" for t, n in doc["rows"].items()]
+    _out(args, doc, lines)
+    return 0
+
+def cmd_verify(args):
+    db = _db(args)
+    if not os.path.exists(db.DB_PATH):
+        raise SystemExit(f"verify: {db.DB_PATH} does not exist")
+    # a plain read-only connection: get_conn() would apply the pragma set and
+    # switch the journal mode of the file being inspected
+    import sqlite3
+    from urllib.parse import quote
+    conn = sqlite3.connect(f"file:{quote(os.path.abspath(db.DB_PATH))}?mode=ro", uri=True,
+                           timeout=db.BUSY_TIMEOUT / 1000)
+    try:
+        check = "quick_check" if args.quick else "integrity_check"
+        integrity = [r[0] for r in conn.execute(f"PRAGMA {check}")]
+        foreign = [list(r) for r in conn.execute("PRAGMA foreign_key_check")]
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+    problems = [] if integrity == ["ok"] else integrity[:20]
+    problems += [f"{r[0]} rowid {r[1]} references missing {r[2]}" for r in foreign[:20]]
+    if version < len(db.MIGRATIONS):
+        problems.append(f"schema version {version} is behind {len(db.MIGRATIONS)}; any other command migrates it")
+    doc = {"ok": not problems, "integrity": integrity[:20], "foreign_key_violations": len(foreign),
+           "schema_version": version, "problems": problems}
+    _out(args, doc, problems or ["ok"])
+    return 0 if not problems else 1
+
+def build_parser():
+    p = argparse.ArgumentParser(prog="python -m school", description="School database tools.")
+    p.add_argument("--db", help="database file (default: data/school.db)")
+    p.add_argument("--busy-timeout", type=int, help="ms to wait for a lock held by another process")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--json", action="store_true", help="print the result as JSON")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    s = sub.add_parser("export", parents=[common], help="write the database as JSON/NDJSON, or one table as CSV")
+    s.add_argument("path", help=".json, .ndjson, .csv or .csv.gz")
+    s.add_argument("--table", choices=("students", "instructors", "courses", "registrations"))
+    s.set_defaults(fn=cmd_export)
+
+    s = sub.add_parser("import", parents=[common], help="load a JSON/NDJSON export or a CSV table")
+    s.add_argument("path")
+    s.add_argument("--table", choices=("students", "instructors", "courses", "registrations"),
+                   help="CSV table (detected from the header when omitted)")
+    s.add_argument("--batch-size", type=int, default=1000)
+    s.add_argument("--no-upsert", action="store_true", help="CSV: reject rows whose key exists instead of updating")
+    s.add_argument("--show-rejected", type=int, default=10, metavar="N", help="list the first N rejected rows")
+    s.add_argument("--strict", action="store_true", help="exit with status 2 if any row was rejected")
+    s.set_defaults(fn=cmd_import)
+
+    s = sub.add_parser("search", parents=[common], help="full-text search over students, instructors and courses")
+    s.add_argument("term")
+    s.add_argument("--limit", type=int, default=50)
+    s.set_defaults(fn=cmd_search)
+
+    s = sub.add_parser("backup", parents=[common], help="online backup to a file, or a snapshot into a store")
+    s.add_argument("path", nargs="?")
+    s.add_argument("--no-verify", action="store_true", help="skip the integrity check of the copy")
+    s.add_argument("--store", help="snapshot store directory instead of a plain copy")
+    s.add_argument("--note", help="note saved with the snapshot")
+    s.add_argument("--keep-last", type=_positive, metavar="N", help="prune the store to this many snapshots")
+    s.set_defaults(fn=cmd_backup)
+
+    s = sub.add_parser("stats", parents=[common], help="row counts and file statistics")
+    s.set_defaults(fn=cmd_stats)
+
+    s = sub.add_parser("verify", parents=[common], help="integrity and foreign-key checks; exit status 1 on problems")
+    s.add_argument("--quick", action="store_true", help="PRAGMA quick_check instead of integrity_check")
+    s.set_defaults(fn=cmd_verify)
+    return p
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.fn(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
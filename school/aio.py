@@ -0,0 +1,158 @@
+import asyncio, functools, threading, weakref
+from concurrent.futures import ThreadPoolExecutor
+from . import db, services, storage, events
+
+# Runs blocking school calls off the event loop. Writes go to a single
+# thread so they never contend for SQLite's write lock; reads go to a small
+# pool and run concurrently under WAL. Each event loop may have at most
+# max_pending calls handed to the threads at once: further callers wait in
+# the loop as suspended coroutines instead of piling up in an unbounded
+# executor queue.
+class DbExecutor:
+    def __init__(self, readers=4, max_pending=64):
+        self.readers = readers
+        self.max_pending = max_pending
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix="school-db-write")
+        self._reader = ThreadPoolExecutor(readers, thread_name_prefix="school-db-read")
+        self._limits = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _limit(self, loop):
+        with self._lock:
+            sem = self._limits.get(loop)
+            if sem is None:
+                sem = self._limits[loop] = asyncio.Semaphore(self.max_pending)
+        return sem
+
+    async def run(self, fn, *args, write=False, **kwargs):
+        loop = asyncio.get_running_loop()
+        sem = self._limit(loop)
+        await sem.acquire()
+        try:
+            cf = (self._writer if write else self._reader).submit(fn, *args, **kwargs)
+        except BaseException:
+            sem.release()
+            raise
+
+        # the slot is freed when the thread is done, not when the caller stops
+        # waiting: a cancelled caller cannot stop a statement that is running
+        def done(_):
+            try:
+                loop.call_soon_threadsafe(sem.release)
+            except RuntimeError:
+                pass  # the loop has been closed
+        cf.add_done_callback(done)
+        return await asyncio.wrap_future(cf)
+
+    def shutdown(self, wait=True):
+        self._writer.shutdown(wait=wait)
+        self._reader.shutdown(wait=wait)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = DbExecutor()
+        return _executor
+
+def configure(readers=4, max_pending=64):
+    global _executor
+    with _executor_lock:
+        old, _executor = _executor, DbExecutor(readers, max_pending)
+    if old is not None:
+        old.shutdown(wait=False)
+    return _executor
+
+def shutdown(wait=True):
+    global _executor
+    with _executor_lock:
+        old, _executor = _executor, None
+    if old is not None:
+        old.shutdown(wait=wait)
+
+def _write(fn):
+    @functools.wraps(fn)
+    async def call(*args, **kwargs):
+        return await executor().run(fn, *args, write=True, **kwargs)
+    return call
+
+def _read(fn):
+    @functools.wraps(fn)
+    async def call(*args, **kwargs):
+        return await executor().run(fn, *args, **kwargs)
+    return call
+
+init_db = _write(db.init_db)
+
+add_student = _write(services.add_student)
+edit_student = _write(services.edit_student)
+remove_student = _write(services.remove_student)
+add_instructor = _write(services.add_instructor)
+edit_instructor = _write(services.edit_instructor)
+remove_instructor = _write(services.remove_instructor)
+add_course = _write(services.add_course)
+edit_course = _write(services.edit_course)
+remove_course = _write(services.remove_course)
+assign_instructor = _write(services.assign_instructor)
+register = _write(services.register)
+unregister = _write(services.unregister)
+add_students_bulk = _write(services.add_students_bulk)
+add_instructors_bulk = _write(services.add_instructors_bulk)
+add_courses_bulk = _write(services.add_courses_bulk)
+register_bulk = _write(services.register_bulk)
+import_json = _write(storage.import_json)
+
+list_students = _read(services.list_students)
+list_instructors = _read(services.list_instructors)
+list_courses = _read(services.list_courses)
+list_registrations = _read(services.list_registrations)
+get_student = _read(services.get_student)
+get_instructor = _read(services.get_instructor)
+get_course = _read(services.get_course)
+snapshot = _read(services.snapshot)
+query = _read(services.query)
+cache_stats = _read(services.cache_stats)
+export_json = _read(storage.export_json)
+
+async def _stream(table, fetch_page, chunk_size, order_by):
+    ex = executor()
+    page = asyncio.ensure_future(ex.run(fetch_page, None, chunk_size, order_by, None))
+    try:
+        while page is not None:
+            rows = await page
+            page = None
+            if len(rows) == chunk_size:
+                after, after_value = db.page_anchor(table, rows[-1], order_by)
+                # read one page ahead while the caller works through this one;
+                # never more, so a slow consumer holds at most two pages
+                page = asyncio.ensure_future(ex.run(fetch_page, after, chunk_size, order_by, after_value))
+            for row in rows:
+                yield row
+    finally:
+        if page is not None:
+            page.cancel()
+
+def iter_students(chunk_size=500, order_by="student_id"):
+    return _stream("students", db.get_students_page, chunk_size, order_by)
+
+def iter_instructors(chunk_size=500, order_by="instructor_id"):
+    return _stream("instructors", db.get_instructors_page, chunk_size, order_by)
+
+def iter_courses(chunk_size=500, order_by="course_id"):
+    return _stream("courses", db.get_courses_page, chunk_size, order_by)
+
+def iter_registrations(chunk_size=500, order_by="student_id"):
+    return _stream("registrations", db.get_registrations_page, chunk_size, order_by)
+
+def subscribe(callback, entities=None):
+    # events are published on the writer thread; hand them to the loop that subscribed
+    loop = asyncio.get_running_loop()
+    def deliver(event):
+        try:
+            loop.call_soon_threadsafe(callback, event)
+        except RuntimeError:
+            pass  # the loop has been closed
+    return events.subscribe(deliver, entities)
@@ -0,0 +1,313 @@
+import mmap, struct, sys, tempfile, zlib
+from array import array
+from . import db, storage
+from .files import replacing
+
+# Columnar binary snapshot of the four tables.
+#
+#   header    magic, version and table count; per table its name and row
+#             count; per column its name, kind, nullability and the offset,
+#             length and CRC32 of its section. The header ends with its own
+#             CRC32.
+#   sections  one per column, 8-byte aligned, made of aligned parts:
+#             [validity bitmap, nullable columns only]
+#             [n+1 uint64 end offsets, string columns only]
+#             [data: n int64 values, or the UTF-8 bytes the offsets index]
+#
+# All integers are little-endian. Sections are written in one pass over the
+# database, spooled per column, then copied behind the header. Loading maps
+# the file and hands out memoryviews over it, so columns are never copied
+# as a whole and any single value can be read without scanning.
+
+MAGIC = b"SCHSNAP\0"
+VERSION = 1
+INT, STR = 0, 1
+KINDS = {
+    "students": (STR, STR, INT, STR),
+    "instructors": (STR, STR, INT, STR),
+    "courses": (STR, STR, STR),
+    "registrations": (STR, STR),
+}
+NULLABLE = {("courses", "instructor_id")}
+_LITTLE = sys.byteorder == "little"
+
+def _align(n):
+    return (n + 7) & ~7
+
+def _le(values, typecode):
+    a = array(typecode, values)
+    if not _LITTLE:
+        a.byteswap()
+    return a.tobytes()
+
+class _ColumnWriter:
+    def __init__(self, kind, nullable):
+        self.kind, self.nullable = kind, nullable
+        self.n = 0
+        self.end = 0
+        self.valid = bytearray() if nullable else None
+        self.data = tempfile.SpooledTemporaryFile(max_size=8 << 20)
+        self.offsets = tempfile.SpooledTemporaryFile(max_size=8 << 20) if kind == STR else None
+        if kind == STR:
+            self.offsets.write(_le([0], "Q"))
+
+    def add(self, values):
+        if self.nullable:
+            for i, v in enumerate(values, self.n):
+                if i % 8 == 0:
+                    self.valid.append(0)
+                if v is not None:
+                    self.valid[-1] |= 1 << (i % 8)
+        self.n += len(values)
+        if self.kind == INT:
+            self.data.write(_le([int(v) for v in values], "q"))
+            return
+        blob = bytearray()
+        ends = []
+        for v in values:
+            if v is not None:
+                blob += str(v).encode("utf-8")
+            ends.append(self.end + len(blob))
+        self.end += len(blob)
+        self.data.write(blob)
+        self.offsets.write(_le(ends, "Q"))
+
+    def parts(self):
+        if self.nullable:
+            yield bytes(self.valid)
+        for spool in (self.offsets, self.data):
+            if spool is not None:
+                spool.seek(0)
+                yield spool
+
+def _header(meta):
+    out = bytearray(MAGIC + struct.pack("<HI", VERSION, len(meta)))
+    for table, n, cols in meta:
+        raw = table.encode()
+        out += struct.pack("<H", len(raw)) + raw + struct.pack("<QH", n, len(cols))
+        for c in cols:
+            raw = c["name"].encode()
+            out += struct.pack("<H", len(raw)) + raw
+            out += struct.pack("<BBQQI", c["kind"], c["nullable"], c["offset"], c["length"], c["crc"])
+    return bytes(out)
+
+def _copy(part, f, crc):
+    if isinstance(part, bytes):
+        f.write(part)
+        crc = zlib.crc32(part, crc)
+    else:
+        while True:
+            data = part.read(1 << 20)
+            if not data:
+                break
+            f.write(data)
+            crc = zlib.crc32(data, crc)
+    pad = b"\0" * (_align(f.tell()) - f.tell())
+    f.write(pad)
+    return zlib.crc32(pad, crc)
+
+def write_snapshot(path, chunk_size=5000):
+    tables = []
+    # one read transaction gives every table the same point-in-time view
+    with db.transaction():
+        for table, names in storage.FIELDS.items():
+            writers = [_ColumnWriter(k, (table, c) in NULLABLE) for c, k in zip(names, KINDS[table])]
+            rows = []
+            for row in db.iter_table(table, chunk_size):
+                rows.append(row)
+                if len(rows) == chunk_size:
+                    for w, values in zip(writers, zip(*rows)):
+                        w.add(values)
+                    rows = []
+            if rows:
+                for w, values in zip(writers, zip(*rows)):
+                    w.add(values)
+            tables.append((table, names, writers))
+
+    # header fields are fixed-width, so its size is known before the offsets are
+    blank = [(t, 0, [{"name": c, "kind": 0, "nullable": 0, "offset": 0, "length": 0, "crc": 0} for c in names])
+             for t, names, _ in tables]
+    start = _align(len(_header(blank)) + 4)
+    try:
+        with replacing(path) as tmp, open(tmp, "wb") as f:
+            f.write(b"\0" * start)
+            meta = []
+            for table, names, writers in tables:
+                cols = []
+                for name, w in zip(names, writers):
+                    offset, crc = f.tell(), 0
+                    for part in w.parts():
+                        crc = _copy(part, f, crc)
+                    cols.append({"name": name, "kind": w.kind, "nullable": int(w.nullable),
+                                 "offset": offset, "length": f.tell() - offset, "crc": crc})
+                meta.append((table, writers[0].n, cols))
+            header = _header(meta)
+            f.seek(0)
+            f.write(header + struct.pack("<I", zlib.crc32(header)))
+    finally:
+        for _, _, writers in tables:
+            for w in writers:
+                w.data.close()
+                if w.offsets is not None:
+                    w.offsets.close()
+    return {table: n for table, n, _ in meta}
+
+class IntColumn:
+    def __init__(self, values):
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+    def __iter__(self):
+        return iter(self.values)
+
+class StrColumn:
+    def __init__(self, offsets, data, valid=None):
+        self.offsets, self.data, self.valid = offsets, data, valid
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def is_null(self, i):
+        return self.valid is not None and not self.valid[i >> 3] >> (i & 7) & 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if self.is_null(i):
+            return None
+        return str(self.data[self.offsets[i]:self.offsets[i + 1]], "utf-8")
+
+    def __iter__(self):
+        offsets, data = self.offsets, self.data
+        start = 0
+        for i in range(1, len(offsets)):
+            end = offsets[i]
+            if self.valid is not None and self.is_null(i - 1):
+                yield None
+            else:
+                yield str(data[start:end], "utf-8")
+            start = end
+
+class Snapshot:
+    def __init__(self, path, verify=True):
+        self._file = open(path, "rb")
+        self._views = []
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._buf = self._view(memoryview(self._mm))
+            self.tables = self._read_header()
+            if verify:
+                self.verify()
+        except BaseException:
+            self.close()
+            raise
+
+    def _view(self, v):
+        self._views.append(v)
+        return v
+
+    def _read_header(self):
+        buf = self._buf
+        if bytes(buf[:8]) != MAGIC:
+            raise ValueError("not a school snapshot")
+        version, count = struct.unpack_from("<HI", buf, 8)
+        if version != VERSION:
+            raise ValueError(f"unsupported snapshot version {version}")
+        pos = 14
+        def name():
+            nonlocal pos
+            (length,) = struct.unpack_from("<H", buf, pos)
+            pos += 2 + length
+            return str(buf[pos - length:pos], "utf-8")
+        tables = {}
+        for _ in range(count):
+            table = name()
+            n, ncols = struct.unpack_from("<QH", buf, pos)
+            pos += 10
+            cols = {}
+            for _ in range(ncols):
+                col = name()
+                kind, nullable, offset, length, crc = struct.unpack_from("<BBQQI", buf, pos)
+                pos += 22
+                cols[col] = (kind, nullable, offset, length, crc)
+            tables[table] = (n, cols)
+        (crc,) = struct.unpack_from("<I", buf, pos)
+        if zlib.crc32(buf[:pos]) != crc:
+            raise ValueError("snapshot header checksum mismatch")
+        return tables
+
+    def verify(self):
+        for table, (n, cols) in self.tables.items():
+            for col, (kind, nullable, offset, length, crc) in cols.items():
+                if offset + length > len(self._buf) or zlib.crc32(self._buf[offset:offset + length]) != crc:
+                    raise ValueError(f"snapshot column {table}.{col} is corrupt")
+
+    def _ints(self, pos, n, typecode):
+        raw = self._buf[pos:pos + 8 * n]
+        if _LITTLE:
+            return self._view(raw.cast(typecode))
+        a = array(typecode, raw)
+        a.byteswap()
+        return a
+
+    def __len__(self):
+        return len(self.tables)
+
+    def count(self, table):
+        return self.tables[table][0]
+
+    def column(self, table, col):
+        n, cols = self.tables[table]
+        kind, nullable, pos, _, _ = cols[col]
+        valid = None
+        if nullable:
+            valid = self._view(self._buf[pos:pos + (n + 7) // 8])
+            pos += _align((n + 7) // 8)
+        if kind == INT:
+            return IntColumn(self._ints(pos, n, "q"))
+        offsets = self._ints(pos, n + 1, "Q")
+        pos += _align(8 * (n + 1))
+        return StrColumn(offsets, self._view(self._buf[pos:pos + offsets[n]]), valid)
+
+    def rows(self, table):
+        return zip(*(self.column(table, c) for c in self.tables[table][1]))
+
+    def close(self):
+        for v in reversed(self._views):
+            v.release()
+        self._views = []
+        if getattr(self, "_mm", None) is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def restore_snapshot(path, batch_size=5000):
+    # merges the snapshot into the database through the bulk services, in
+    # dependency order, so rows are validated and existing keys kept
+    db.init_db()
+    report = {}
+    with Snapshot(path) as snap:
+        for table in storage.FIELDS:
+            counts = report[table] = {"inserted": 0, "duplicate": 0, "invalid": 0}
+            if table not in snap.tables:
+                continue
+            rows = snap.rows(table)
+            while True:
+                batch = [r for _, r in zip(range(batch_size), rows)]
+                if not batch:
+                    break
+                result = storage.BULK[table](batch)
+                for key in counts:
+                    counts[key] += result[key]
+    return report
@@ -0,0 +1,88 @@
+import threading
+from collections import OrderedDict
+from . import db
+
+def _weight(value):
+    # rough size in rows, so one huge table listing cannot crowd out memory
+    if isinstance(value, tuple) and value and all(isinstance(v, list) for v in value):
+        return sum(len(v) for v in value)
+    if isinstance(value, list):
+        return len(value)
+    return 1
+
+# LRU cache of read results, bounded by entry count and total rows. Entries
+# are tagged with the entities they were read from: local writes drop the
+# matching entries (invalidate), while writes from other connections or
+# processes are noticed through PRAGMA data_version and clear everything.
+class ReadCache:
+    def __init__(self, max_entries=256, max_rows=200_000):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._data = OrderedDict()  # key -> (value, tags, weight)
+        self._rows = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def _check_external(self, conn):
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        seen = getattr(self._local, "seen", None)
+        if seen != (conn, version):
+            # a connection's first reading cannot be compared with anything,
+            # so it is treated as a change too
+            self._local.seen = (conn, version)
+            self.clear()
+
+    def get(self, key, tags, load):
+        conn = db.get_conn()
+        if conn.in_transaction:
+            # uncommitted state must never be cached
+            return load()
+        self._check_external(conn)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generation
+        value = load()
+        weight = _weight(value)
+        with self._lock:
+            # skip the store if an invalidation raced with the load
+            if generation == self._generation and weight <= self.max_rows:
+                old = self._data.pop(key, None)
+                if old is not None:
+                    self._rows -= old[2]
+                self._data[key] = (value, frozenset(tags), weight)
+                self._rows += weight
+                while len(self._data) > self.max_entries or self._rows > self.max_rows:
+                    _, (_, _, w) = self._data.popitem(last=False)
+                    self._rows -= w
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, entity):
+        with self._lock:
+            self._generation += 1
+            stale = [k for k, (_, tags, _) in self._data.items() if entity in tags]
+            for k in stale:
+                self._rows -= self._data.pop(k)[2]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._data)
+            self._data.clear()
+            self._rows = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / total if total else 0.0,
+                    "entries": len(self._data), "rows": self._rows,
+                    "evictions": self.evictions, "invalidations": self.invalidations}
@@ -0,0 +1,131 @@
+import csv, gzip, io
+from . import db, services
+from .files import replacing
+from .storage import FIELDS, OPTIONAL
+
+# export columns: the entity views, so courses and registrations carry the
+# joined names; imports only read the FIELDS columns and ignore the rest
+HEADERS = {
+    "students": ("student_id", "name", "age", "email"),
+    "instructors": ("instructor_id", "name", "age", "email"),
+    "courses": ("course_id", "course_name", "instructor_id", "instructor_name"),
+    "registrations": ("student_id", "student_name", "course_id", "course_name"),
+}
+BULK = {
+    "students": lambda rows, upsert: services.add_students_bulk(rows, upsert),
+    "instructors": lambda rows, upsert: services.add_instructors_bulk(rows, upsert),
+    "courses": lambda rows, upsert: services.add_courses_bulk(rows, upsert),
+    # a registration has no columns besides its key, so there is nothing to update
+    "registrations": lambda rows, upsert: services.register_bulk(rows),
+}
+
+def _gzipped(path, compress):
+    if compress is None:
+        return path.endswith(".gz")
+    return compress
+
+def export_csv(table, path, compress=None, chunk_size=1000, progress=None):
+    # progress(rows, bytes_written) every chunk_size rows; raising aborts
+    if table not in HEADERS:
+        raise ValueError(f"unknown table {table!r}")
+    n = 0
+    # write next to the target and swap it in whole, so a cancelled or failed
+    # export never leaves a truncated file or gzip stream at path
+    with replacing(path) as tmp, open(tmp, "wb") as raw:
+        # name the member after the target, not the temp file
+        stream = gzip.GzipFile(path, mode="wb", fileobj=raw) if _gzipped(path, compress) else raw
+        f = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+        try:
+            w = csv.writer(f)
+            w.writerow(HEADERS[table])
+            # a single statement reads one consistent snapshot
+            for row in db.iter_rows(table, chunk_size):
+                w.writerow(row)
+                n += 1
+                if progress and n % chunk_size == 0:
+                    progress(n, raw.tell())
+        finally:
+            f.flush()
+            f.detach()
+            if stream is not raw:
+                stream.close()
+        if progress:
+            progress(n, raw.tell())
+    return n
+
+def detect_table(header):
+    # by column names, in any order: an export of ours, or a file carrying
+    # every required column (keys included) of exactly one table
+    header = {h.strip() for h in header}
+    for table, cols in HEADERS.items():
+        if header == set(cols):
+            return table
+    matches = [t for t, names in FIELDS.items()
+               if all(c in header for c in names if (t, c) not in OPTIONAL)]
+    if len(matches) != 1:
+        raise ValueError("cannot tell which table the CSV holds; pass table=")
+    return matches[0]
+
+def _open_text(raw):
+    # gzip is recognised by its magic number, whatever the file is called
+    if raw.peek(2)[:2] == b"\x1f\x8b":
+        raw = gzip.GzipFile(fileobj=raw, mode="rb")
+    # utf-8-sig drops the byte order mark spreadsheet programs write
+    return io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+
+def import_csv(path, table=None, batch_size=1000, upsert=True, progress=None, max_rejected=10000):
+    # rows are validated and written batch_size at a time, one transaction per
+    # batch; with upsert, rows for existing keys update them.
+    # progress(rows, bytes_read) after each batch; raising stops the import
+    # and keeps the batches already committed
+    db.init_db()
+    report = {"table": table, "rows": 0, "inserted": 0, "updated": 0, "duplicate": 0, "invalid": 0,
+              "rejected": [], "rejected_total": 0}
+
+    def reject(line, rec, reason):
+        report["rejected_total"] += 1
+        if len(report["rejected"]) < max_rejected:
+            report["rejected"].append({"line": line, "record": rec, "reason": reason})
+
+    with open(path, "rb") as raw, _open_text(raw) as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return report
+        table = report["table"] = table or detect_table(header)
+        if table not in FIELDS:
+            raise ValueError(f"unknown table {table!r}")
+        header = [h.strip() for h in header]
+        missing = [c for c in FIELDS[table] if c not in header and (table, c) not in OPTIONAL]
+        if missing:
+            raise ValueError(f"CSV is missing column(s) {', '.join(missing)}")
+        pos = [header.index(c) if c in header else None for c in FIELDS[table]]
+        width = len(header)
+
+        def flush(batch):
+            result = BULK[table]([row for _, row in batch], upsert)
+            for key in ("inserted", "updated", "duplicate", "invalid"):
+                report[key] += result.get(key, 0)
+            for n, reason in result["rejected"]:
+                reject(batch[n][0], batch[n][1], reason)
+            if progress:
+                progress(report["rows"], raw.tell())
+
+        batch = []
+        for rec in reader:
+            if not rec:
+                continue
+            report["rows"] += 1
+            if len(rec) != width:
+                report["invalid"] += 1
+                reject(reader.line_num, rec, f"expected {width} fields, got {len(rec)}")
+                continue
+            # empty cells of optional columns (a course without instructor) mean NULL
+            batch.append((reader.line_num, tuple(rec[p] or None if p is not None else None for p in pos)))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    report["rejected"].sort(key=lambda r: r["line"])
+    return report
@@ -1,16 +1,321 @@
-import sqlite3, os, shutil, datetime
+import sqlite3, os, re, time, random, datetime, threading, weakref, atexit, functools
+from contextlib import contextmanager
+from . import metrics
+from .files import replacing
 
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "school.db")
 
+# applied once when a thread first opens its connection
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("mmap_size", 256 * 1024 * 1024),
+    ("cache_size", -16000),
+    ("foreign_keys", "ON"),
+)
+
+# Lock contention. SQLite itself waits up to BUSY_TIMEOUT ms for a lock held
+# by another connection; if that runs out, transaction() retries BEGIN or
+# COMMIT up to RETRIES more times, sleeping BACKOFF seconds doubled per
+# attempt (capped at MAX_BACKOFF, with jitter), then raises DatabaseBusy.
+# Change them with configure().
+BUSY_TIMEOUT = 5000
+RETRIES = 3
+BACKOFF = 0.05
+MAX_BACKOFF = 2.0
+
+class DatabaseBusy(sqlite3.OperationalError):
+    pass
+
+_local = threading.local()
+# weak, so a thread that exits without close_conn() drops its thread-local
+# and with it the last reference: the connection is closed and untracked
+_open_conns = weakref.WeakSet()
+
+class _Connection(sqlite3.Connection):
+    # the C type does not support weak references; a subclass does
+    pass
+
+class _Token:
+    pass
+
+def _bind(conn):
+    # A connection references itself through its statement cache, so
+    # dropping it only frees it at the next cycle collection. The token lives
+    # in the thread-local instead and closes the connection as soon as the
+    # thread exits (or replaces it), without waiting for the collector.
+    _local.conn = conn
+    _local.token = _Token()
+    weakref.finalize(_local.token, conn.close)
+
+_open_lock = threading.Lock()
+# bumped by close_all() so other threads reopen instead of reusing a closed handle
+_generation = 0
+# bumped by configure() and instrument() so threads pick up the new settings
+_settings = 0
+
+def _connect(path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # connections are only ever used by the thread that opened them;
+    # check_same_thread is off so close_all() can shut them down at exit
+    factory = _TimedConnection if _instrumented else _Connection
+    conn = sqlite3.connect(path, check_same_thread=False, factory=factory)
+    for name, value in PRAGMAS:
+        conn.execute(f"PRAGMA {name} = {value}")
+    conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT)}")
+    with _open_lock:
+        _open_conns.add(conn)
+    return conn
+
 def get_conn():
-    os.makedirs(os.path.join(os.path.dirname(os.path.dirname(__file__)), "data"), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("PRAGMA foreign_keys = ON")
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != DB_PATH or _local.generation != _generation:
+        if conn is not None:
+            close_conn()
+        conn = _connect(DB_PATH)
+        _bind(conn)
+        _local.path, _local.generation = DB_PATH, _generation
+        _local.settings = _settings
+    elif _local.settings != _settings:
+        conn = _refresh(conn)
     return conn
 
-def init_db():
+def _refresh(conn):
+    # configure() or instrument() ran since this thread connected
+    if isinstance(conn, _TimedConnection) != _instrumented:
+        if conn.in_transaction:
+            # swapped on the first call after the transaction ends
+            return conn
+        close_conn()
+        conn = _connect(DB_PATH)
+        _bind(conn)
+        _local.path = DB_PATH
+    else:
+        conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT)}")
+    _local.settings = _settings
+    return conn
+
+def close_conn():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        return
+    _local.conn = _local.path = _local.token = None
+    with _open_lock:
+        _open_conns.discard(conn)
+    conn.close()
+
+def close_all():
+    global _generation
+    with _open_lock:
+        conns = list(_open_conns)
+        _open_conns.clear()
+        _generation += 1
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    _local.conn = _local.path = _local.token = None
+
+atexit.register(close_all)
+
+def configure(busy_timeout=None, retries=None, backoff=None, max_backoff=None):
+    global BUSY_TIMEOUT, RETRIES, BACKOFF, MAX_BACKOFF, _settings
+    if busy_timeout is not None:
+        BUSY_TIMEOUT = int(busy_timeout)
+    if retries is not None:
+        RETRIES = int(retries)
+    if backoff is not None:
+        BACKOFF = float(backoff)
+    if max_backoff is not None:
+        MAX_BACKOFF = float(max_backoff)
+    _settings += 1
+    return {"busy_timeout": BUSY_TIMEOUT, "retries": RETRIES, "backoff": BACKOFF, "max_backoff": MAX_BACKOFF}
+
+# per-process totals for write transactions: how many took the write lock,
+# how many had to wait for it, seconds spent waiting at BEGIN and COMMIT
+# (inside SQLite and in backoff sleeps), retries, and DatabaseBusy failures
+_lock_stats = {"acquired": 0, "contended": 0, "wait": 0.0, "retries": 0, "failures": 0}
+_stats_lock = threading.Lock()
+
+def lock_stats():
+    with _stats_lock:
+        return dict(_lock_stats)
+
+def reset_lock_stats():
+    with _stats_lock:
+        _lock_stats.update(acquired=0, contended=0, wait=0.0, retries=0, failures=0)
+
+def _is_busy(exc):
+    # "database is locked", "database table is locked", ...
+    return isinstance(exc, sqlite3.OperationalError) and "locked" in str(exc)
+
+def _with_retry(step, what, acquire):
+    # BEGIN and COMMIT are safe to repeat: a failed BEGIN IMMEDIATE holds no
+    # lock and a failed COMMIT leaves the transaction open
+    start = time.perf_counter()
+    attempt = 0
+    busy = False
+    try:
+        while True:
+            try:
+                return step()
+            except sqlite3.OperationalError as exc:
+                if not _is_busy(exc):
+                    raise
+                busy = True
+                if attempt >= RETRIES:
+                    with _stats_lock:
+                        _lock_stats["failures"] += 1
+                    raise DatabaseBusy(f"database is busy: could not {what} after {attempt + 1} attempts") from exc
+                attempt += 1
+                with _stats_lock:
+                    _lock_stats["retries"] += 1
+                time.sleep(min(MAX_BACKOFF, BACKOFF * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0))
+    finally:
+        waited = time.perf_counter() - start
+        with _stats_lock:
+            _lock_stats["acquired"] += acquire
+            _lock_stats["wait"] += waited
+            # an uncontended lock is taken in microseconds
+            if busy or waited > 0.001:
+                _lock_stats["contended"] += 1
+
+@contextmanager
+def transaction(mode=""):
+    # mode "IMMEDIATE" takes the write lock up front, for read-then-write work
+    # and for writes generally: waiting for the lock then happens at BEGIN,
+    # where it can be timed and retried
+    if mode not in ("", "DEFERRED", "IMMEDIATE", "EXCLUSIVE"):
+        raise ValueError(f"unknown transaction mode {mode!r}")
     conn = get_conn()
-    cur = conn.cursor()
+    if conn.in_transaction:
+        # nested use joins the outer transaction
+        yield conn
+        return
+    _local.after_commit = []
+    writing = mode in ("IMMEDIATE", "EXCLUSIVE")
+    if writing:
+        _with_retry(lambda: conn.execute(f"BEGIN {mode}"), "lock the database", 1)
+    else:
+        conn.execute(f"BEGIN {mode}")
+    try:
+        yield conn
+        if writing:
+            _with_retry(conn.commit, "commit", 0)
+        else:
+            conn.commit()
+    except BaseException:
+        conn.rollback()
+        _local.after_commit = None
+        raise
+    else:
+        hooks, _local.after_commit = _local.after_commit, None
+        for fn in hooks:
+            fn()
+
+def after_commit(fn):
+    # run fn once the current transaction commits (dropped on rollback),
+    # or straight away when no transaction is open
+    hooks = getattr(_local, "after_commit", None)
+    if hooks is None or not get_conn().in_transaction:
+        fn()
+    else:
+        hooks.append(fn)
+
+# Opt-in instrumentation, off by default and free while off. instrument()
+# switches new connections to the timed classes below, which record every
+# statement's execute time (fetching is not included) and keep the query
+# plan of statements slower than slow_ms; it also wraps the public entry
+# points (get_*, insert_*, search, ...) to record whole-call latency.
+# stats() returns the numbers.
+_instrumented = False
+_explain = True
+_stats = metrics.QueryStats()
+_unwrapped = {}
+_TIMED = re.compile(r"(get_(?!conn$)|insert_|update_|delete_|register_|unregister_|set_|count_|search$|existing_keys$|is_registered$|backup_db$|rebuild_search_index$)|.*_exists$")
+_PLANNED = re.compile(r"\s*(SELECT|INSERT|UPDATE|DELETE|REPLACE|WITH)\b", re.I)
+
+def _query_plan(conn, sql, params):
+    if params is None or not _PLANNED.match(sql):
+        return None
+    try:
+        # the base class method, so the EXPLAIN itself is not timed
+        rows = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    except sqlite3.Error:
+        return None
+    depth, plan = {0: -1}, []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        plan.append("  " * depth[node] + detail)
+    return plan
+
+def _observe(conn, sql, params, seconds):
+    _stats.add_statement(sql, seconds)
+    if _stats.is_slow(seconds):
+        _stats.add_slow(sql, seconds, _query_plan(conn, sql, params) if _explain else None)
+
+class _TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, params=()):
+        t = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            _observe(self.connection, sql, params, time.perf_counter() - t)
+
+    def executemany(self, sql, seq):
+        t = time.perf_counter()
+        try:
+            return super().executemany(sql, seq)
+        finally:
+            _observe(self.connection, sql, None, time.perf_counter() - t)
+
+class _TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq):
+        return self.cursor().executemany(sql, seq)
+
+def _timed(name, fn):
+    @functools.wraps(fn)
+    def timed(*args, **kwargs):
+        t = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _stats.add_function(name, time.perf_counter() - t)
+    return timed
+
+def instrument(enabled=True, slow_ms=100.0, explain=True):
+    # threads switch connections on their next call outside a transaction;
+    # collected numbers are kept when turning it off (see reset_stats)
+    global _instrumented, _explain, _settings
+    g = globals()
+    if enabled and not _instrumented:
+        for name, fn in list(g.items()):
+            if _TIMED.match(name) and callable(fn) and not isinstance(fn, type):
+                _unwrapped[name] = fn
+                g[name] = _timed(name, fn)
+    elif not enabled and _instrumented:
+        g.update(_unwrapped)
+        _unwrapped.clear()
+    _stats.slow_ms = slow_ms
+    _explain = explain
+    _instrumented = bool(enabled)
+    _settings += 1
+
+def stats():
+    return dict(_stats.stats(), enabled=_instrumented, locks=lock_stats())
+
+def reset_stats():
+    _stats.reset()
+    reset_lock_stats()
+
+def _schema_v1(cur):
     cur.execute("""
     CREATE TABLE IF NOT EXISTS students(
         student_id TEXT PRIMARY KEY,
@@ -40,83 +345,375 @@ def init_db():
         FOREIGN KEY(student_id) REFERENCES students(student_id) ON DELETE CASCADE,
         FOREIGN KEY(course_id) REFERENCES courses(course_id) ON DELETE CASCADE
     )""")
-    conn.commit()
-    conn.close()
+    _create_search_index(cur)
 
-def backup_db(dst_path: str):
-    src = DB_PATH
-    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
-    shutil.copyfile(src, dst_path)
+def _indexes_v2(cur):
+    # join and cascade paths plus email lookups, which no primary key covers
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_registrations_course ON registrations(course_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_courses_instructor ON courses(instructor_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_students_email ON students(email)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_instructors_email ON instructors(email)")
+    cur.execute("ANALYZE")
 
-def insert_student(student_id, name, age, email):
+# Append only. A database at PRAGMA user_version N has run the first N
+# entries; databases created before versioning report 0 and run them all,
+# which is safe because every step is idempotent.
+MIGRATIONS = (_schema_v1, _indexes_v2)
+
+def schema_version():
+    return get_conn().execute("PRAGMA user_version").fetchone()[0]
+
+def migrate():
+    # the write lock is taken before the version is read, so concurrent
+    # starters apply each migration once
+    with transaction("IMMEDIATE") as conn:
+        cur = conn.cursor()
+        version = cur.execute("PRAGMA user_version").fetchone()[0]
+        for step in MIGRATIONS[version:]:
+            step(cur)
+        if version < len(MIGRATIONS):
+            cur.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+        return max(version, len(MIGRATIONS))
+
+def init_db():
+    # a current schema costs one pragma read; newer versions are left alone
+    if schema_version() >= len(MIGRATIONS):
+        return
+    migrate()
+
+# full-text indexed columns and their bm25 weights (ids rank above names above emails)
+_FTS = {
+    "students": (("student_id", 10.0), ("name", 5.0), ("email", 1.0)),
+    "instructors": (("instructor_id", 10.0), ("name", 5.0), ("email", 1.0)),
+    "courses": (("course_id", 10.0), ("course_name", 5.0)),
+}
+
+def _create_search_index(cur):
+    # external-content FTS5 tables keyed on the base table rowid; triggers keep
+    # them in sync. Rowids of TEXT-keyed tables can change on VACUUM, so run
+    # rebuild_search_index() after one.
+    have = {r[0] for r in cur.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    for table, spec in _FTS.items():
+        fts = f"{table}_fts"
+        cols = ",".join(c for c, _ in spec)
+        new = ",".join(f"new.{c}" for c, _ in spec)
+        old = ",".join(f"old.{c}" for c, _ in spec)
+        cur.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{table}', content_rowid='rowid', prefix='2 3')")
+        cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts}(rowid,{cols}) VALUES(new.rowid,{new});
+        END""")
+        cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts}({fts},rowid,{cols}) VALUES('delete',old.rowid,{old});
+        END""")
+        cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN
+            INSERT INTO {fts}({fts},rowid,{cols}) VALUES('delete',old.rowid,{old});
+            INSERT INTO {fts}(rowid,{cols}) VALUES(new.rowid,{new});
+        END""")
+        if fts not in have:
+            weights = ", ".join(str(w) for _, w in spec)
+            cur.execute(f"INSERT INTO {fts}({fts},rank) VALUES('rank','bm25({weights})')")
+            cur.execute(f"INSERT INTO {fts}({fts}) VALUES('rebuild')")
+
+def rebuild_search_index():
+    with transaction("IMMEDIATE") as conn:
+        for table in _FTS:
+            conn.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES('rebuild')")
+
+def backup_db(dst_path: str, pages=1024, progress=None, pause=0.0, verify=True):
+    # Online copy through the SQLite backup API, `pages` pages per step.
+    # progress(done, total) is called in pages after every step and may
+    # raise to abort; `pause` seconds are slept between steps to throttle I/O.
+    # The copy is written beside dst_path and only replaces it once complete
+    # and verified (see files.replacing).
+    def step(status, remaining, total):
+        if progress:
+            progress(total - remaining, total)
+        if pause and remaining:
+            time.sleep(pause)
+    with replacing(dst_path) as tmp:
+        dst = sqlite3.connect(tmp)
+        try:
+            # Copy from one read snapshot. Under WAL it does not block writers,
+            # and without it every write from another connection would restart
+            # the copy, so a steady trickle of writes could starve it forever.
+            with transaction() as conn:
+                conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+                conn.backup(dst, pages=pages, progress=step)
+            if verify:
+                result = [r[0] for r in dst.execute("PRAGMA integrity_check")]
+                if result != ["ok"]:
+                    raise sqlite3.DatabaseError("backup failed integrity check: " + "; ".join(result[:5]))
+        finally:
+            dst.close()
+
+# primary key columns per table, used by the set-based existence checks
+_KEYS = {
+    "students": ("student_id",),
+    "instructors": ("instructor_id",),
+    "courses": ("course_id",),
+    "registrations": ("student_id", "course_id"),
+}
+
+# column order used for raw table reads (exports, snapshots)
+_COLUMNS = {
+    "students": ("student_id", "name", "age", "email"),
+    "instructors": ("instructor_id", "name", "age", "email"),
+    "courses": ("course_id", "course_name", "instructor_id"),
+    "registrations": ("student_id", "course_id"),
+}
+
+def iter_table(table, chunk_size=1000):
+    cur = get_conn().cursor()
+    cur.execute(f"SELECT {','.join(_COLUMNS[table])} FROM {table} ORDER BY {','.join(_KEYS[table])}")
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield from rows
+
+def iter_rows(table, chunk_size=1000, row_factory=None):
+    # entity view rows (with joined names) in key order, from one cursor;
+    # row_factory (e.g. models.student_row) hydrates them as they are fetched
+    select, _ = _VIEWS[table]
+    cur = get_conn().cursor()
+    cur.row_factory = row_factory
+    cur.execute(f"{select} ORDER BY {','.join('t.' + k for k in _KEYS[table])}")
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield from rows
+
+# entity read views for the paged APIs: the SELECT (base table aliased t)
+# and the columns they can be ordered by, mapped to their position in a row
+_VIEWS = {
+    "students": ("SELECT t.student_id,t.name,t.age,t.email FROM students t",
+                 {"student_id": 0, "name": 1, "age": 2, "email": 3}),
+    "instructors": ("SELECT t.instructor_id,t.name,t.age,t.email FROM instructors t",
+                    {"instructor_id": 0, "name": 1, "age": 2, "email": 3}),
+    "courses": ("SELECT t.course_id,t.course_name,t.instructor_id,i.name FROM courses t "
+                "LEFT JOIN instructors i ON t.instructor_id=i.instructor_id",
+                {"course_id": 0, "course_name": 1}),
+    "registrations": ("SELECT t.student_id,s.name,t.course_id,c.course_name FROM registrations t "
+                      "JOIN students s ON s.student_id=t.student_id JOIN courses c ON c.course_id=t.course_id",
+                      {"student_id": 0, "course_id": 2}),
+}
+
+def _page(table, after, limit, order_by, after_value):
+    select, sortable = _VIEWS[table]
+    keys = _KEYS[table]
+    if order_by not in sortable:
+        raise ValueError(f"cannot order {table} by {order_by!r}")
+    # the primary key breaks ties so the keyset is always unique
+    order = (order_by,) + tuple(k for k in keys if k != order_by)
+    cols = ",".join(f"t.{c}" for c in order)
+    sql, params = select, []
+    if after is not None:
+        anchor = dict(zip(keys, after if isinstance(after, tuple) else (after,)))
+        if order_by not in anchor:
+            if after_value is None:
+                where = " AND ".join(f"{k}=?" for k in keys)
+                row = get_conn().execute(f"SELECT {order_by} FROM {table} WHERE {where}", [anchor[k] for k in keys]).fetchone()
+                if row is None:
+                    raise LookupError(f"{table} row {after!r} no longer exists; pass after_value")
+                after_value = row[0]
+            anchor[order_by] = after_value
+        sql += f" WHERE ({cols}) > ({','.join('?' * len(order))})"
+        params = [anchor[c] for c in order]
+    sql += f" ORDER BY {cols} LIMIT ?"
+    return get_conn().execute(sql, params + [limit]).fetchall()
+
+def page_anchor(table, row, order_by):
+    # (after, after_value) that continues a page ending with `row`
+    _, sortable = _VIEWS[table]
+    key = tuple(row[sortable[k]] for k in _KEYS[table])
+    return (key if len(key) > 1 else key[0]), row[sortable[order_by]]
+
+def _iter(table, chunk_size, order_by):
+    after = after_value = None
+    while True:
+        rows = _page(table, after, chunk_size, order_by, after_value)
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        after, after_value = page_anchor(table, rows[-1], order_by)
+
+def _rows_by(table, cols, values):
+    # rows of an entity view whose `cols` match any of `values`, in key order
+    select, _ = _VIEWS[table]
+    values = list(values)
+    order = ",".join(f"t.{k}" for k in _KEYS[table])
+    out = []
     conn = get_conn()
-    conn.execute("INSERT INTO students(student_id,name,age,email) VALUES(?,?,?,?)",(student_id,name,int(age),email))
-    conn.commit()
-    conn.close()
+    step = 900 // len(cols)
+    for i in range(0, len(values), step):
+        chunk = values[i:i+step]
+        if len(cols) == 1:
+            where, params = f"t.{cols[0]} IN ({','.join('?' * len(chunk))})", chunk
+        else:
+            row = "(" + ",".join("?" * len(cols)) + ")"
+            where = f"({','.join('t.' + c for c in cols)}) IN (VALUES {','.join([row] * len(chunk))})"
+            params = [v for key in chunk for v in key]
+        out.extend(conn.execute(f"{select} WHERE {where} ORDER BY {order}", params).fetchall())
+    return out
 
-def update_student(student_id, name, age, email):
+def _count(table):
+    return get_conn().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+def existing_keys(table, keys):
+    cols = _KEYS[table]
+    keys = list(set(keys))
+    found = set()
     conn = get_conn()
-    conn.execute("UPDATE students SET name=?, age=?, email=? WHERE student_id=?",(name,int(age),email,student_id))
-    conn.commit()
-    conn.close()
+    # stay well under SQLite's bound-parameter limit
+    step = 900 // len(cols)
+    for i in range(0, len(keys), step):
+        chunk = keys[i:i+step]
+        if len(cols) == 1:
+            where, params = f"{cols[0]} IN ({','.join('?' * len(chunk))})", chunk
+        else:
+            row = "(" + ",".join("?" * len(cols)) + ")"
+            where = f"({','.join(cols)}) IN (VALUES {','.join([row] * len(chunk))})"
+            params = [v for key in chunk for v in key]
+        for r in conn.execute(f"SELECT {','.join(cols)} FROM {table} WHERE {where}", params):
+            found.add(r[0] if len(cols) == 1 else tuple(r))
+    return found
+
+def _where_key(table, prefix=""):
+    return " AND ".join(f"{prefix}{c}=?" for c in _KEYS[table])
+
+def _get(table, key):
+    # point lookup through the primary-key index
+    select, _ = _VIEWS[table]
+    key = key if isinstance(key, tuple) else (key,)
+    return get_conn().execute(f"{select} WHERE {_where_key(table, 't.')}", key).fetchone()
+
+def _exists(table, key):
+    key = key if isinstance(key, tuple) else (key,)
+    return get_conn().execute(f"SELECT 1 FROM {table} WHERE {_where_key(table)}", key).fetchone() is not None
+
+def insert_student(student_id, name, age, email):
+    with transaction("IMMEDIATE") as conn:
+        conn.execute("INSERT INTO students(student_id,name,age,email) VALUES(?,?,?,?)",(student_id,name,int(age),email))
+
+def insert_students_many(rows):
+    with transaction("IMMEDIATE") as conn:
+        cur = conn.executemany("INSERT OR IGNORE INTO students(student_id,name,age,email) VALUES(?,?,?,?)",((r[0],r[1],int(r[2]),r[3]) for r in rows))
+        return cur.rowcount
+
+def update_student(student_id, name, age, email):
+    with transaction("IMMEDIATE") as conn:
+        conn.execute("UPDATE students SET name=?, age=?, email=? WHERE student_id=?",(name,int(age),email,student_id))
+
+def update_students_many(rows):
+    with transaction("IMMEDIATE") as conn:
+        cur = conn.executemany("UPDATE students SET name=?, age=?, email=? WHERE student_id=?",((r[1],int(r[2]),r[3],r[0]) for r in rows))
+        return cur.rowcount
 
 def delete_student(student_id):
-    conn = get_conn()
-    conn.execute("DELETE FROM students WHERE student_id=?",(student_id,))
-    conn.commit()
-    conn.close()
+    with transaction("IMMEDIATE") as conn:
+        conn.execute("DELETE FROM students WHERE student_id=?",(student_id,))
 
 def get_students():
     conn = get_conn()
     cur = conn.cursor()
     cur.execute("SELECT student_id,name,age,email FROM students ORDER BY student_id")
     rows = cur.fetchall()
-    conn.close()
     return rows
 
+def get_students_page(after_id=None, limit=500, order_by="student_id", after_value=None):
+    return _page("students", after_id, limit, order_by, after_value)
+
+def iter_students(chunk_size=500, order_by="student_id"):
+    return _iter("students", chunk_size, order_by)
+
+def count_students():
+    return _count("students")
+
+def get_students_by_ids(ids):
+    return _rows_by("students", ("student_id",), ids)
+
+def get_student(student_id):
+    return _get("students", student_id)
+
+def student_exists(student_id):
+    return _exists("students", student_id)
+
 def insert_instructor(instructor_id, name, age, email):
-    conn = get_conn()
-    conn.execute("INSERT INTO instructors(instructor_id,name,age,email) VALUES(?,?,?,?)",(instructor_id,name,int(age),email))
-    conn.commit()
-    conn.close()
+    with transaction("IMMEDIATE") as conn:
+        conn.execute("INSERT INTO instructors(instructor_id,name,age,email) VALUES(?,?,?,?)",(instructor_id,name,int(age),email))
+
+def insert_instructors_many(rows):
+    with transaction("IMMEDIATE") as conn:
+        cur = conn.executemany("INSERT OR IGNORE INTO instructors(instructor_id,name,age,email) VALUES(?,?,?,?)",((r[0],r[1],int(r[2]),r[3]) for r in rows))
+        return cur.rowcount
 
 def update_instructor(instructor_id, name, age, email):
-    conn = get_conn()
-    conn.execute("UPDATE instructors SET name=?, age=?, email=? WHERE instructor_id=?",(name,int(age),email,instructor_id))
-    conn.commit()
-    conn.close()
+    with transaction("IMMEDIATE") as conn:
+        conn.execute("UPDATE instructors SET name=?, age=?, email=? WHERE instructor_id=?",(name,int(age),email,instructor_id))
+
+def update_instructors_many(rows):
+    with transaction("IMMEDIATE") as conn:
+        cur = conn.executemany("UPDATE instructors SET name=?, age=?, email=? WHERE instructor_id=?",((r[1],int(r[2]),r[3],r[0]) for r in rows))
+        return cur.rowcount
 
 def delete_instructor(instructor_id):
-    conn = get_conn()
-    conn.execute("DELETE FROM instructors WHERE instructor_id=?",(instructor_id,))
-    conn.commit()
-    conn.close()
+    with transaction("IMMEDIATE") as conn:
+        conn.execute("DELETE FROM instructors WHERE instructor_id=?",(instructor_id,))
 
 def get_instructors():
     conn = get_conn()
     cur = conn.cursor()
     cur.execute("SELECT instructor_id,name,age,email FROM instructors ORDER BY instructor_id")
     rows = cur.fetchall()
-    conn.close()
     return rows
 
+def get_instructors_page(after_id=None, limit=500, order_by="instructor_id", after_value=None):
+    return _page("instructors", after_id, limit, order_by, after_value)
+
+def iter_instructors(chunk_size=500, order_by="instructor_id"):
+    return _iter("instructors", chunk_size, order_by)
+
+def count_instructors():
+    return _count("instructors")
+
+def get_instructors_by_ids(ids):
+    return _rows_by("instructors", ("instructor_id",), ids)
+
+def get_instructor(instructor_id):
+    return _get("instructors", instructor_id)
+
+def instructor_exists(instructor_id):
+    return _exists("instructors", instructor_id)
+
 def insert_course(course_id, course_name, instructor_id=None):
-    conn = get_conn()
-    conn.execute("INSERT INTO courses(course_id,course_name,instructor_id) VALUES(?,?,?)",(course_id,course_name,instructor_id))
-    conn.commit()
-    conn.close()
+    with transaction("IMMEDIATE") as conn:
+        conn.execute("INSERT INTO courses(course_id,course_name,instructor_id) VALUES(?,?,?)",(course_id,course_name,instructor_id))
+
+def insert_courses_many(rows):
+    with transaction("IMMEDIATE") as conn:
+        cur = conn.executemany("INSERT OR IGNORE INTO courses(course_id,course_name,instructor_id) VALUES(?,?,?)",((r[0],r[1],r[2] if len(r) > 2 and r[2] else None) for r in rows))
+        return cur.rowcount
 
 def update_course(course_id, course_name, instructor_id):
-    conn = get_conn()
-    conn.execute("UPDATE courses SET course_name=?, instructor_id=? WHERE course_id=?",(course_name,instructor_id,course_id))
-    conn.commit()
-    conn.close()
+    with transaction("IMMEDIATE") as conn:
+        conn.execute("UPDATE courses SET course_name=?, instructor_id=? WHERE course_id=?",(course_name,instructor_id,course_id))
+
+def update_courses_many(rows):
+    with transaction("IMMEDIATE") as conn:
+        cur = conn.executemany("UPDATE courses SET course_name=?, instructor_id=? WHERE course_id=?",((r[1],r[2] if len(r) > 2 and r[2] else None,r[0]) for r in rows))
+        return cur.rowcount
+
+def set_course_instructor(course_id, instructor_id):
+    with transaction("IMMEDIATE") as conn:
+        return conn.execute("UPDATE courses SET instructor_id=? WHERE course_id=?",(instructor_id,course_id)).rowcount
 
 def delete_course(course_id):
-    conn = get_conn()
-    conn.execute("DELETE FROM courses WHERE course_id=?",(course_id,))
-    conn.commit()
-    conn.close()
+    with transaction("IMMEDIATE") as conn:
+        conn.execute("DELETE FROM courses WHERE course_id=?",(course_id,))
 
 def get_courses():
     conn = get_conn()
@@ -127,20 +724,41 @@ def get_courses():
     ORDER BY c.course_id
     """)
     rows = cur.fetchall()
-    conn.close()
     return rows
 
+def get_courses_page(after_id=None, limit=500, order_by="course_id", after_value=None):
+    return _page("courses", after_id, limit, order_by, after_value)
+
+def iter_courses(chunk_size=500, order_by="course_id"):
+    return _iter("courses", chunk_size, order_by)
+
+def count_courses():
+    return _count("courses")
+
+def get_courses_by_ids(ids):
+    return _rows_by("courses", ("course_id",), ids)
+
+def get_course(course_id):
+    return _get("courses", course_id)
+
+def course_exists(course_id):
+    return _exists("courses", course_id)
+
+def get_courses_by_instructor(instructor_id):
+    return _rows_by("courses", ("instructor_id",), (instructor_id,))
+
 def register_student(student_id, course_id):
-    conn = get_conn()
-    conn.execute("INSERT OR IGNORE INTO registrations(student_id,course_id) VALUES(?,?)",(student_id,course_id))
-    conn.commit()
-    conn.close()
+    with transaction("IMMEDIATE") as conn:
+        conn.execute("INSERT OR IGNORE INTO registrations(student_id,course_id) VALUES(?,?)",(student_id,course_id))
+
+def register_students_many(pairs):
+    with transaction("IMMEDIATE") as conn:
+        cur = conn.executemany("INSERT OR IGNORE INTO registrations(student_id,course_id) VALUES(?,?)",((r[0],r[1]) for r in pairs))
+        return cur.rowcount
 
 def unregister_student(student_id, course_id):
-    conn = get_conn()
-    conn.execute("DELETE FROM registrations WHERE student_id=? AND course_id=?",(student_id,course_id))
-    conn.commit()
-    conn.close()
+    with transaction("IMMEDIATE") as conn:
+        conn.execute("DELETE FROM registrations WHERE student_id=? AND course_id=?",(student_id,course_id))
 
 def get_registrations():
     conn = get_conn()
@@ -153,18 +771,69 @@ def get_registrations():
     ORDER BY r.student_id,r.course_id
     """)
     rows = cur.fetchall()
-    conn.close()
     return rows
 
-def search(term):
-    like = f"%{term}%"
+def get_registrations_page(after_key=None, limit=500, order_by="student_id", after_value=None):
+    return _page("registrations", after_key, limit, order_by, after_value)
+
+def iter_registrations(chunk_size=500, order_by="student_id"):
+    return _iter("registrations", chunk_size, order_by)
+
+def count_registrations():
+    return _count("registrations")
+
+def get_registrations_by_keys(keys):
+    return _rows_by("registrations", ("student_id", "course_id"), keys)
+
+def is_registered(student_id, course_id):
+    return _exists("registrations", (student_id, course_id))
+
+def get_registrations_by_student(student_id):
+    return _rows_by("registrations", ("student_id",), (student_id,))
+
+def get_registrations_by_course(course_id):
+    return _rows_by("registrations", ("course_id",), (course_id,))
+
+def _match_expr(term):
+    # every word becomes a quoted prefix token; tokens are ANDed together
+    return " ".join(f'"{t}"*' for t in re.findall(r"\w+", term))
+
+def search(term, limit=50):
+    limit = -1 if limit is None else limit
+    term = (term or "").strip()
+    match = _match_expr(term)
+    if term and not match:
+        return [], [], []
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT student_id,name,age,email FROM students WHERE student_id LIKE ? OR name LIKE ? OR email LIKE ?",(like,like,like))
+    if not match:
+        cur.execute("SELECT student_id,name,age,email FROM students ORDER BY student_id LIMIT ?",(limit,))
+        students = cur.fetchall()
+        cur.execute("SELECT instructor_id,name,age,email FROM instructors ORDER BY instructor_id LIMIT ?",(limit,))
+        instructors = cur.fetchall()
+        cur.execute("SELECT course_id,course_name,IFNULL(instructor_id,'') FROM courses ORDER BY course_id LIMIT ?",(limit,))
+        courses = cur.fetchall()
+        return students, instructors, courses
+    cur.execute("""
+    SELECT s.student_id,s.name,s.age,s.email
+    FROM students_fts f JOIN students s ON s.rowid=f.rowid
+    WHERE students_fts MATCH ? ORDER BY f.rank LIMIT ?
+    """,(match,limit))
     students = cur.fetchall()
-    cur.execute("SELECT instructor_id,name,age,email FROM instructors WHERE instructor_id LIKE ? OR name LIKE ? OR email LIKE ?",(like,like,like))
+    cur.execute("""
+    SELECT i.instructor_id,i.name,i.age,i.email
+    FROM instructors_fts f JOIN instructors i ON i.rowid=f.rowid
+    WHERE instructors_fts MATCH ? ORDER BY f.rank LIMIT ?
+    """,(match,limit))
     instructors = cur.fetchall()
-    cur.execute("SELECT course_id,course_name,IFNULL(instructor_id,'') FROM courses WHERE course_id LIKE ? OR course_name LIKE ?",(like,like))
+    cur.execute("""
+    SELECT c.course_id,c.course_name,IFNULL(c.instructor_id,'')
+    FROM courses_fts f JOIN courses c ON c.rowid=f.rowid
+    WHERE courses_fts MATCH ? ORDER BY f.rank LIMIT ?
+    """,(match,limit))
     courses = cur.fetchall()
-    conn.close()
     return students, instructors, courses
+
+# SCHOOL_DB_SLOW_MS=<ms> turns instrumentation on at import, e.g. in the field
+if os.environ.get("SCHOOL_DB_SLOW_MS"):
+    instrument(slow_ms=float(os.environ["SCHOOL_DB_SLOW_MS"]))
@@ -0,0 +1,35 @@
+import threading, logging
+from dataclasses import dataclass
+
+log = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class ChangeEvent:
+    entity: str   # "student", "instructor", "course" or "registration"
+    op: str       # "insert", "update" or "delete"
+    keys: tuple   # primary keys touched; (student_id, course_id) pairs for registrations
+
+_subscribers = []
+_lock = threading.Lock()
+
+def subscribe(callback, entities=None):
+    entry = (callback, frozenset(entities) if entities else None)
+    with _lock:
+        _subscribers.append(entry)
+    def unsubscribe():
+        with _lock:
+            if entry in _subscribers:
+                _subscribers.remove(entry)
+    return unsubscribe
+
+def publish(event):
+    # callbacks run synchronously on the publishing thread; a failing
+    # subscriber must not undo a write that has already committed
+    with _lock:
+        subscribers = list(_subscribers)
+    for callback, entities in subscribers:
+        if entities is None or event.entity in entities:
+            try:
+                callback(event)
+            except Exception:
+                log.exception("change subscriber %r failed", callback)
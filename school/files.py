@@ -0,0 +1,40 @@
+import os, stat, tempfile
+from contextlib import contextmanager
+
+# Atomic file replacement shared by the exports, backups and snapshots.
+#
+#   with replacing(path) as tmp:
+#       write the whole file to tmp
+#
+# tmp is a fresh file in the target's directory (unique, so concurrent
+# writers never share one). On success it is renamed over path; on any
+# error, including a cancel raised from a progress callback, it is removed
+# and an earlier file at path is left untouched.
+
+# read once: os.umask() can only be queried by setting it, which would race
+# with files other threads create
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+def _mode(path):
+    # keep the mode of the file being replaced, else what open() would give;
+    # mkstemp creates 0600 whatever the umask
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+@contextmanager
+def replacing(path, suffix=".tmp"):
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=folder, suffix=suffix)
+    os.close(fd)
+    try:
+        yield tmp
+        os.chmod(tmp, _mode(path))
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
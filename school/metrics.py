@@ -0,0 +1,119 @@
+import math, re, threading, time
+from collections import deque
+
+# Latency histogram with STEPS buckets per doubling from 1 µs up to about two
+# hours, so percentiles come out within ~10% at a fixed 1 KB per series.
+class Histogram:
+    STEPS = 4
+    SIZE = 33 * STEPS
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * self.SIZE
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        us = seconds * 1e6
+        i = int(math.log2(us) * self.STEPS) + 1 if us >= 1 else 0
+        self.counts[min(i, self.SIZE - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        # upper bound of the bucket holding the p-th percentile, in seconds
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                return min(self.max, 2 ** (i / self.STEPS) / 1e6)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1000,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "p50_ms": self.percentile(50) * 1000,
+            "p90_ms": self.percentile(90) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+_SPACE = re.compile(r"\s+")
+_ROWS = re.compile(r"\(\?(?:, ?\?)*\)(?:, ?\(\?(?:, ?\?)*\))+")
+_LIST = re.compile(r"\?(?:, ?\?)+")
+
+def normalize_sql(sql):
+    # one key per statement shape: whitespace collapsed and parameter lists
+    # of any length folded, so chunked IN (...) lookups share one series
+    sql = _SPACE.sub(" ", sql).strip()
+    return _LIST.sub("?...", _ROWS.sub("(?...)", sql))
+
+# Per-function and per-statement latency series plus a bounded log of slow
+# statements. Recording is thread-safe; stats() returns plain dicts.
+class QueryStats:
+    def __init__(self, slow_ms=100.0, slow_log_size=200):
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self._functions = {}
+        self._statements = {}
+        self._keys = {}
+        self._slow = deque(maxlen=slow_log_size)
+        self.started = time.time()
+
+    def statement_key(self, sql):
+        key = self._keys.get(sql)
+        if key is None:
+            key = normalize_sql(sql)
+            # raw texts differ per IN-list length; keep the memo bounded
+            if len(self._keys) < 4096:
+                self._keys[sql] = key
+        return key
+
+    def add_function(self, name, seconds):
+        with self._lock:
+            h = self._functions.get(name)
+            if h is None:
+                h = self._functions[name] = Histogram()
+            h.add(seconds)
+
+    def add_statement(self, sql, seconds):
+        key = self.statement_key(sql)
+        with self._lock:
+            h = self._statements.get(key)
+            if h is None:
+                h = self._statements[key] = Histogram()
+            h.add(seconds)
+        return key
+
+    def is_slow(self, seconds):
+        return self.slow_ms is not None and seconds * 1000 >= self.slow_ms
+
+    def add_slow(self, sql, seconds, plan):
+        with self._lock:
+            self._slow.append({"at": time.time(), "ms": seconds * 1000, "sql": self.statement_key(sql), "plan": plan})
+
+    def stats(self):
+        with self._lock:
+            return {
+                "since": self.started,
+                "slow_ms": self.slow_ms,
+                "functions": {k: h.summary() for k, h in self._functions.items()},
+                "statements": {k: h.summary() for k, h in self._statements.items()},
+                "slow": list(self._slow),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._functions.clear()
+            self._statements.clear()
+            self._slow.clear()
+            self.started = time.time()
@@ -1,25 +1,132 @@
+from array import array
+from bisect import bisect_left
 from dataclasses import dataclass, field
 from typing import List, Optional
+from . import db
 
-@dataclass
+@dataclass(slots=True)
 class Person:
     name: str
     age: int
     email: str
 
-@dataclass
+@dataclass(slots=True)
 class Student(Person):
     student_id: str
     registered_courses: List[str] = field(default_factory=list)
 
-@dataclass
+@dataclass(slots=True)
 class Instructor(Person):
     instructor_id: str
     assigned_courses: List[str] = field(default_factory=list)
 
-@dataclass
+@dataclass(slots=True)
 class Course:
     course_id: str
     course_name: str
     instructor_id: Optional[str] = None
     enrolled_students: List[str] = field(default_factory=list)
+
+# sqlite3 row factories for the db entity views (db.iter_rows and friends),
+# e.g. cursor.row_factory = student_row
+def student_row(cursor, row):
+    return Student(row[1], row[2], row[3], row[0])
+
+def instructor_row(cursor, row):
+    return Instructor(row[1], row[2], row[3], row[0])
+
+def course_row(cursor, row):
+    return Course(row[0], row[1], row[2])
+
+ROW_FACTORIES = {"students": student_row, "instructors": instructor_row, "courses": course_row}
+
+class _Strings:
+    # append-only string column: UTF-8 bytes in one buffer plus end offsets,
+    # about len(utf8) + 4 bytes per value instead of a str object each
+    __slots__ = ("data", "ends")
+
+    def __init__(self):
+        self.data = bytearray()
+        self.ends = array("I")
+
+    def append(self, s):
+        self.data += s.encode("utf-8")
+        if len(self.data) > 0xFFFFFFFF and self.ends.typecode == "I":
+            self.ends = array("Q", self.ends)
+        self.ends.append(len(self.data))
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("string column index out of range")
+        start = self.ends[i - 1] if i > 0 else 0
+        return self.data[start:self.ends[i]].decode("utf-8")
+
+    def nbytes(self):
+        return len(self.data) + self.ends.itemsize * len(self.ends)
+
+# Columnar in-memory student table for bulk work: one array of ages and
+# packed string columns instead of a tuple (or object) per row. Rows come
+# back as tuples or Student objects on demand.
+class StudentTable:
+    __slots__ = ("ids", "names", "ages", "emails", "_sorted")
+
+    def __init__(self, rows=()):
+        self.ids, self.names, self.emails = _Strings(), _Strings(), _Strings()
+        self.ages = array("i")
+        self._sorted = True
+        self.extend(rows)
+
+    @classmethod
+    def from_db(cls, chunk_size=5000):
+        return cls(db.iter_table("students", chunk_size))
+
+    def append(self, student_id, name, age, email):
+        if self._sorted and len(self.ids) and self.ids[len(self.ids) - 1] >= student_id:
+            self._sorted = False
+        self.ids.append(student_id)
+        self.names.append(name)
+        self.ages.append(int(age))
+        self.emails.append(email)
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(*row)
+
+    def __len__(self):
+        return len(self.ages)
+
+    def row(self, i):
+        return (self.ids[i], self.names[i], self.ages[i], self.emails[i])
+
+    def __getitem__(self, i):
+        return Student(self.names[i], self.ages[i], self.emails[i], self.ids[i])
+
+    def __iter__(self):
+        return (self.row(i) for i in range(len(self)))
+
+    def index(self, student_id):
+        # binary search while ids arrived in order (as from_db loads them)
+        if self._sorted:
+            i = bisect_left(self.ids, student_id)
+            if i < len(self.ids) and self.ids[i] == student_id:
+                return i
+            raise KeyError(student_id)
+        for i in range(len(self.ids)):
+            if self.ids[i] == student_id:
+                return i
+        raise KeyError(student_id)
+
+    def get(self, student_id):
+        try:
+            return self.row(self.index(student_id))
+        except KeyError:
+            return None
+
+    def nbytes(self):
+        return (self.ids.nbytes() + self.names.nbytes() + self.emails.nbytes()
+                + self.ages.itemsize * len(self.ages))
@@ -0,0 +1,139 @@
+import math, re
+from . import db
+
+# Declarative record schemas for the four tables, compiled once at import.
+# Rows are positional tuples in storage.FIELDS order. A batch is checked a
+# column at a time and comes back as a mask with one entry per row: None
+# for a valid row, else the reason it is rejected (the first failing field
+# wins). Foreign keys are resolved with one set-based lookup per reference.
+
+EMAIL = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+INTEGER = re.compile(r"\s*[+-]?\d+\s*")
+
+def valid_id(v):
+    # printable, no surrounding whitespace, at most 64 characters; string
+    # methods rather than a regex, which costs twice as much per value
+    return len(v) <= 64 and v.isprintable() and v.strip() == v
+
+def as_int(v):
+    # ints as given, integer strings and finite numbers truncated; else None.
+    # bool is an int subclass, but True is not an age
+    if type(v) is int:
+        return v
+    if isinstance(v, bool):
+        return None
+    if isinstance(v, str):
+        return int(v) if (v.isascii() and v.isdigit()) or INTEGER.fullmatch(v) else None
+    if isinstance(v, (int, float)) and math.isfinite(v):
+        return int(v)
+    return None
+
+class Field:
+    # kind str or int; min/max bound ints; check(value) -> bool further
+    # restricts non-empty strings; ref names the table a value must exist in
+    def __init__(self, name, kind=str, required=True, min=None, max=None, check=None, ref=None,
+                 missing=None, invalid=None, unknown=None):
+        self.name, self.kind, self.required = name, kind, required
+        self.min, self.max, self.check, self.ref = min, max, check, ref
+        self.invalid = invalid or f"invalid {name}"
+        self.missing = missing or (self.invalid if kind is int else f"missing {name}")
+        self.unknown = unknown or f"unknown {ref}"
+
+    def errors(self, col):
+        # (position, reason) for the values of one column that fail; each
+        # check is one comprehension over the column, reasons are only
+        # worked out for the failures
+        if self.kind is int:
+            lo, hi = self.min, self.max
+            ints = [v if type(v) is int else as_int(v) for v in col]
+            bad = [k for k, n in enumerate(ints)
+                   if n is None or (lo is not None and n < lo) or (hi is not None and n > hi)]
+        elif not self.required:
+            # empty optional values are NULL; present ones must be strings
+            bad = [k for k, v in enumerate(col) if v and type(v) is not str]
+        elif self.check:
+            check = self.check
+            bad = [k for k, v in enumerate(col) if type(v) is not str or not v or not check(v)]
+        else:
+            bad = [k for k, v in enumerate(col) if not v or type(v) is not str]
+        return [(k, self.missing if col[k] is None or col[k] == "" else self.invalid) for k in bad]
+
+class Schema:
+    def __init__(self, table, fields, arity=None):
+        self.table = table
+        self.fields = tuple(fields)
+        self.arity = tuple(arity or (len(self.fields),))
+        self.wrong_arity = f"expected {' or '.join(map(str, self.arity))} fields"
+        self.refs = tuple((j, f) for j, f in enumerate(self.fields) if f.ref)
+
+    def check_fields(self, rows):
+        mask = [None] * len(rows)
+        ok = []
+        for i, row in enumerate(rows):
+            if isinstance(row, (tuple, list)) and len(row) in self.arity:
+                ok.append(i)
+            else:
+                mask[i] = self.wrong_arity
+        if not ok:
+            return mask
+        picked = [rows[i] for i in ok]
+        for j, field in enumerate(self.fields):
+            if j < min(self.arity):
+                col = [r[j] for r in picked]
+            else:
+                # short rows (a course without instructor column) read as None
+                col = [r[j] if len(r) > j else None for r in picked]
+            for k, reason in field.errors(col):
+                if mask[ok[k]] is None:
+                    mask[ok[k]] = reason
+        return mask
+
+    def check_refs(self, rows, mask):
+        # one existence query per referenced table, over the distinct values
+        # of the rows still valid; call inside the writing transaction so
+        # parents written earlier in it are seen
+        for j, field in self.refs:
+            values = {rows[i][j] for i in range(len(rows)) if mask[i] is None and len(rows[i]) > j and rows[i][j]}
+            if not values:
+                continue
+            found = db.existing_keys(field.ref, values)
+            for i, row in enumerate(rows):
+                if mask[i] is None and len(row) > j and row[j] and row[j] not in found:
+                    mask[i] = field.unknown
+        return mask
+
+    def validate(self, rows):
+        rows = rows if isinstance(rows, list) else list(rows)
+        return self.check_refs(rows, self.check_fields(rows))
+
+    def check(self, row):
+        return self.validate([row])[0]
+
+    def require(self, row):
+        error = self.check(row)
+        if error:
+            raise ValueError(error)
+
+def _person(table, key):
+    return Schema(table, (
+        Field(key, check=valid_id, missing="missing id", invalid="invalid id"),
+        Field("name"),
+        # bounded so a huge value is rejected here, not as an overflow
+        # from sqlite that aborts the whole batch
+        Field("age", int, min=0, max=150),
+        Field("email", check=EMAIL.fullmatch, missing="invalid email"),
+    ))
+
+SCHEMAS = {
+    "students": _person("students", "student_id"),
+    "instructors": _person("instructors", "instructor_id"),
+    "courses": Schema("courses", (
+        Field("course_id", check=valid_id, missing="missing id", invalid="invalid id"),
+        Field("course_name", missing="missing course name"),
+        Field("instructor_id", required=False, ref="instructors", unknown="unknown instructor"),
+    ), arity=(2, 3)),
+    "registrations": Schema("registrations", (
+        Field("student_id", check=valid_id, missing="missing id", invalid="invalid id", ref="students", unknown="unknown student"),
+        Field("course_id", check=valid_id, missing="missing id", invalid="invalid id", ref="courses", unknown="unknown course"),
+    )),
+}
@@ -1,63 +1,162 @@
-from . import db, validators
+from . import db, events
+from .schema import SCHEMAS
+from .cache import ReadCache
+from .events import ChangeEvent
+
+_cache = ReadCache()
+# local writes drop cached reads of the entity they touched
+events.subscribe(lambda ev: _cache.invalidate(ev.entity))
+
+def _publish(entity, op, *keys):
+    # delivered after the surrounding transaction commits, never on rollback
+    event = ChangeEvent(entity, op, tuple(keys))
+    db.after_commit(lambda: events.publish(event))
 
 def add_student(student_id, name, age, email):
-    if not validators.non_negative_age(age):
-        raise ValueError("invalid age")
-    if not validators.valid_email(email):
-        raise ValueError("invalid email")
+    SCHEMAS["students"].require((student_id, name, age, email))
     db.insert_student(student_id, name, age, email)
+    _publish("student", "insert", student_id)
 
 def edit_student(student_id, name, age, email):
-    if not validators.non_negative_age(age):
-        raise ValueError("invalid age")
-    if not validators.valid_email(email):
-        raise ValueError("invalid email")
+    SCHEMAS["students"].require((student_id, name, age, email))
     db.update_student(student_id, name, age, email)
+    _publish("student", "update", student_id)
 
 def remove_student(student_id):
     db.delete_student(student_id)
+    _publish("student", "delete", student_id)
 
 def add_instructor(instructor_id, name, age, email):
-    if not validators.non_negative_age(age):
-        raise ValueError("invalid age")
-    if not validators.valid_email(email):
-        raise ValueError("invalid email")
+    SCHEMAS["instructors"].require((instructor_id, name, age, email))
     db.insert_instructor(instructor_id, name, age, email)
+    _publish("instructor", "insert", instructor_id)
 
 def edit_instructor(instructor_id, name, age, email):
-    if not validators.non_negative_age(age):
-        raise ValueError("invalid age")
-    if not validators.valid_email(email):
-        raise ValueError("invalid email")
+    SCHEMAS["instructors"].require((instructor_id, name, age, email))
     db.update_instructor(instructor_id, name, age, email)
+    _publish("instructor", "update", instructor_id)
 
 def remove_instructor(instructor_id):
     db.delete_instructor(instructor_id)
+    _publish("instructor", "delete", instructor_id)
 
 def add_course(course_id, course_name, instructor_id=None):
-    db.insert_course(course_id, course_name, instructor_id if instructor_id else None)
+    instructor_id = instructor_id if instructor_id else None
+    SCHEMAS["courses"].require((course_id, course_name, instructor_id))
+    db.insert_course(course_id, course_name, instructor_id)
+    _publish("course", "insert", course_id)
 
 def edit_course(course_id, course_name, instructor_id):
-    db.update_course(course_id, course_name, instructor_id if instructor_id else None)
+    instructor_id = instructor_id if instructor_id else None
+    SCHEMAS["courses"].require((course_id, course_name, instructor_id))
+    db.update_course(course_id, course_name, instructor_id)
+    _publish("course", "update", course_id)
 
 def remove_course(course_id):
     db.delete_course(course_id)
+    _publish("course", "delete", course_id)
 
 def assign_instructor(course_id, instructor_id):
-    rows = db.get_courses()
-    found = [x for x in rows if x[0]==course_id]
-    if not found:
+    if not db.set_course_instructor(course_id, instructor_id):
         raise ValueError("course not found")
-    db.update_course(course_id, found[0][1], instructor_id)
+    _publish("course", "update", course_id)
 
 def register(student_id, course_id):
+    SCHEMAS["registrations"].require((student_id, course_id))
     db.register_student(student_id, course_id)
+    _publish("registration", "insert", (student_id, course_id))
 
 def unregister(student_id, course_id):
     db.unregister_student(student_id, course_id)
+    _publish("registration", "delete", (student_id, course_id))
+
+def list_students():
+    return _cache.get(("students",), ("student",), db.get_students)
+
+def list_instructors():
+    return _cache.get(("instructors",), ("instructor",), db.get_instructors)
+
+def list_courses():
+    return _cache.get(("courses",), ("course", "instructor"), db.get_courses)
+
+def list_registrations():
+    return _cache.get(("registrations",), ("registration", "student", "course"), db.get_registrations)
+
+def get_student(student_id):
+    return _cache.get(("student", student_id), ("student",), lambda: db.get_student(student_id))
+
+def get_instructor(instructor_id):
+    return _cache.get(("instructor", instructor_id), ("instructor",), lambda: db.get_instructor(instructor_id))
+
+def get_course(course_id):
+    return _cache.get(("course", course_id), ("course", "instructor"), lambda: db.get_course(course_id))
 
 def snapshot():
-    return db.get_students(), db.get_instructors(), db.get_courses(), db.get_registrations()
+    return list_students(), list_instructors(), list_courses(), list_registrations()
+
+def query(term, limit=50):
+    return _cache.get(("query", term, limit), ("student", "instructor", "course"), lambda: db.search(term, limit))
+
+def cache_stats():
+    return _cache.stats()
+
+def clear_cache():
+    _cache.clear()
+
+_ENTITY = {"students": "student", "instructors": "instructor", "courses": "course", "registrations": "registration"}
+
+def _bulk(table, rows, insert_many, key=lambda r: r[0], update_many=None):
+    # rows are checked column-wise against the table schema, then foreign and
+    # existing keys are resolved with set-based lookups and the survivors
+    # written in one executemany; with update_many, rows whose key exists
+    # update it instead of being rejected
+    result = {"inserted": 0, "updated": 0, "duplicate": 0, "invalid": 0, "rejected": []}
+    def reject(n, outcome, reason):
+        result[outcome] += 1
+        result["rejected"].append((n, reason))
+    rows = rows if isinstance(rows, list) else list(rows)
+    schema = SCHEMAS[table]
+    mask = schema.check_fields(rows)
+    with db.transaction("IMMEDIATE"):
+        schema.check_refs(rows, mask)
+        candidates = []
+        for n, error in enumerate(mask):
+            if error:
+                reject(n, "invalid", error)
+            else:
+                candidates.append((n, rows[n]))
+        existing = db.existing_keys(table, [key(r) for _, r in candidates])
+        fresh, changed, seen = [], [], set()
+        for n, row in candidates:
+            if key(row) in existing or key(row) in seen:
+                if update_many:
+                    changed.append(row)
+                else:
+                    reject(n, "duplicate", "already exists")
+            else:
+                seen.add(key(row))
+                fresh.append(row)
+        if fresh:
+            result["inserted"] = insert_many(fresh)
+            _publish(_ENTITY[table], "insert", *(key(r) for r in fresh))
+        if changed:
+            # applied in input order, so the last row for a key wins
+            result["updated"] = update_many(changed)
+            _publish(_ENTITY[table], "update", *dict.fromkeys(key(r) for r in changed))
+    result["rejected"].sort()
+    return result
+
+def add_students_bulk(rows, upsert=False):
+    return _bulk("students", rows, db.insert_students_many,
+                 update_many=db.update_students_many if upsert else None)
+
+def add_instructors_bulk(rows, upsert=False):
+    return _bulk("instructors", rows, db.insert_instructors_many,
+                 update_many=db.update_instructors_many if upsert else None)
+
+def add_courses_bulk(rows, upsert=False):
+    return _bulk("courses", rows, db.insert_courses_many,
+                 update_many=db.update_courses_many if upsert else None)
 
-def query(term):
-    return db.search(term)
+def register_bulk(pairs):
+    return _bulk("registrations", pairs, db.register_students_many, key=lambda r: (r[0], r[1]))
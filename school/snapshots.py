@@ -0,0 +1,175 @@
+import os, json, time, zlib, hashlib, tempfile
+from datetime import datetime, timezone
+from . import db
+from .files import replacing
+
+# Content-addressed snapshot store for the database file.
+#
+# A snapshot is a consistent copy taken with db.backup_db, cut into
+# fixed-size chunks aligned to the page size. Each chunk is stored once,
+# zlib-compressed, under its BLAKE2b hash; the snapshot itself is just a
+# manifest listing chunk hashes. SQLite rewrites pages in place, so an
+# hourly snapshot of a mostly unchanged database only adds the chunks that
+# hold changed pages.
+#
+# Layout:  root/chunks/ab/<hash>   root/manifests/<id>.json
+class SnapshotStore:
+    def __init__(self, root, chunk_size=64 * 1024, level=6):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.level = level
+        self.chunks_dir = os.path.join(root, "chunks")
+        self.manifests_dir = os.path.join(root, "manifests")
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        os.makedirs(self.manifests_dir, exist_ok=True)
+
+    def _chunk_path(self, digest):
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def _write_atomic(self, path, data):
+        with replacing(path) as tmp, open(tmp, "wb") as f:
+            f.write(data)
+
+    def _put(self, data):
+        digest = hashlib.blake2b(data, digest_size=32).hexdigest()
+        path = self._chunk_path(digest)
+        if os.path.exists(path):
+            # refresh the mtime so a concurrent prune's grace period covers it
+            os.utime(path)
+            return digest, 0
+        blob = zlib.compress(data, self.level)
+        self._write_atomic(path, blob)
+        return digest, len(blob)
+
+    def _get(self, digest):
+        with open(self._chunk_path(digest), "rb") as f:
+            data = zlib.decompress(f.read())
+        if hashlib.blake2b(data, digest_size=32).hexdigest() != digest:
+            raise ValueError(f"chunk {digest} is corrupt")
+        return data
+
+    def create(self, note=None, verify=True):
+        # a unique name, so concurrent creates from pool threads never share it
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix="snapshot-", suffix=".db.tmp")
+        os.close(fd)
+        try:
+            db.backup_db(tmp, verify=verify)
+            conn = db.get_conn()
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            # whole pages per chunk, so a changed page never shifts its neighbours
+            step = max(page_size, self.chunk_size // page_size * page_size)
+            chunks, size, added = [], 0, 0
+            with open(tmp, "rb") as f:
+                while True:
+                    data = f.read(step)
+                    if not data:
+                        break
+                    digest, stored = self._put(data)
+                    chunks.append(digest)
+                    size += len(data)
+                    added += stored
+        finally:
+            os.remove(tmp)
+        created = datetime.now(timezone.utc)
+        manifest = {
+            "id": created.strftime("%Y%m%dT%H%M%S%fZ"),
+            "created": created.isoformat(),
+            "note": note,
+            "size": size,
+            "chunk_size": step,
+            "page_size": page_size,
+            "user_version": version,
+            "chunks": chunks,
+            "added_bytes": added,
+        }
+        self._write_atomic(os.path.join(self.manifests_dir, manifest["id"] + ".json"),
+                           json.dumps(manifest).encode("utf-8"))
+        return manifest
+
+    def manifest(self, snapshot_id):
+        path = os.path.join(self.manifests_dir, snapshot_id + ".json")
+        if not os.path.exists(path):
+            raise LookupError(f"no snapshot {snapshot_id!r}")
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def list(self):
+        out = []
+        for name in sorted(os.listdir(self.manifests_dir)):
+            if name.endswith(".json"):
+                m = self.manifest(name[:-5])
+                m.pop("chunks")
+                out.append(m)
+        return out
+
+    def restore(self, snapshot_id, dst_path=None):
+        m = self.manifest(snapshot_id)
+        dst_path = dst_path or db.DB_PATH
+        with replacing(dst_path, suffix=".restore") as tmp:
+            with open(tmp, "wb") as f:
+                for digest in m["chunks"]:
+                    f.write(self._get(digest))
+            if os.path.abspath(dst_path) == os.path.abspath(db.DB_PATH):
+                db.close_all()
+        # a WAL left over from the replaced file would be replayed onto the restored one
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(dst_path + suffix):
+                os.remove(dst_path + suffix)
+        return m
+
+    def prune(self, keep_last=0, hourly=0, daily=0, weekly=0, monthly=0, grace=3600):
+        # keep the newest `keep_last` snapshots plus the newest snapshot in each
+        # of the last N hours/days/weeks/months that have one; the newest
+        # snapshot always survives, and without any rule nothing is pruned
+        if max(keep_last, hourly, daily, weekly, monthly) <= 0:
+            raise ValueError("prune needs at least one retention rule")
+        snaps = sorted(self.list(), key=lambda m: m["created"], reverse=True)
+        keep = {m["id"] for m in snaps[:max(keep_last, 1)]}
+        rules = ((hourly, "%Y%m%d%H"), (daily, "%Y%m%d"), (weekly, "%G%V"), (monthly, "%Y%m"))
+        for count, fmt in rules:
+            buckets = set()
+            for m in snaps:
+                if len(buckets) >= count:
+                    break
+                bucket = datetime.fromisoformat(m["created"]).strftime(fmt)
+                if bucket not in buckets:
+                    buckets.add(bucket)
+                    keep.add(m["id"])
+        removed = [m["id"] for m in snaps if m["id"] not in keep]
+        for snapshot_id in removed:
+            os.remove(os.path.join(self.manifests_dir, snapshot_id + ".json"))
+        return {"removed": removed, **self.collect_garbage(grace)}
+
+    def collect_garbage(self, grace=3600):
+        # chunks touched within `grace` seconds may belong to a snapshot that
+        # is still being written, so they survive until a later sweep
+        live = set()
+        for name in os.listdir(self.manifests_dir):
+            if name.endswith(".json"):
+                live.update(self.manifest(name[:-5])["chunks"])
+        cutoff = time.time() - grace
+        freed = chunks = 0
+        for sub in os.listdir(self.chunks_dir):
+            folder = os.path.join(self.chunks_dir, sub)
+            for digest in os.listdir(folder):
+                path = os.path.join(folder, digest)
+                if digest in live:
+                    continue
+                st = os.stat(path)
+                if st.st_mtime < cutoff:
+                    os.remove(path)
+                    freed += st.st_size
+                    chunks += 1
+        return {"freed_chunks": chunks, "freed_bytes": freed}
+
+    def stats(self):
+        chunks = stored = 0
+        for sub in os.listdir(self.chunks_dir):
+            folder = os.path.join(self.chunks_dir, sub)
+            for digest in os.listdir(folder):
+                chunks += 1
+                stored += os.path.getsize(os.path.join(folder, digest))
+        snaps = self.list()
+        return {"snapshots": len(snaps), "chunks": chunks, "stored_bytes": stored,
+                "logical_bytes": sum(m["size"] for m in snaps)}
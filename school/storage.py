@@ -1,40 +1,242 @@
 import json, os
-from . import db
-
-def export_json(path):
-    s = db.get_students()
-    i = db.get_instructors()
-    c = db.get_courses()
-    r = db.get_registrations()
-    obj = {"students":[{"student_id":x[0],"name":x[1],"age":x[2],"email":x[3]} for x in s],
-           "instructors":[{"instructor_id":x[0],"name":x[1],"age":x[2],"email":x[3]} for x in i],
-           "courses":[{"course_id":x[0],"course_name":x[1],"instructor_id":x[2]} for x in c],
-           "registrations":[{"student_id":x[0],"course_id":x[2]} for x in r]}
-    with open(path,"w",encoding="utf-8") as f:
-        json.dump(obj,f,indent=2)
-
-def import_json(path):
+from . import db, services
+from .files import replacing
+
+# field order matches the positional rows the bulk services take
+FIELDS = {
+    "students": ("student_id", "name", "age", "email"),
+    "instructors": ("instructor_id", "name", "age", "email"),
+    "courses": ("course_id", "course_name", "instructor_id"),
+    "registrations": ("student_id", "course_id"),
+}
+# (table, column) pairs that may be missing or null
+OPTIONAL = {("courses", "instructor_id")}
+BULK = {
+    "students": services.add_students_bulk,
+    "instructors": services.add_instructors_bulk,
+    "courses": services.add_courses_bulk,
+    "registrations": services.register_bulk,
+}
+
+def _write_records(f, fmt, chunk_size, progress):
+    counts = {}
+    sep = ""
+    # json.dumps escapes non-ASCII, so characters written equal bytes written
+    size = total = 0
+
+    def write(s):
+        nonlocal size
+        f.write(s)
+        size += len(s)
+
+    if fmt == "json":
+        write("{")
+    for table, names in FIELDS.items():
+        n = 0
+        if fmt == "json":
+            write(f'{sep}"{table}":[')
+            sep = ",\n"
+        for row in db.iter_table(table, chunk_size):
+            rec = dict(zip(names, row))
+            if fmt == "ndjson":
+                write(json.dumps({"table": table, **rec}, separators=(",", ":")) + "\n")
+            else:
+                write(("\n" if n == 0 else ",\n") + json.dumps(rec, separators=(",", ":")))
+            n += 1
+            total += 1
+            if progress and total % chunk_size == 0:
+                progress(total, size)
+        if fmt == "json":
+            write("\n]" if n else "]")
+        counts[table] = n
+    if fmt == "json":
+        write("}\n")
+    if progress:
+        progress(total, size)
+    return counts
+
+def export_json(path, fmt=None, chunk_size=1000, progress=None):
+    # progress(rows, bytes) is called every chunk_size rows; raising from it aborts the export
+    if fmt is None:
+        fmt = "ndjson" if isinstance(path, str) and path.endswith((".ndjson", ".jsonl")) else "json"
+    if fmt not in ("json", "ndjson"):
+        raise ValueError(f"unknown export format {fmt!r}")
+    # one read transaction gives every table the same point-in-time view
+    with db.transaction():
+        if hasattr(path, "write"):
+            return _write_records(path, fmt, chunk_size, progress)
+        with replacing(path) as tmp, open(tmp, "w", encoding="utf-8") as f:
+            return _write_records(f, fmt, chunk_size, progress)
+
+_decoder = json.JSONDecoder()
+_WS = " \t\r\n"
+
+class _Malformed(ValueError):
+    def __init__(self, offset, msg):
+        super().__init__(f"byte {offset}: malformed JSON ({msg})")
+        self.offset = offset
+
+class _Reader:
+    # pulls one JSON value at a time out of a file, keeping only the
+    # unconsumed tail of the last chunk in memory; `base` is the byte offset
+    # of buf[0] in the file, for error positions
+    def __init__(self, f, chunk_size, max_value=1 << 20):
+        self.f, self.chunk_size, self.max_value = f, chunk_size, max_value
+        self.buf, self.pos, self.base = "", 0, 0
+
+    def fill(self):
+        data = self.f.read(self.chunk_size)
+        if not data:
+            return False
+        self.base += len(self.buf[:self.pos].encode("utf-8"))
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def offset(self, pos=None):
+        return self.base + len(self.buf[:self.pos if pos is None else pos].encode("utf-8"))
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WS:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def take(self, allowed):
+        c = self.peek()
+        if c not in allowed or not c:
+            raise _Malformed(self.offset(), f"expected one of {allowed!r}, got {c or 'EOF'!r}")
+        self.pos += 1
+        return c
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as ex:
+                # more input only helps a value cut off at the chunk edge; a
+                # value still failing past max_value characters is malformed,
+                # so a bad record never pulls the rest of the file into memory
+                if len(self.buf) - self.pos > self.max_value or not self.fill():
+                    raise _Malformed(self.offset(ex.pos), ex.msg) from None
+                continue
+            # a number ending exactly at the buffer edge may continue in the next chunk
+            if end == len(self.buf) and self.fill():
+                continue
+            self.pos = end
+            return obj
+
+def _iter_document(f, chunk_size):
+    r = _Reader(f, chunk_size)
+    r.take("{")
+    if r.peek() == "}":
+        return
+    while True:
+        key = r.value()
+        r.take(":")
+        if r.peek() == "[":
+            r.take("[")
+            if r.peek() == "]":
+                r.take("]")
+            else:
+                while True:
+                    yield key, r.value(), None
+                    if r.take(",]") == "]":
+                        break
+        else:
+            r.value()
+        if r.take(",}") == "}":
+            break
+
+def _iter_ndjson(f):
+    for n, line in enumerate(f):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            rec = json.loads(line)
+        except json.JSONDecodeError as ex:
+            yield None, line, f"line {n + 1}: malformed JSON ({ex.msg})"
+            continue
+        if not isinstance(rec, dict):
+            yield None, rec, f"line {n + 1}: not an object"
+            continue
+        yield rec.pop("table", None), rec, None
+
+def _to_row(table, rec):
+    if not isinstance(rec, dict):
+        return None, "record is not an object"
+    for name in FIELDS[table]:
+        if name not in rec and (table, name) not in OPTIONAL:
+            return None, f"missing field {name!r}"
+    return tuple(rec.get(name) for name in FIELDS[table]), None
+
+def import_json(path, batch_size=1000, fmt=None, max_rejected=10000, progress=None):
+    # progress(rows, bytes_read) is called after each committed batch; raising
+    # from it stops the import, keeping the batches already committed
     if not os.path.exists(path):
         return
+    if fmt is None:
+        fmt = "ndjson" if path.endswith((".ndjson", ".jsonl")) else "json"
     db.init_db()
-    data = json.load(open(path,"r",encoding="utf-8"))
-    for x in data.get("students",[]):
-        try:
-            db.insert_student(x["student_id"],x["name"],x["age"],x["email"])
-        except:
-            pass
-    for x in data.get("instructors",[]):
-        try:
-            db.insert_instructor(x["instructor_id"],x["name"],x["age"],x["email"])
-        except:
-            pass
-    for x in data.get("courses",[]):
-        try:
-            db.insert_course(x["course_id"],x["course_name"],x.get("instructor_id"))
-        except:
-            pass
-    for x in data.get("registrations",[]):
+    report = {t: {"inserted": 0, "duplicate": 0, "invalid": 0} for t in FIELDS}
+    report["rejected"] = []
+    report["rejected_total"] = 0
+    pending = {t: [] for t in FIELDS}
+    counters = {t: 0 for t in FIELDS}
+    seen = 0
+
+    def reject(table, index, rec, reason):
+        report["rejected_total"] += 1
+        if len(report["rejected"]) < max_rejected:
+            report["rejected"].append({"table": table, "index": index, "record": rec, "reason": reason})
+
+    def flush():
+        # tables are flushed in dependency order so a batch can reference
+        # parents that arrived in the same batch
+        with db.transaction("IMMEDIATE"):
+            for table in FIELDS:
+                batch = pending[table]
+                if not batch:
+                    continue
+                result = BULK[table]([row for _, _, row in batch])
+                for key in ("inserted", "duplicate", "invalid"):
+                    report[table][key] += result[key]
+                for n, reason in result["rejected"]:
+                    reject(table, batch[n][0], batch[n][1], reason)
+                pending[table] = []
+        if progress:
+            progress(seen, f.buffer.tell())
+
+    with open(path, "r", encoding="utf-8") as f:
+        records = _iter_ndjson(f) if fmt == "ndjson" else _iter_document(f, 1 << 16)
+        size = 0
         try:
-            db.register_student(x["student_id"],x["course_id"])
-        except:
-            pass
+            for table, rec, error in records:
+                seen += 1
+                if error or table not in FIELDS:
+                    reject(table, None, rec, error or f"unknown table {table!r}")
+                    continue
+                index = counters[table]
+                counters[table] += 1
+                row, error = _to_row(table, rec)
+                if error:
+                    report[table]["invalid"] += 1
+                    reject(table, index, rec, error)
+                    continue
+                pending[table].append((index, rec, row))
+                size += 1
+                if size >= batch_size:
+                    flush()
+                    size = 0
+        except _Malformed as ex:
+            # a broken document cannot be resynchronised; keep what was read
+            # before the damage and report where it stopped
+            report["error"] = f"{ex}; import stopped"
+            reject(None, None, None, report["error"])
+        flush()
+    return report
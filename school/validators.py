@@ -1,10 +1,11 @@
-import re
+from .schema import EMAIL, as_int
+
+# single-value checks, kept for callers outside the package; records are
+# validated through schema.SCHEMAS
 
 def valid_email(s: str) -> bool:
-    return bool(re.match(r"^[^@\s]+@[^@\s]+\.[^@\s]+$", s))
+    return isinstance(s, str) and EMAIL.fullmatch(s) is not None
 
 def non_negative_age(a: int) -> bool:
-    try:
-        return int(a) >= 0
-    except:
-        return False
+    n = as_int(a)
+    return n is not None and n >= 0